@@ -0,0 +1,199 @@
+"""
+Count the calls Flintrock makes to AWS APIs, and how they went.
+
+We hook into botocore's event system, so every call gets counted, including
+the ones boto3 resources make behind the scenes when we read an attribute
+that hasn't been loaded yet, and the ones in polling loops. botocore's own
+retries are counted separately from the calls they retry.
+
+Stats collection is off until enable() is called.
+"""
+import collections
+import threading
+import time
+
+# The upper bounds, in seconds, of the buckets in each operation's latency
+# histogram. Slower calls go in a final, unbounded bucket.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Error codes AWS uses to tell us we're calling it too fast. These are EC2's,
+# like in ec2_gateway, plus S3's.
+THROTTLING_ERROR_CODES = {
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+    'SlowDown',
+}
+
+
+class OperationStats:
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        self.errors = 0
+        self.latencies = []
+
+    def get_histogram(self) -> 'collections.OrderedDict[str, int]':
+        histogram = collections.OrderedDict(
+            ('<= {b}s'.format(b=bound), 0) for bound in LATENCY_BUCKETS)
+        histogram['> {b}s'.format(b=LATENCY_BUCKETS[-1])] = 0
+        labels = list(histogram)
+        for latency in self.latencies:
+            bucket = next(
+                (i for (i, bound) in enumerate(LATENCY_BUCKETS) if latency <= bound),
+                len(LATENCY_BUCKETS))
+            histogram[labels[bucket]] += 1
+        return histogram
+
+    def get_percentile(self, percentile: float) -> float:
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+
+class ApiStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operations = collections.defaultdict(OperationStats)
+        # botocore makes each call, retries included, on the thread that
+        # started it, so that's where we keep track of the call in progress.
+        # Older versions of botocore don't pass the call's context on to
+        # needs-retry handlers.
+        self._current_call = threading.local()
+
+    def register(self, events):
+        """
+        Start counting the calls made by clients on the provided botocore
+        event emitter, like a boto3 session's events.
+        """
+        events.register(
+            'before-call', self._before_call, unique_id='flintrock-api-stats-before-call')
+        events.register(
+            'needs-retry', self._needs_retry, unique_id='flintrock-api-stats-needs-retry')
+        events.register(
+            'after-call', self._after_call, unique_id='flintrock-api-stats-after-call')
+        # Only newer versions of botocore tell us about calls that fail without
+        # a response.
+        events.register(
+            'after-call-error', self._after_call_error,
+            unique_id='flintrock-api-stats-after-call-error')
+
+    def _before_call(self, context, **kwargs):
+        call = {
+            'start': time.monotonic(),
+            'attempts': 0,
+            'throttles': 0,
+        }
+        context['flintrock_api_stats'] = call
+        self._current_call.call = call
+
+    def _needs_retry(self, attempts, response=None, **kwargs):
+        # This is called after every attempt at a call, whether or not it
+        # gets retried.
+        call = getattr(self._current_call, 'call', None)
+        if call is None:
+            return
+        call['attempts'] = attempts
+        if response is not None:
+            (http_response, parsed) = response
+            if parsed.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+                call['throttles'] += 1
+
+    def _after_call(self, model, context, parsed, **kwargs):
+        self._record(model=model, context=context, failed='Error' in parsed)
+
+    def _after_call_error(self, model, context, **kwargs):
+        self._record(model=model, context=context, failed=True)
+
+    def _record(self, *, model, context: dict, failed: bool):
+        call = context.pop('flintrock_api_stats', None)
+        if call is None:
+            return
+        if getattr(self._current_call, 'call', None) is call:
+            self._current_call.call = None
+        name = '{s}.{o}'.format(s=model.service_model.endpoint_prefix, o=model.name)
+
+        with self._lock:
+            operation = self.operations[name]
+            operation.calls += 1
+            operation.retries += max(0, call['attempts'] - 1)
+            operation.throttles += call['throttles']
+            operation.errors += int(failed)
+            operation.latencies.append(time.monotonic() - call['start'])
+
+    def get_stats(self) -> dict:
+        """
+        Get the stats for each operation in a form that can be serialized to
+        JSON. Latencies are in seconds.
+        """
+        with self._lock:
+            return {
+                name: {
+                    'calls': operation.calls,
+                    'retries': operation.retries,
+                    'throttles': operation.throttles,
+                    'errors': operation.errors,
+                    'latency_p50': operation.get_percentile(50),
+                    'latency_p95': operation.get_percentile(95),
+                    'latency_max': max(operation.latencies),
+                    'latency_histogram': operation.get_histogram(),
+                }
+                for (name, operation) in self.operations.items()}
+
+    def format_summary(self) -> str:
+        stats = self.get_stats()
+        lines = [
+            '{o:<40} {c:>6} {r:>8} {t:>10} {e:>7} {p50:>9} {p95:>9} {m:>9}'.format(
+                o='AWS API operation', c='calls', r='retries', t='throttles', e='errors',
+                p50='p50 (ms)', p95='p95 (ms)', m='max (ms)')]
+        for (name, operation) in sorted(stats.items()):
+            lines.append(
+                '{o:<40} {c:>6} {r:>8} {t:>10} {e:>7} {p50:>9.0f} {p95:>9.0f} {m:>9.0f}'.format(
+                    o=name,
+                    c=operation['calls'],
+                    r=operation['retries'],
+                    t=operation['throttles'],
+                    e=operation['errors'],
+                    p50=operation['latency_p50'] * 1000,
+                    p95=operation['latency_p95'] * 1000,
+                    m=operation['latency_max'] * 1000))
+        lines.append(
+            '{o:<40} {c:>6} {r:>8} {t:>10} {e:>7}'.format(
+                o='total',
+                c=sum(o['calls'] for o in stats.values()),
+                r=sum(o['retries'] for o in stats.values()),
+                t=sum(o['throttles'] for o in stats.values()),
+                e=sum(o['errors'] for o in stats.values())))
+        return '\n'.join(lines)
+
+
+_stats = None
+
+
+def enable():
+    """
+    Start collecting stats. Clients created afterwards through register_session(),
+    and clients on boto3's default session, get counted.
+    """
+    global _stats
+    if _stats is None:
+        _stats = ApiStats()
+
+        import boto3
+        boto3.setup_default_session()
+        _stats.register(boto3.DEFAULT_SESSION.events)
+
+
+def register_session(session):
+    """
+    Count the calls made by clients and resources from the provided boto3
+    session, if stats collection is enabled.
+    """
+    if _stats is not None:
+        _stats.register(session.events)
+
+
+def get_stats() -> ApiStats:
+    return _stats
@@ -0,0 +1,285 @@
+import collections
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# Flintrock modules
+from .exceptions import Error
+
+# Apache keeps every release in its archive, which is where we get published
+# digests from.
+APACHE_ARCHIVE = 'https://archive.apache.org/dist/'
+
+DEFAULT_HADOOP_DOWNLOAD_SOURCE = \
+    'http://www.apache.org/dyn/closer.lua/hadoop/common/hadoop-{v}/hadoop-{v}.tar.gz?as_json'
+
+# The file in a local artifact store that lists what's in it.
+INDEX_FILE = 'artifacts.json'
+
+Artifact = collections.namedtuple('Artifact', ['name', 'urls', 'digest_urls'])
+
+
+class ArtifactStoreError(Error):
+    pass
+
+
+def get_hadoop_artifact(*, version: str, download_source: str) -> Artifact:
+    name = 'hadoop-{v}.tar.gz'.format(v=version)
+    digest_url = '{a}hadoop/common/hadoop-{v}/{n}'.format(a=APACHE_ARCHIVE, v=version, n=name)
+    return Artifact(
+        name=name,
+        urls=[download_source.format(v=version)],
+        # Older releases list the SHA-512 digest along with others in a
+        # .mds file.
+        digest_urls=[digest_url + '.sha512', digest_url + '.mds'])
+
+
+def get_spark_artifact(*, version: str, distribution: str) -> Artifact:
+    name = 'spark-{v}-bin-{d}.tgz'.format(v=version, d=distribution)
+    apache_url = '{a}spark/spark-{v}/{n}'.format(a=APACHE_ARCHIVE, v=version, n=name)
+    return Artifact(
+        name=name,
+        urls=[
+            'https://s3.amazonaws.com/spark-related-packages/' + name,
+            apache_url,
+        ],
+        # Older releases list the SHA-512 digest along with others in a
+        # .sha file.
+        digest_urls=[apache_url + '.sha512', apache_url + '.sha'])
+
+
+class ArtifactStore:
+    """
+    This is an abstract class. Implementations of this class serve artifacts
+    that were fetched into a local store with `flintrock artifacts fetch`, and
+    then copied somewhere cluster nodes can download them from.
+
+    Each artifact sits next to a file with its SHA-512 checksum, so nodes check
+    what they download against the checksum recorded when it was fetched.
+    """
+    def get_url(self, name: str) -> str:
+        raise NotImplementedError
+
+    def get_artifact(self, artifact: Artifact) -> Artifact:
+        """
+        Get the provided artifact as it is in this store.
+        """
+        return Artifact(
+            name=artifact.name,
+            urls=[self.get_url(artifact.name)],
+            digest_urls=[self.get_url(artifact.name + '.sha512')])
+
+
+class HTTPArtifactStore(ArtifactStore):
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+
+    def get_url(self, name: str) -> str:
+        return '{u}/{n}'.format(u=self.url, n=name)
+
+
+class S3ArtifactStore(ArtifactStore):
+    """
+    A store in an S3 bucket. We hand nodes pre-signed URLs, so they need
+    neither credentials nor the AWS CLI.
+    """
+    def __init__(self, *, bucket: str, prefix: str=''):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+        # We import boto3 here since it's slow to import, and most commands
+        # never touch S3.
+        import boto3
+        self.s3 = boto3.client(service_name='s3')
+
+    def get_url(self, name: str) -> str:
+        return self.s3.generate_presigned_url(
+            ClientMethod='get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': '/'.join(filter(None, [self.prefix, name]))},
+            ExpiresIn=3600 * 6)
+
+
+def get_artifact_store(location: str) -> ArtifactStore:
+    """
+    Get the artifact store at the provided location, which can be an s3:// URL
+    or an http:// or https:// URL. Cluster nodes download straight from the
+    store, so it has to be somewhere they can reach.
+    """
+    parsed = urllib.parse.urlparse(location)
+
+    if parsed.scheme == 's3':
+        if not parsed.netloc:
+            raise ArtifactStoreError(
+                "No bucket in artifact store location: {l}".format(l=location))
+        return S3ArtifactStore(bucket=parsed.netloc, prefix=parsed.path)
+    elif parsed.scheme in ['http', 'https']:
+        return HTTPArtifactStore(location)
+    else:
+        raise ArtifactStoreError(
+            "Unsupported artifact store location: {l}\n"
+            "Cluster nodes download artifacts straight from the store, so it must "
+            "be an http://, https://, or s3:// URL. To use a store you fetched "
+            "into a local directory, copy the directory to a bucket or web server "
+            "first.".format(l=location))
+
+
+def parse_sha512(digest_file: str) -> str:
+    """
+    Find the SHA-512 checksum in a digest file in any of the formats Apache
+    uses, or return None if there isn't one.
+    """
+    # Some formats split the checksum into groups across several lines.
+    for hex_run in re.findall(r'[0-9a-fA-F]+', re.sub(r'\s', '', digest_file)):
+        if len(hex_run) == 128:
+            return hex_run.lower()
+    return None
+
+
+def get_published_sha512(artifact: Artifact) -> str:
+    """
+    Get the SHA-512 checksum from the first of the artifact's digest files that
+    we can fetch and that has one, or return None if none do.
+    """
+    for digest_url in artifact.digest_urls:
+        try:
+            with urllib.request.urlopen(digest_url, timeout=30) as response:
+                digest_file = response.read().decode('utf-8', 'replace')
+        except (urllib.error.URLError, OSError):
+            continue
+        # Mirrors may answer with an error page, and older releases publish
+        # digests in formats without a SHA-512.
+        checksum = parse_sha512(digest_file)
+        if checksum:
+            return checksum
+    return None
+
+
+def get_download_urls(url: str) -> 'List[str]':
+    """
+    Get the URLs to try downloading from, in order. An Apache closer.lua URL
+    stands for the mirror Apache prefers, with the Apache archive as a fallback.
+    """
+    if 'closer.lua/' not in url:
+        return [url]
+
+    path = url.split('closer.lua/', 1)[1].split('?', 1)[0]
+    urls = []
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            mirror_info = json.loads(response.read().decode('utf-8'))
+        urls.append(mirror_info['preferred'].rstrip('/') + '/' + path)
+    except (urllib.error.URLError, OSError, ValueError, KeyError):
+        pass
+    urls.append(APACHE_ARCHIVE + path)
+    return urls
+
+
+def get_file_sha512(path: str) -> str:
+    checksum = hashlib.sha512()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class LocalArtifactStore:
+    """
+    A directory on the machine running Flintrock that we fetch artifacts into.
+
+    An index file records where each artifact came from and its checksum, and
+    each artifact gets a .sha512 file next to it, so the directory can be
+    served as is by an HTTPArtifactStore or S3ArtifactStore.
+    """
+    def __init__(self, directory: str):
+        self.directory = os.path.expanduser(directory)
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def get_index(self) -> dict:
+        try:
+            with open(self.get_path(INDEX_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_index(self, index: dict):
+        temp_path = self.get_path(INDEX_FILE + '.partial')
+        with open(temp_path, 'w') as f:
+            json.dump(index, f, indent=4, sort_keys=True)
+        os.replace(temp_path, self.get_path(INDEX_FILE))
+
+    def contains(self, artifact: Artifact) -> bool:
+        """
+        Check that the store has the provided artifact, and that it's intact.
+        """
+        entry = self.get_index().get(artifact.name)
+        path = self.get_path(artifact.name)
+        return (
+            entry is not None and
+            os.path.isfile(path) and
+            os.path.getsize(path) == entry['size'] and
+            get_file_sha512(path) == entry['sha512'])
+
+    def fetch(self, artifact: Artifact) -> dict:
+        """
+        Download the provided artifact into the store, check it against its
+        published checksum, and record it in the index. Return its index entry.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        expected_checksum = get_published_sha512(artifact)
+        if not expected_checksum:
+            print(
+                "Warning: Could not get a SHA-512 checksum for {n} from any of:\n"
+                "{u}\n"
+                "We can't verify what we download, so we'll record its checksum "
+                "and mark it as unverified in the store's index."
+                .format(n=artifact.name, u='\n'.join('  ' + u for u in artifact.digest_urls)),
+                file=sys.stderr)
+
+        errors = []
+        for url in [u for url in artifact.urls for u in get_download_urls(url)]:
+            (fd, temp_path) = tempfile.mkstemp(dir=self.directory, suffix='.partial')
+            checksum = hashlib.sha512()
+            size = 0
+            try:
+                with os.fdopen(fd, 'wb') as f, urllib.request.urlopen(url, timeout=60) as response:
+                    for chunk in iter(lambda: response.read(1024 * 1024), b''):
+                        checksum.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+            except (urllib.error.URLError, OSError) as e:
+                os.remove(temp_path)
+                errors.append("{u}: {e}".format(u=url, e=e))
+                continue
+
+            if expected_checksum and checksum.hexdigest() != expected_checksum:
+                os.remove(temp_path)
+                errors.append("{u}: Checksum does not match the published checksum.".format(u=url))
+                continue
+
+            os.replace(temp_path, self.get_path(artifact.name))
+            with open(self.get_path(artifact.name + '.sha512'), 'w') as f:
+                f.write('{c}  {n}\n'.format(c=checksum.hexdigest(), n=artifact.name))
+
+            entry = {
+                'sha512': checksum.hexdigest(),
+                'size': size,
+                'source': url,
+                'verified': bool(expected_checksum),
+            }
+            index = self.get_index()
+            index[artifact.name] = entry
+            self._write_index(index)
+            return entry
+
+        raise ArtifactStoreError(
+            "Could not fetch {n}:\n{e}".format(n=artifact.name, e='\n'.join(errors)))
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import shlex
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+
+# External modules
+import boto3
+import botocore
+import paramiko
+
+# Flintrock modules
+from .exceptions import Error
+from .ssh import ssh_check_output
+
+
+class BuildCacheError(Error):
+    pass
+
+
+def get_build_key(*, repository: str, commit: str, profile: str) -> str:
+    """
+    Get the key we cache a build under. The key is derived from everything that
+    determines what the build produces, so the same build always gets the same
+    key no matter who made it.
+    """
+    build_spec = json.dumps(
+        {'repository': repository, 'commit': commit, 'profile': profile},
+        sort_keys=True)
+    return hashlib.sha256(build_spec.encode('utf-8')).hexdigest()
+
+
+class BuildCache:
+    """
+    This is an abstract class. Implementations of this class store build
+    artifacts somewhere cluster nodes can get them from, keyed by a build key.
+
+    Artifacts live on cluster nodes, so fetch() and store() move them to and
+    from a node via the provided SSH client.
+    """
+    def contains(self, key: str) -> bool:
+        """
+        Check whether the cache has an artifact stored under the provided key.
+        """
+        raise NotImplementedError
+
+    def fetch(
+            self,
+            *,
+            key: str,
+            ssh_client: paramiko.client.SSHClient,
+            remote_path: str):
+        """
+        Copy the artifact stored under the provided key to remote_path on a node.
+        """
+        raise NotImplementedError
+
+    def store(
+            self,
+            *,
+            key: str,
+            ssh_client: paramiko.client.SSHClient,
+            remote_path: str):
+        """
+        Store the artifact at remote_path on a node under the provided key.
+        """
+        raise NotImplementedError
+
+
+class LocalBuildCache(BuildCache):
+    """
+    A cache in a directory on the machine running Flintrock.
+
+    Artifacts travel between this machine and the cluster, so this is the
+    slowest backend. It needs no setup, though.
+    """
+    def __init__(self, directory: str):
+        self.directory = os.path.expanduser(directory)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.tgz')
+
+    def contains(self, key: str) -> bool:
+        return os.path.isfile(self._get_path(key))
+
+    def fetch(self, *, key, ssh_client, remote_path):
+        with ssh_client.open_sftp() as sftp:
+            sftp.put(localpath=self._get_path(key), remotepath=remote_path)
+
+    def store(self, *, key, ssh_client, remote_path):
+        os.makedirs(self.directory, exist_ok=True)
+        # We download to a temporary file first so that an interrupted store
+        # never leaves a partial artifact in the cache.
+        (fd, temp_path) = tempfile.mkstemp(dir=self.directory, suffix='.partial')
+        os.close(fd)
+        try:
+            with ssh_client.open_sftp() as sftp:
+                sftp.get(remotepath=remote_path, localpath=temp_path)
+            os.replace(temp_path, self._get_path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def _download(*, ssh_client: paramiko.client.SSHClient, url: str, remote_path: str):
+    ssh_check_output(
+        client=ssh_client,
+        command="""
+            curl --fail --silent --show-error --location --output {p} {u}
+        """.format(
+            p=shlex.quote(remote_path),
+            u=shlex.quote(url)))
+
+
+def _upload(*, ssh_client: paramiko.client.SSHClient, url: str, remote_path: str):
+    ssh_check_output(
+        client=ssh_client,
+        command="""
+            curl --fail --silent --show-error --upload-file {p} {u}
+        """.format(
+            p=shlex.quote(remote_path),
+            u=shlex.quote(url)))
+
+
+class HTTPBuildCache(BuildCache):
+    """
+    A cache behind an HTTP server that supports GET, HEAD, and PUT.
+
+    Nodes download from and upload to the server directly.
+    """
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+
+    def _get_url(self, key: str) -> str:
+        return '{u}/{k}.tgz'.format(u=self.url, k=key)
+
+    def contains(self, key: str) -> bool:
+        request = urllib.request.Request(self._get_url(key), method='HEAD')
+        try:
+            with urllib.request.urlopen(request, timeout=10):
+                return True
+        except urllib.error.HTTPError as e:
+            if e.code in [403, 404]:
+                return False
+            raise
+
+    def fetch(self, *, key, ssh_client, remote_path):
+        _download(ssh_client=ssh_client, url=self._get_url(key), remote_path=remote_path)
+
+    def store(self, *, key, ssh_client, remote_path):
+        _upload(ssh_client=ssh_client, url=self._get_url(key), remote_path=remote_path)
+
+
+class S3BuildCache(BuildCache):
+    """
+    A cache in an S3 bucket, or in a bucket on any service that speaks the S3 API.
+
+    We hand nodes pre-signed URLs, so they need neither credentials nor the AWS CLI.
+    """
+    def __init__(self, *, bucket: str, prefix: str='', endpoint_url: str=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.s3 = boto3.client(service_name='s3', endpoint_url=endpoint_url)
+
+    def _get_object_key(self, key: str) -> str:
+        return '/'.join(filter(None, [self.prefix, key + '.tgz']))
+
+    def _get_presigned_url(self, key: str, client_method: str) -> str:
+        return self.s3.generate_presigned_url(
+            ClientMethod=client_method,
+            Params={'Bucket': self.bucket, 'Key': self._get_object_key(key)},
+            ExpiresIn=3600)
+
+    def contains(self, key: str) -> bool:
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=self._get_object_key(key))
+            return True
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ['403', '404', 'NoSuchKey']:
+                return False
+            raise
+
+    def fetch(self, *, key, ssh_client, remote_path):
+        _download(
+            ssh_client=ssh_client,
+            url=self._get_presigned_url(key, 'get_object'),
+            remote_path=remote_path)
+
+    def store(self, *, key, ssh_client, remote_path):
+        _upload(
+            ssh_client=ssh_client,
+            url=self._get_presigned_url(key, 'put_object'),
+            remote_path=remote_path)
+
+
+def get_build_cache(location: str, *, s3_endpoint_url: str=None) -> BuildCache:
+    """
+    Get the build cache at the provided location, which can be an s3:// URL,
+    an http:// or https:// URL, or a local directory.
+
+    s3:// locations are looked up in AWS unless s3_endpoint_url points at
+    another service that speaks the S3 API.
+    """
+    parsed = urllib.parse.urlparse(location)
+
+    if parsed.scheme == 's3':
+        if not parsed.netloc:
+            raise BuildCacheError(
+                "No bucket in build cache location: {l}".format(l=location))
+        return S3BuildCache(
+            bucket=parsed.netloc,
+            prefix=parsed.path,
+            endpoint_url=s3_endpoint_url)
+    elif parsed.scheme in ['http', 'https']:
+        return HTTPBuildCache(location)
+    elif parsed.scheme in ['', 'file']:
+        return LocalBuildCache(parsed.path if parsed.scheme == 'file' else location)
+    else:
+        raise BuildCacheError(
+            "Unsupported build cache location: {l}".format(l=location))
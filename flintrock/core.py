@@ -1,15 +1,20 @@
 import asyncio
 import concurrent.futures
 import functools
+import gzip
 import json
 import os
 import posixpath
 import shlex
 import sys
+import threading
 import time
 
 # Flintrock modules
-from .ssh import get_ssh_client, ssh_check_output, ssh
+from . import tracing
+from .defaults import DEFAULT_BOOTSTRAP_TIMEOUT, DEFAULT_MAX_PARALLEL
+from .exceptions import Error
+from .ssh import SSHClientPool, RemoteStep, ssh_check_output, ssh_check_steps, ssh
 
 FROZEN = getattr(sys, 'frozen', False)
 
@@ -20,6 +25,34 @@ else:
 
 SCRIPTS_DIR = os.path.join(THIS_DIR, 'scripts')
 
+# The file in the home directory of a machine image where build-image records
+# which services it installed on the image.
+BAKED_SERVICES_FILE = '.flintrock-baked-services.json'
+
+# The files in the home directory of a node where its bootstrap script reports
+# how it's doing.
+BOOTSTRAP_STATUS_FILE = '.flintrock-bootstrap.json'
+BOOTSTRAP_LOG_FILE = '.flintrock-bootstrap.log'
+# How long we give a node to start running its bootstrap script once we can
+# SSH in, and how often we check on it.
+BOOTSTRAP_START_TIMEOUT = 300
+BOOTSTRAP_POLL_INTERVAL = 5
+
+
+# The services start() can rebuild from a cluster's manifest, by class name.
+# See register_service().
+SERVICES = {}
+
+
+def register_service(service_class: type) -> type:
+    """
+    Let start() find a service class by name in a cluster's manifest.
+
+    This can be used as a class decorator.
+    """
+    SERVICES[service_class.__name__] = service_class
+    return service_class
+
 
 class StorageDirs:
     def __init__(self, *, root, ephemeral, persistent):
@@ -52,6 +85,11 @@ class FlintrockCluster:
         # self.slave_ips = []
         # self.slave_hosts = []
         self.storage_dirs = storage_dirs
+        self.ssh_client_pool = SSHClientPool()
+        self._template_mappings = {}
+        # The services, and their manifests, that are already installed on the
+        # cluster's machine image.
+        self.baked_services = []
 
     @property
     def master_ip(self) -> str:
@@ -103,6 +141,17 @@ class FlintrockCluster:
         """
         raise NotImplementedError
 
+    def host_is_booted(self, host: str) -> bool:
+        """
+        Check whether a node has finished booting, so that it's worth trying to
+        connect to it via SSH.
+
+        Providers can override this method if they have a cheap way of knowing
+        when a node has booted. By default we assume it has, and rely on
+        retrying the SSH connection.
+        """
+        return True
+
     def destroy_check(self):
         """
         Check that the cluster is in a state in which it can be destroyed.
@@ -139,7 +188,12 @@ class FlintrockCluster:
         """
         pass
 
-    def start(self, *, user: str, identity_file: str):
+    def start(
+            self,
+            *,
+            user: str,
+            identity_file: str,
+            max_parallel: int=DEFAULT_MAX_PARALLEL):
         """
         Start up all the services installed on the cluster.
 
@@ -147,14 +201,22 @@ class FlintrockCluster:
         started up by the provider (e.g. EC2, GCE, etc.) they're hosted on
         and are running.
         """
-        master_ssh_client = get_ssh_client(
-            user=user,
-            host=self.master_ip,
-            identity_file=identity_file,
-            wait=True,
-            print_status=False)
-
-        with master_ssh_client:
+        try:
+            self._start(
+                user=user,
+                identity_file=identity_file,
+                max_parallel=max_parallel)
+        finally:
+            self.ssh_client_pool.close()
+
+    def _start(self, *, user: str, identity_file: str, max_parallel: int):
+        with self.ssh_client_pool.borrow(
+                user=user,
+                host=self.master_ip,
+                identity_file=identity_file,
+                wait=True,
+                is_booted=functools.partial(self.host_is_booted, self.master_ip),
+                print_status=False) as master_ssh_client:
             manifest_raw = ssh_check_output(
                 client=master_ssh_client,
                 command="""
@@ -187,8 +249,7 @@ class FlintrockCluster:
 
         services = []
         for [service_name, manifest] in manifest['services']:
-            # TODO: Expose the classes being used here.
-            service = globals()[service_name](**manifest)
+            service = SERVICES[service_name](**manifest)
             services.append(service)
 
         partial_func = functools.partial(
@@ -199,27 +260,27 @@ class FlintrockCluster:
             cluster=self)
         hosts = [self.master_ip] + self.slave_ips
 
-        _run_asynchronously(partial_func=partial_func, hosts=hosts)
+        _run_asynchronously(
+            partial_func=partial_func,
+            hosts=hosts,
+            max_parallel=max_parallel)
 
-        master_ssh_client = get_ssh_client(
-            user=user,
-            host=self.master_ip,
-            identity_file=identity_file)
-
-        with master_ssh_client:
+        with self.ssh_client_pool.borrow(
+                user=user,
+                host=self.master_ip,
+                identity_file=identity_file) as master_ssh_client:
             for service in services:
-                service.configure_master(
-                    ssh_client=master_ssh_client,
-                    cluster=self)
-
-        # NOTE: We sleep here so that the slave services have time to come up.
-        #       If we refactor stuff to have a start_slave() that blocks until
-        #       the slave is fully up, then we won't need this sleep anymore.
-        if services:
-            time.sleep(30)
-
-        for service in services:
-            service.health_check(master_host=self.master_ip)
+                with tracing.span(
+                        get_service_phase(service, 'configure_master'),
+                        host=self.master_ip):
+                    service.configure_master(
+                        ssh_client=master_ssh_client,
+                        cluster=self)
+
+        wait_for_services(
+            cluster=self,
+            services=services,
+            master_host=self.master_ip)
 
     def stop_check(self):
         """
@@ -254,7 +315,8 @@ class FlintrockCluster:
             master_only: bool,
             user: str,
             identity_file: str,
-            command: tuple):
+            command: tuple,
+            max_parallel: int=DEFAULT_MAX_PARALLEL):
         """
         Run a shell command on each node of an existing cluster.
 
@@ -269,10 +331,17 @@ class FlintrockCluster:
             run_command_node,
             user=user,
             identity_file=identity_file,
-            command=command)
+            command=command,
+            cluster=self)
         hosts = target_hosts
 
-        _run_asynchronously(partial_func=partial_func, hosts=hosts)
+        try:
+            _run_asynchronously(
+                partial_func=partial_func,
+                hosts=hosts,
+                max_parallel=max_parallel)
+        finally:
+            self.ssh_client_pool.close()
 
     def copy_file_check(self):
         """
@@ -291,7 +360,8 @@ class FlintrockCluster:
             user: str,
             identity_file: str,
             local_path: str,
-            remote_path: str):
+            remote_path: str,
+            max_parallel: int=DEFAULT_MAX_PARALLEL):
         """
         Copy a file to each node of an existing cluster.
 
@@ -307,10 +377,17 @@ class FlintrockCluster:
             user=user,
             identity_file=identity_file,
             local_path=local_path,
-            remote_path=remote_path)
+            remote_path=remote_path,
+            cluster=self)
         hosts = target_hosts
 
-        _run_asynchronously(partial_func=partial_func, hosts=hosts)
+        try:
+            _run_asynchronously(
+                partial_func=partial_func,
+                hosts=hosts,
+                max_parallel=max_parallel)
+        finally:
+            self.ssh_client_pool.close()
 
     def login(
             self,
@@ -329,7 +406,18 @@ class FlintrockCluster:
         """
         Generate a template mapping from a FlintrockCluster instance that we can use
         to fill in template parameters.
+
+        Mappings are cached, since we need the same mapping for every node and
+        building it gets expensive on large clusters. Providers must clear
+        _template_mappings whenever the cluster's nodes change.
         """
+        cache_key = (
+            service,
+            self.storage_dirs.root,
+            tuple(self.storage_dirs.ephemeral))
+        if cache_key in self._template_mappings:
+            return self._template_mappings[cache_key]
+
         root_dir = posixpath.join(self.storage_dirs.root, service)
         ephemeral_dirs = ','.join(posixpath.join(path, service) for path in self.storage_dirs.ephemeral)
 
@@ -348,45 +436,138 @@ class FlintrockCluster:
             'root_ephemeral_dirs': ephemeral_dirs if ephemeral_dirs else root_dir,
         }
 
+        self._template_mappings[cache_key] = template_mapping
         return template_mapping
 
 
-def _run_asynchronously(*, partial_func: functools.partial, hosts: list):
+class HostResult:
     """
-    Run a function asynchronously against each of the provided hosts.
+    The outcome of running a function against a single host.
+    """
+    def __init__(self, *, host: str, value=None, error: Exception=None, duration: float):
+        self.host = host
+        self.value = value
+        self.error = error
+        self.duration = duration
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+_thread_local = threading.local()
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the event loop that drives fan-outs from the current thread.
+
+    We keep one loop per thread for the life of the process instead of closing it
+    after every fan-out, so that several fan-outs can run in one process.
+    """
+    loop = getattr(_thread_local, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _thread_local.loop = loop
+    return loop
+
+
+def _run_on_host(partial_func: functools.partial, host: str) -> HostResult:
+    start = time.time()
+    try:
+        with tracing.span(partial_func.func.__name__, host=host):
+            value = partial_func(host=host)
+    except Exception as e:
+        return HostResult(host=host, error=e, duration=time.time() - start)
+    else:
+        return HostResult(host=host, value=value, duration=time.time() - start)
+
+
+def _run_asynchronously(
+        *,
+        partial_func: functools.partial,
+        hosts: 'Iterable[str]',
+        max_parallel: int=DEFAULT_MAX_PARALLEL) -> 'List[HostResult]':
+    """
+    Run a function asynchronously against each of the provided hosts, working on
+    at most max_parallel hosts at once.
+
+    hosts can be any iterable, including a lazy one that blocks until the next
+    host is ready. Work on each host starts as soon as the iterable yields it.
+
+    Return a HostResult for each host, in the same order as the hosts. If the
+    function failed on any host, raise the first error once all the hosts are done.
 
     This function assumes that partial_func accepts `host` as a keyword argument.
     """
-    loop = asyncio.get_event_loop()
-    executor = concurrent.futures.ThreadPoolExecutor(len(hosts))
+    loop = _get_event_loop()
+    # Paramiko is blocking, so each host we are working on still needs a thread.
+    # The executor caps how many of those threads exist at once.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel)
 
     tasks = []
-    for host in hosts:
-        # TODO: Use parameter names for run_in_executor() once Python 3.4.4 is released.
-        #       Until then, we leave them out to maintain compatibility across Python 3.4
-        #       and 3.5.
-        # See: http://stackoverflow.com/q/32873974/
-        task = loop.run_in_executor(
-            executor,
-            functools.partial(partial_func, host=host))
-        tasks.append(task)
-
     try:
-        loop.run_until_complete(asyncio.gather(*tasks))
-        # done, _ = loop.run_until_complete(asyncio.wait(tasks))
-        # # Is this the right way to make sure no coroutine failed?
-        # for future in done:
-        #     future.result()
+        for host in hosts:
+            # TODO: Use parameter names for run_in_executor() once Python 3.4.4 is released.
+            #       Until then, we leave them out to maintain compatibility across Python 3.4
+            #       and 3.5.
+            # See: http://stackoverflow.com/q/32873974/
+            task = loop.run_in_executor(
+                executor,
+                functools.partial(_run_on_host, partial_func, host))
+            tasks.append(task)
+
+        if tasks:
+            results = loop.run_until_complete(asyncio.gather(*tasks))
+        else:
+            results = []
     finally:
         # TODO: Let KeyboardInterrupt cleanly cancel hung commands.
         #       Currently, we can't do this without dumping a large stack trace or
         #       waiting until the executor threads yield control.
         #       See: http://stackoverflow.com/q/29177490/
-        # We shutdown explcitly to make sure threads are cleaned up before shutting
-        # the loop down.
+        # We shutdown explcitly to make sure threads are cleaned up before returning.
         # See: http://stackoverflow.com/a/32615276/
         executor.shutdown(wait=True)
-        loop.close()
+
+    for result in results:
+        if not result.ok:
+            raise result.error
+
+    return results
+
+
+def wait_for_services(
+        *,
+        cluster: FlintrockCluster,
+        services: list,
+        master_host: str):
+    """
+    Wait for every service on the cluster to report that all its slaves are up,
+    and then run each service's health check.
+
+    We wait on all the services at once, so the total wait is as long as the
+    slowest service takes to come up.
+    """
+    if not services:
+        return
+
+    num_slaves = len(cluster.slave_ips)
+    with tracing.span('wait_for_ready'), \
+            concurrent.futures.ThreadPoolExecutor(max_workers=len(services)) as executor:
+        futures = [
+            executor.submit(
+                functools.partial(
+                    service.wait_for_ready,
+                    master_host=master_host,
+                    num_slaves=num_slaves))
+            for service in services]
+        for future in futures:
+            future.result()
+
+    for service in services:
+        with tracing.span(get_service_phase(service, 'health_check')):
+            service.health_check(master_host=master_host)
 
 
 def provision_cluster(
@@ -394,28 +575,96 @@ def provision_cluster(
         cluster: FlintrockCluster,
         services: list,
         user: str,
-        identity_file: str):
+        identity_file: str,
+        hosts: 'Iterable[str]'=None,
+        max_parallel: int=DEFAULT_MAX_PARALLEL,
+        bootstrap: bool=False,
+        bootstrap_timeout: float=DEFAULT_BOOTSTRAP_TIMEOUT):
     """
     Connect to a freshly launched cluster and install the specified services.
-    """
-    partial_func = functools.partial(
-        provision_node,
-        services=services,
-        user=user,
-        identity_file=identity_file,
-        cluster=cluster)
-    hosts = [cluster.master_ip] + cluster.slave_ips
 
-    _run_asynchronously(partial_func=partial_func, hosts=hosts)
+    By default we provision every node in the cluster at once. Providers can
+    instead pass in hosts, an iterable that yields each node as it becomes
+    ready, so that we can start on early nodes while the rest are still booting.
+    hosts must cover every node in the cluster, and the cluster's addresses must
+    be up-to-date by the time it is exhausted.
+
+    If bootstrap is True, the nodes were launched with the script from
+    get_bootstrap_script() and install the services themselves, so we just
+    wait up to bootstrap_timeout seconds for each of them to finish.
+    """
+    try:
+        _provision_cluster(
+            cluster=cluster,
+            services=services,
+            user=user,
+            identity_file=identity_file,
+            hosts=hosts,
+            max_parallel=max_parallel,
+            bootstrap=bootstrap,
+            bootstrap_timeout=bootstrap_timeout)
+    finally:
+        cluster.ssh_client_pool.close()
 
-    master_ssh_client = get_ssh_client(
-        user=user,
-        host=cluster.master_host,
-        identity_file=identity_file)
 
-    with master_ssh_client:
+def _provision_cluster(
+        *,
+        cluster: FlintrockCluster,
+        services: list,
+        user: str,
+        identity_file: str,
+        hosts: 'Iterable[str]',
+        max_parallel: int,
+        bootstrap: bool,
+        bootstrap_timeout: float):
+    if hosts is None:
+        hosts = [cluster.master_ip] + cluster.slave_ips
+
+    # Installation doesn't depend on the rest of the cluster, so we run it on
+    # each node as soon as that node is ready.
+    with tracing.span('provision'):
+        _run_asynchronously(
+            partial_func=functools.partial(
+                functools.partial(wait_for_bootstrap, timeout=bootstrap_timeout)
+                if bootstrap else provision_node,
+                services=services,
+                user=user,
+                identity_file=identity_file,
+                cluster=cluster),
+            hosts=hosts,
+            max_parallel=max_parallel)
+
+    with cluster.ssh_client_pool.borrow(
+            user=user,
+            host=cluster.master_ip,
+            identity_file=identity_file) as master_ssh_client:
+        for service in services:
+            if not service_is_baked(service=service, cluster=cluster):
+                with tracing.span(
+                        get_service_phase(service, 'install_master'),
+                        host=cluster.master_ip):
+                    service.install_master(
+                        ssh_client=master_ssh_client,
+                        cluster=cluster)
+
+    # Configuration needs the full list of nodes, which we only have now.
+    with tracing.span('configure'):
+        _run_asynchronously(
+            partial_func=functools.partial(
+                configure_node,
+                services=services,
+                user=user,
+                identity_file=identity_file,
+                cluster=cluster),
+            hosts=[cluster.master_ip] + cluster.slave_ips,
+            max_parallel=max_parallel)
+
+    with cluster.ssh_client_pool.borrow(
+            user=user,
+            host=cluster.master_ip,
+            identity_file=identity_file) as master_ssh_client:
         manifest = {
-            'services': [[type(m).__name__, m.manifest] for m in services]}
+            'services': [get_service_manifest(service) for service in services]}
         # The manifest tells us how the cluster is configured. We'll need this
         # when we resize the cluster or restart it.
         ssh_check_output(
@@ -427,18 +676,60 @@ def provision_cluster(
                 u=shlex.quote(user)))
 
         for service in services:
-            service.configure_master(
-                ssh_client=master_ssh_client,
-                cluster=cluster)
+            with tracing.span(
+                    get_service_phase(service, 'configure_master'),
+                    host=cluster.master_ip):
+                service.configure_master(
+                    ssh_client=master_ssh_client,
+                    cluster=cluster)
+
+    wait_for_services(
+        cluster=cluster,
+        services=services,
+        master_host=cluster.master_host)
 
-    # NOTE: We sleep here so that the slave services have time to come up.
-    #       If we refactor stuff to have a start_slave() that blocks until
-    #       the slave is fully up, then we won't need this sleep anymore.
-    if services:
-        time.sleep(30)
 
-    for service in services:
-        service.health_check(master_host=cluster.master_host)
+def get_service_phase(service, phase: str) -> str:
+    """
+    Name a phase of work on a service, like its install, for tracing.
+    """
+    return '{s}.{p}'.format(s=type(service).__name__, p=phase)
+
+
+def get_service_manifest(service) -> list:
+    return [type(service).__name__, service.manifest]
+
+
+def service_is_baked(*, service, cluster: FlintrockCluster) -> bool:
+    """
+    Check whether the provided service, in the exact configuration requested,
+    is already installed on the cluster's machine image.
+    """
+    return get_service_manifest(service) in cluster.baked_services
+
+
+def get_java_install_step() -> RemoteStep:
+    return RemoteStep(
+        name='java',
+        command="""
+            set -e
+
+            sudo yum install -y java-1.7.0-openjdk
+            sudo sh -c "echo export JAVA_HOME=/usr/lib/jvm/jre >> /etc/environment"
+            source /etc/environment
+        """)
+
+
+def get_hostname_step(*, host: str) -> RemoteStep:
+    return RemoteStep(
+        name='hostname',
+        command="""
+            set -e
+
+            fullname=`hostname`.ec2.internal
+
+            echo "{h} $fullname $(hostname)" |sudo tee -a /etc/hosts
+        """.format(h=host))
 
 
 def provision_node(
@@ -452,88 +743,368 @@ def provision_node(
     Connect to a freshly launched node, set it up for SSH access, configure ephemeral
     storage, and install the specified services.
 
+    This method doesn't need to know about the other nodes in the cluster, so
+    it can run while they are still coming up.
+
     This method is role-agnostic; it runs on both the cluster master and slaves.
     This method is meant to be called asynchronously.
     """
-    client = get_ssh_client(
-        user=user,
-        host=host,
-        identity_file=identity_file,
-        wait=True)
-
-    with client:
-        ssh_check_output(
-            client=client,
-            command="""
-                set -e
-
-                echo {private_key} > ~/.ssh/id_rsa
-                echo {public_key} >> ~/.ssh/authorized_keys
-
-                chmod 400 ~/.ssh/id_rsa
-            """.format(
-                private_key=shlex.quote(cluster.ssh_key_pair.private),
-                public_key=shlex.quote(cluster.ssh_key_pair.public)))
-
-        with client.open_sftp() as sftp:
-            sftp.put(
-                localpath=os.path.join(SCRIPTS_DIR, 'setup-ephemeral-storage.py'),
-                remotepath='/tmp/setup-ephemeral-storage.py')
+    with cluster.ssh_client_pool.borrow(
+            user=user,
+            host=host,
+            identity_file=identity_file,
+            wait=True,
+            is_booted=functools.partial(cluster.host_is_booted, host)) as client:
+        with open(os.path.join(SCRIPTS_DIR, 'setup-ephemeral-storage.py')) as f:
+            setup_ephemeral_storage_script = f.read()
 
         print("[{h}] Configuring ephemeral storage...".format(h=host))
         # TODO: Print some kind of warning if storage is large, since formatting
         #       will take several minutes (~4 minutes for 2TB).
-        storage_dirs_raw = ssh_check_output(
+        # NOTE: We send these steps in one batch to save round trips. This matters
+        #       most when the client is far away from the cluster.
+        [_, storage_dirs_result, java_home_result, baked_services_result] = ssh_check_steps(
             client=client,
-            command="""
-                set -e
-                python /tmp/setup-ephemeral-storage.py
-                rm -f /tmp/setup-ephemeral-storage.py
-            """)
-        storage_dirs = json.loads(storage_dirs_raw)
+            steps=[
+                RemoteStep(
+                    name='ssh-keys',
+                    command="""
+                        set -e
+
+                        echo {private_key} > ~/.ssh/id_rsa
+                        echo {public_key} >> ~/.ssh/authorized_keys
+
+                        chmod 400 ~/.ssh/id_rsa
+                    """.format(
+                        private_key=shlex.quote(cluster.ssh_key_pair.private),
+                        public_key=shlex.quote(cluster.ssh_key_pair.public))),
+                RemoteStep(
+                    name='ephemeral-storage',
+                    command="python -",
+                    input=setup_ephemeral_storage_script),
+                # The default CentOS AMIs on EC2 don't come with Java installed.
+                RemoteStep(
+                    name='java-home',
+                    command="""
+                        echo "$JAVA_HOME"
+                    """),
+                RemoteStep(
+                    name='baked-services',
+                    command="""
+                        cat {f} 2> /dev/null || echo '{{"services": []}}'
+                    """.format(f=BAKED_SERVICES_FILE)),
+            ])
+        storage_dirs = json.loads(storage_dirs_result.output)
+        # Every node in a cluster comes from the same image.
+        cluster.baked_services = json.loads(baked_services_result.output)['services']
 
         cluster.storage_dirs.root = storage_dirs['root']
         cluster.storage_dirs.ephemeral = storage_dirs['ephemeral']
 
-        # The default CentOS AMIs on EC2 don't come with Java installed.
-        java_home = ssh_check_output(
-            client=client,
-            command="""
-                echo "$JAVA_HOME"
-            """)
-
-        if not java_home.strip():
+        steps = []
+        if not java_home_result.output.strip():
             print("[{h}] Installing Java...".format(h=host))
+            steps.append(get_java_install_step())
+        if cluster.subnet_is_private:
+            print("[{h}] Configuring hostname...".format(h=host))
+            steps.append(get_hostname_step(host=host))
+        if steps:
+            ssh_check_steps(client=client, steps=steps)
 
-            ssh_check_output(
+        for service in services:
+            if service_is_baked(service=service, cluster=cluster):
+                print("[{h}] {s} is already installed on the image.".format(
+                    h=host, s=type(service).__name__))
+            else:
+                with tracing.span(get_service_phase(service, 'install'), host=host):
+                    service.install(
+                        ssh_client=client,
+                        cluster=cluster)
+
+
+def get_bootstrap_script(*, services: list, user: str) -> str:
+    """
+    Get a script that sets up a freshly launched node on its own when it first
+    boots, so that we don't have to drive each node over SSH. Providers pass it
+    to the node as user data, and cloud-init runs it as root.
+
+    The script does what provision_node() would, short of anything that needs
+    to know about the cluster, and reports how it's doing in a status file that
+    wait_for_bootstrap() polls.
+    """
+    with open(os.path.join(SCRIPTS_DIR, 'setup-ephemeral-storage.py')) as f:
+        setup_ephemeral_storage_script = f.read()
+
+    inputs = []
+    lines = []
+
+    def add_step(step: RemoteStep, indent: str=''):
+        input_path = '/dev/null'
+        if step.input:
+            if step.input not in inputs:
+                inputs.append(step.input)
+            input_path = '"$work_dir/input-{i}"'.format(i=inputs.index(step.input))
+        lines.append('{i}run_step {n} {p} {c}'.format(
+            i=indent,
+            n=shlex.quote(step.name),
+            p=input_path,
+            c=shlex.quote(step.command)))
+
+    add_step(
+        RemoteStep(
+            name='ephemeral-storage',
+            command="python -",
+            input=setup_ephemeral_storage_script))
+    # The default CentOS AMIs on EC2 don't come with Java installed.
+    lines.append("""su - "$user" -c 'test -n "$JAVA_HOME"' ||""")
+    add_step(get_java_install_step(), indent='    ')
+    for service in services:
+        steps = service.get_install_steps()
+        if not steps:
+            continue
+        lines.append('if ! is_baked {m}; then'.format(
+            m=shlex.quote(json.dumps(get_service_manifest(service)))))
+        for step in steps:
+            add_step(step, indent='    ')
+        lines.append('fi')
+
+    # Quoted here-documents pass the inputs through untouched.
+    write_inputs = ''.join(
+        """
+cat > "$work_dir/input-{i}" <<'FLINTROCK_INPUT_EOF'
+{input}
+FLINTROCK_INPUT_EOF
+""".format(i=i, input=input.rstrip('\n'))
+        for (i, input) in enumerate(inputs))
+
+    return """#!/bin/bash
+# Flintrock bootstrap script. cloud-init runs this as root when the node
+# first boots.
+
+set -o pipefail
+
+user={user}
+home="$(getent passwd "$user" | cut -d: -f6)"
+status_file="$home/{status_file}"
+log_file="$home/{log_file}"
+work_dir="$(mktemp -d)"
+
+# Some distributions configure sudo to require a terminal, which we don't have.
+echo "Defaults:$user !requiretty" > /etc/sudoers.d/flintrock-bootstrap
+chmod 440 /etc/sudoers.d/flintrock-bootstrap
+trap 'rm -rf /etc/sudoers.d/flintrock-bootstrap "$work_dir"' EXIT
+
+report() {{
+    # Replace the status file in one go so it's never read half-written.
+    echo "$1" > "$status_file.partial"
+    chown "$user" "$status_file.partial"
+    mv "$status_file.partial" "$status_file"
+}}
+
+run_step() {{
+    report '{{"status": "running", "step": "'"$1"'"}}'
+    echo "=== $1" >> "$log_file"
+    if ! su - "$user" -c "$3" < "$2" > "$work_dir/$1.out" 2>> "$log_file"; then
+        cat "$work_dir/$1.out" >> "$log_file"
+        report '{{"status": "failed", "step": "'"$1"'"}}'
+        exit 1
+    fi
+    cat "$work_dir/$1.out" >> "$log_file"
+}}
+
+is_baked() {{
+    python -c 'import json, sys; sys.exit(json.loads(sys.argv[2]) not in json.load(open(sys.argv[1]))["services"])' \\
+        "$home/{baked_services_file}" "$1" 2> /dev/null
+}}
+
+touch "$log_file"
+chown "$user" "$log_file"
+{write_inputs}
+{steps}
+
+report '{{"status": "done", "storage_dirs": '"$(cat "$work_dir/ephemeral-storage.out")"'}}'
+""".format(
+        user=shlex.quote(user),
+        status_file=BOOTSTRAP_STATUS_FILE,
+        log_file=BOOTSTRAP_LOG_FILE,
+        baked_services_file=BAKED_SERVICES_FILE,
+        write_inputs=write_inputs,
+        steps='\n'.join(lines))
+
+
+def get_bootstrap_user_data(*, services: list, user: str) -> bytes:
+    """
+    Get the bootstrap script for the provided services, compressed. cloud-init
+    recognizes gzipped user data and decompresses it itself, and compressing
+    the script keeps it under the size limits providers put on user data.
+    """
+    return gzip.compress(
+        get_bootstrap_script(services=services, user=user).encode('utf-8'))
+
+
+def wait_for_bootstrap(
+        *,
+        services: list,
+        user: str,
+        host: str,
+        identity_file: str,
+        cluster: FlintrockCluster,
+        timeout: float=DEFAULT_BOOTSTRAP_TIMEOUT):
+    """
+    Wait up to timeout seconds for a freshly launched node to finish running
+    its bootstrap script, and then do the few things that provision_node() does
+    which the script can't, like set the node up for SSH access within the
+    cluster.
+
+    This method is role-agnostic; it runs on both the cluster master and slaves.
+    This method is meant to be called asynchronously.
+    """
+    with cluster.ssh_client_pool.borrow(
+            user=user,
+            host=host,
+            identity_file=identity_file,
+            wait=True,
+            is_booted=functools.partial(cluster.host_is_booted, host)) as client:
+        print("[{h}] Waiting for node to bootstrap itself...".format(h=host))
+
+        def get_log_tail() -> str:
+            return ssh_check_output(
                 client=client,
+                command="""
+                    tail -n 20 {f} 2> /dev/null || true
+                """.format(f=BOOTSTRAP_LOG_FILE))
+
+        start = time.time()
+        while True:
+            status = json.loads(
+                ssh_check_output(
+                    client=client,
+                    command="""
+                        cat {f} 2> /dev/null || echo '{{"status": "pending"}}'
+                    """.format(f=BOOTSTRAP_STATUS_FILE)))
+
+            if status['status'] == 'done':
+                break
+            elif status['status'] == 'failed':
+                raise Error(
+                    "[{h}] Bootstrap step {s} failed:\n{l}".format(
+                        h=host, s=status['step'], l=get_log_tail()))
+            elif (status['status'] == 'pending' and
+                    time.time() - start > BOOTSTRAP_START_TIMEOUT):
+                raise Error(
+                    "[{h}] The node did not run its bootstrap script. "
+                    "Make sure its machine image comes with cloud-init.".format(h=host))
+            elif time.time() - start > timeout:
+                raise Error(
+                    "[{h}] The node did not finish bootstrapping within {t} seconds. "
+                    "It was on step {s}:\n{l}".format(
+                        h=host, t=timeout, s=status.get('step'), l=get_log_tail()))
+            time.sleep(BOOTSTRAP_POLL_INTERVAL)
+
+        cluster.storage_dirs.root = status['storage_dirs']['root']
+        cluster.storage_dirs.ephemeral = status['storage_dirs']['ephemeral']
+
+        steps = [
+            RemoteStep(
+                name='ssh-keys',
                 command="""
                     set -e
 
-                    sudo yum install -y java-1.7.0-openjdk
-                    sudo sh -c "echo export JAVA_HOME=/usr/lib/jvm/jre >> /etc/environment"
-                    source /etc/environment
-                """)
+                    echo {private_key} > ~/.ssh/id_rsa
+                    echo {public_key} >> ~/.ssh/authorized_keys
+
+                    chmod 400 ~/.ssh/id_rsa
+                """.format(
+                    private_key=shlex.quote(cluster.ssh_key_pair.private),
+                    public_key=shlex.quote(cluster.ssh_key_pair.public))),
+            RemoteStep(
+                name='baked-services',
+                command="""
+                    cat {f} 2> /dev/null || echo '{{"services": []}}'
+                """.format(f=BAKED_SERVICES_FILE)),
+        ]
         if cluster.subnet_is_private:
             print("[{h}] Configuring hostname...".format(h=host))
-            ssh_check_output(
-                client=client,
-                command="""
-                    set -e
+            steps.append(get_hostname_step(host=host))
+        results = ssh_check_steps(client=client, steps=steps)
+        cluster.baked_services = json.loads(results[1].output)['services']
+
 
-                    fullname=`hostname`.ec2.internal
+def bake_node(
+        *,
+        services: list,
+        user: str,
+        host: str,
+        identity_file: str,
+        cluster: FlintrockCluster):
+    """
+    Install Java and the specified services on a node that we're going to make a
+    machine image from, and record which services we installed so that clusters
+    launched from the image can skip installing them.
 
-                    echo "{h} $fullname $(hostname)" |sudo tee -a /etc/hosts
-                    """.format(h=host))
+    Unlike provision_node(), this leaves out anything specific to one cluster,
+    like SSH keys and storage.
+    """
+    with cluster.ssh_client_pool.borrow(
+            user=user,
+            host=host,
+            identity_file=identity_file,
+            wait=True,
+            is_booted=functools.partial(cluster.host_is_booted, host)) as client:
+        java_home = ssh_check_output(
+            client=client,
+            command="""
+                echo "$JAVA_HOME"
+            """)
+        if not java_home.strip():
+            print("[{h}] Installing Java...".format(h=host))
+            ssh_check_steps(client=client, steps=[get_java_install_step()])
 
         for service in services:
             service.install(
                 ssh_client=client,
                 cluster=cluster)
-            service.configure(
+            service.install_master(
                 ssh_client=client,
                 cluster=cluster)
 
+        baked_services = {
+            'services': [get_service_manifest(service) for service in services]}
+        ssh_check_output(
+            client=client,
+            command="""
+                echo {b} > {f}
+            """.format(
+                b=shlex.quote(json.dumps(baked_services, indent=4, sort_keys=True)),
+                f=BAKED_SERVICES_FILE))
+
+
+def configure_node(
+        *,
+        services: list,
+        user: str,
+        host: str,
+        identity_file: str,
+        cluster: FlintrockCluster):
+    """
+    Configure the installed services on a freshly provisioned node.
+
+    This method needs the full list of nodes in the cluster, so it must run
+    only after every node has been provisioned.
+
+    This method is role-agnostic; it runs on both the cluster master and slaves.
+    This method is meant to be called asynchronously.
+    """
+    with cluster.ssh_client_pool.borrow(
+            user=user,
+            host=host,
+            identity_file=identity_file) as client:
+        for service in services:
+            with tracing.span(get_service_phase(service, 'configure'), host=host):
+                service.configure(
+                    ssh_client=client,
+                    cluster=cluster)
+
 
 def start_node(
         *,
@@ -549,47 +1120,54 @@ def start_node(
     This method is role-agnostic; it runs on both the cluster master and slaves.
     This method is meant to be called asynchronously.
     """
-    ssh_client = get_ssh_client(
-        user=user,
-        host=host,
-        identity_file=identity_file,
-        wait=True)
-
-    with ssh_client:
+    with cluster.ssh_client_pool.borrow(
+            user=user,
+            host=host,
+            identity_file=identity_file,
+            wait=True,
+            is_booted=functools.partial(cluster.host_is_booted, host)) as ssh_client:
         # TODO: Consider consolidating ephemeral storage code under a dedicated
         #       Flintrock service.
         if cluster.storage_dirs.ephemeral:
-            ssh_check_output(
+            ssh_check_steps(
                 client=ssh_client,
-                command="""
-                    sudo chown "{u}:{u}" {d}
-                """.format(
-                    u=user,
-                    d=' '.join(cluster.storage_dirs.ephemeral)))
+                steps=[
+                    RemoteStep(
+                        name='ephemeral-storage',
+                        command="""
+                            sudo chown "{u}:{u}" {d}
+                        """.format(
+                            u=user,
+                            d=' '.join(cluster.storage_dirs.ephemeral)))])
 
         for service in services:
-            service.configure(
-                ssh_client=ssh_client,
-                cluster=cluster)
+            with tracing.span(get_service_phase(service, 'configure'), host=host):
+                service.configure(
+                    ssh_client=ssh_client,
+                    cluster=cluster)
 
 
-def run_command_node(*, user: str, host: str, identity_file: str, command: tuple):
+def run_command_node(
+        *,
+        user: str,
+        host: str,
+        identity_file: str,
+        command: tuple,
+        cluster: FlintrockCluster):
     """
     Run a shell command on a node.
 
     This method is role-agnostic; it runs on both the cluster master and slaves.
     This method is meant to be called asynchronously.
     """
-    ssh_client = get_ssh_client(
-        user=user,
-        host=host,
-        identity_file=identity_file)
-
     print("[{h}] Running command...".format(h=host))
 
     command_str = ' '.join(command)
 
-    with ssh_client:
+    with cluster.ssh_client_pool.borrow(
+            user=user,
+            host=host,
+            identity_file=identity_file) as ssh_client:
         ssh_check_output(
             client=ssh_client,
             command=command_str)
@@ -603,19 +1181,18 @@ def copy_file_node(
         host: str,
         identity_file: str,
         local_path: str,
-        remote_path: str):
+        remote_path: str,
+        cluster: FlintrockCluster):
     """
     Copy a file to the specified remote path on a node.
 
     This method is role-agnostic; it runs on both the cluster master and slaves.
     This method is meant to be called asynchronously.
     """
-    ssh_client = get_ssh_client(
-        user=user,
-        host=host,
-        identity_file=identity_file)
-
-    with ssh_client:
+    with cluster.ssh_client_pool.borrow(
+            user=user,
+            host=host,
+            identity_file=identity_file) as ssh_client:
         remote_dir = posixpath.dirname(remote_path)
 
         try:
@@ -640,4 +1217,4 @@ def copy_file_node(
 # core.py and services.py. I've thought about how to remove this circular dependency,
 # but for now this seems like what we need to go with.
 # Flintrock modules
-from .services import HDFS, Spark  # Used by start_cluster()
+from .services import HDFS, Spark  # Registers the services start() uses.
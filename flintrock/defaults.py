@@ -0,0 +1,15 @@
+"""
+Defaults that both the command-line interface and the rest of Flintrock use.
+
+This module mustn't import anything slow, since the CLI imports it on every
+invocation.
+"""
+
+# The maximum number of hosts we talk to at once. Every host we are talking to
+# ties up a thread and an SSH session, so this is what keeps the client's thread
+# count and memory use flat as clusters get bigger.
+DEFAULT_MAX_PARALLEL = 128
+
+# How long, in seconds, we give a node launched with --bootstrap to install its
+# services once we can SSH in. Building Spark from Git alone can take 20 minutes.
+DEFAULT_BOOTSTRAP_TIMEOUT = 60 * 60
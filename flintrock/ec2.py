@@ -1,6 +1,9 @@
+import base64
 import functools
+import math
 import string
 import sys
+import threading
 import time
 import urllib.request
 from collections import namedtuple
@@ -8,13 +11,15 @@ from datetime import datetime
 import socket
 
 # External modules
-import boto3
 import botocore
 import click
 
 # Flintrock modules
+from . import tracing
 from .core import FlintrockCluster
-from .core import provision_cluster
+from .core import bake_node, get_bootstrap_user_data, get_service_manifest, provision_cluster
+from .core import DEFAULT_BOOTSTRAP_TIMEOUT, DEFAULT_MAX_PARALLEL
+from .ec2_gateway import DEFAULT_MAX_PARALLEL_CALLS, get_gateway
 from .exceptions import (
     Error,
     ClusterNotFound,
@@ -22,6 +27,23 @@ from .exceptions import (
     ClusterInvalidState,
     NothingToDo)
 from .ssh import generate_ssh_key_pair
+from .state_cache import DEFAULT_TTL
+
+
+# How long we reuse the results of a batched instance status check.
+INSTANCE_STATUS_TTL = 5
+# How many instances we terminate per call while destroying a cluster.
+TERMINATE_BATCH_SIZE = 50
+# How long we keep trying to delete a cluster's security group while its
+# instances shut down.
+SECURITY_GROUP_DELETE_TIMEOUT = 600
+# While EC2 is still running its reachability check, we assume an instance has
+# booted once it has been running for this long.
+INSTANCE_BOOT_GRACE_PERIOD = 30
+# How often we check on a machine image that's being created.
+IMAGE_POLL_INTERVAL = 15
+# EC2 won't take more user data than this.
+MAX_USER_DATA_SIZE = 16 * 1024
 
 
 class NoDefaultVPC(Error):
@@ -44,13 +66,35 @@ def timeit(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         start = datetime.now().replace(microsecond=0)
-        res = func(*args, **kwargs)
+        with tracing.span(func.__name__):
+            res = func(*args, **kwargs)
         end = datetime.now().replace(microsecond=0)
         print("{f} finished in {t}.".format(f=func.__name__, t=(end - start)))
         return res
     return wrapper
 
 
+ClusterMetadata = namedtuple(
+    'ClusterMetadata', [
+        'subnet_is_private',
+        'master_ip',
+        'master_host',
+        'slave_ips',
+        'slave_hosts'])
+
+# The parts of an EC2 instance we keep in the state cache, named like the
+# attributes of a boto3 instance so the two can be used interchangeably.
+CachedInstance = namedtuple(
+    'CachedInstance', [
+        'id',
+        'state',
+        'subnet_id',
+        'public_ip_address',
+        'public_dns_name',
+        'private_ip_address',
+        'private_dns_name'])
+
+
 class EC2Cluster(FlintrockCluster):
     def __init__(
             self,
@@ -65,43 +109,119 @@ class EC2Cluster(FlintrockCluster):
         self.vpc_id = vpc_id
         self.master_instance = master_instance
         self.slave_instances = slave_instances
+        self._metadata = None
+        self._subnet_privacy = None
+        self._instance_statuses = {}
+        self._instance_statuses_checked_at = 0
+        self._instance_status_lock = threading.Lock()
+        # The manifests of the services installed on the cluster, if the state
+        # cache told us about them.
+        self.service_manifests = None
 
     @property
     def instances(self):
         return [self.master_instance] + self.slave_instances
 
     @property
-    def master_ip(self):
-        if self.subnet_is_private:
-            return self.master_instance.private_ip_address
+    def metadata(self) -> ClusterMetadata:
+        """
+        A snapshot of the cluster's addresses and hostnames.
+
+        The snapshot is taken the first time it's needed and then reused, since
+        we read these addresses for every node we touch and we don't want to hit
+        AWS each time. It's refreshed in wait_for_state(). Anything else that
+        changes the cluster's instances must call invalidate_metadata().
+        """
+        if self._metadata is None:
+            self.refresh_metadata()
+        return self._metadata
+
+    def refresh_metadata(self):
+        """
+        Take a new snapshot of the cluster's addresses and hostnames from the
+        current instance objects.
+
+        Subnet privacy is looked up in AWS only once per subnet.
+        """
+        if self._lookup_subnet_is_private():
+            self._metadata = ClusterMetadata(
+                subnet_is_private=True,
+                master_ip=self.master_instance.private_ip_address,
+                master_host=self.master_instance.private_dns_name,
+                slave_ips=[i.private_ip_address for i in self.slave_instances],
+                slave_hosts=[i.private_dns_name for i in self.slave_instances])
         else:
-            return self.master_instance.public_ip_address
+            self._metadata = ClusterMetadata(
+                subnet_is_private=False,
+                master_ip=self.master_instance.public_ip_address,
+                master_host=self.master_instance.public_dns_name,
+                slave_ips=[i.public_ip_address for i in self.slave_instances],
+                slave_hosts=[i.public_dns_name for i in self.slave_instances])
+
+        self._template_mappings.clear()
+
+    def _lookup_subnet_is_private(self) -> bool:
+        subnet_id = self.master_instance.subnet_id
+        if self._subnet_privacy is None or self._subnet_privacy[0] != subnet_id:
+            gateway = get_gateway(self.region)
+            subnet = gateway.call(
+                gateway.client.describe_subnets,
+                SubnetIds=[subnet_id])['Subnets'][0]
+            self._subnet_privacy = (
+                subnet_id,
+                not subnet['MapPublicIpOnLaunch'])
+        return self._subnet_privacy[1]
+
+    def get_cache_entry(self) -> dict:
+        """
+        Describe the cluster for the state cache, with everything we need to
+        rebuild it later without calling AWS.
+        """
+        def describe_instance(instance) -> dict:
+            return {
+                'id': instance.id,
+                'state': instance.state['Name'],
+                'subnet_id': instance.subnet_id,
+                'public_ip_address': instance.public_ip_address,
+                'public_dns_name': instance.public_dns_name,
+                'private_ip_address': instance.private_ip_address,
+                'private_dns_name': instance.private_dns_name,
+            }
+
+        return {
+            'vpc_id': self.vpc_id,
+            'master': describe_instance(self.master_instance),
+            'slaves': [describe_instance(i) for i in self.slave_instances],
+            'subnet_is_private': self._lookup_subnet_is_private(),
+        }
+
+    def invalidate_metadata(self):
+        """
+        Drop the cluster's metadata snapshot, along with anything derived from
+        it. The next read will take a fresh snapshot.
+        """
+        self._metadata = None
+        self._template_mappings.clear()
+
+    @property
+    def master_ip(self):
+        return self.metadata.master_ip
 
     @property
     def master_host(self):
-        if self.subnet_is_private:
-            return self.master_instance.private_dns_name
-        else:
-            return self.master_instance.public_dns_name
+        return self.metadata.master_host
 
     @property
     def slave_ips(self):
-        if self.subnet_is_private:
-            return [i.private_ip_address for i in self.slave_instances]
-        else:
-            return [i.public_ip_address for i in self.slave_instances]
+        return self.metadata.slave_ips
 
     @property
     def slave_hosts(self):
-        if self.subnet_is_private:
-            return [i.private_dns_name for i in self.slave_instances]
-        else:
-            return [i.public_dns_name for i in self.slave_instances]
+        return self.metadata.slave_hosts
 
     @property
     def subnet_is_private(self):
-        ec2 = boto3.resource(service_name='ec2', region_name=self.region)
-        return not ec2.Subnet(self.master_instance.subnet_id).map_public_ip_on_launch
+        return self.metadata.subnet_is_private
 
     @property
     def state(self):
@@ -119,55 +239,214 @@ class EC2Cluster(FlintrockCluster):
         separate matter.
 
         This method updates the cluster's instance metadata and
-        master and slave IP addresses and hostnames.
+        refreshes the snapshot of master and slave IP addresses
+        and hostnames.
         """
-        ec2 = boto3.resource(service_name='ec2', region_name=self.region)
+        gateway = get_gateway(self.region)
 
         while any([i.state['Name'] != state for i in self.instances]):
             # Update metadata for all instances in one shot. We don't want
             # to make a call to AWS for each of potentially hundreds of
             # instances.
-            instances = list(
-                ec2.instances.filter(
-                    InstanceIds=[i.id for i in self.instances]))
-            (self.master_instance, self.slave_instances) = _get_cluster_master_slaves(instances)
+            instances = gateway.get_instances(
+                instance_ids=[i.id for i in self.instances])
+            (self.master_instance, self.slave_instances) = _get_cluster_master_slaves(
+                instances,
+                # Image builders are master-only clusters.
+                allow_no_slaves=not self.slave_instances)
             time.sleep(3)
 
-    def destroy(self):
+        self.refresh_metadata()
+
+    def iter_running_hosts(self) -> 'Iterator[str]':
+        """
+        Wait for the cluster's instances to reach the running state, and yield
+        the address of each instance as soon as it gets there.
+
+        Like wait_for_state(), this method updates the cluster's instance
+        metadata. By the time the iterator is exhausted, the snapshot of
+        master and slave addresses is up-to-date.
+        """
+        gateway = get_gateway(self.region)
+        pending_ids = {i.id for i in self.instances}
+        subnet_is_private = self._lookup_subnet_is_private()
+
+        while pending_ids:
+            # As in wait_for_state(), we update metadata for all instances in
+            # one shot.
+            instances = {
+                i.id: i for i in gateway.get_instances(
+                    instance_ids=[i.id for i in self.instances])}
+            self.master_instance = instances.get(self.master_instance.id, self.master_instance)
+            self.slave_instances = [instances.get(i.id, i) for i in self.slave_instances]
+
+            for instance in self.instances:
+                if instance.id not in pending_ids:
+                    continue
+                if instance.state['Name'] in ['shutting-down', 'terminated']:
+                    raise Error(
+                        "Instance {i} is {s} and will not come up."
+                        .format(i=instance.id, s=instance.state['Name']))
+                if instance.state['Name'] == 'running':
+                    pending_ids.remove(instance.id)
+                    if subnet_is_private:
+                        yield instance.private_ip_address
+                    else:
+                        yield instance.public_ip_address
+
+            if pending_ids:
+                time.sleep(3)
+
+        self.refresh_metadata()
+
+    def _get_instance_statuses(self) -> dict:
+        """
+        Get the status of every instance in the cluster.
+
+        Many threads ask about their own hosts at once while we wait for SSH,
+        so we look up all the instances together and share the results for a
+        few seconds rather than making a call per host.
+        """
+        with self._instance_status_lock:
+            if time.time() - self._instance_statuses_checked_at > INSTANCE_STATUS_TTL:
+                gateway = get_gateway(self.region)
+                statuses = {}
+                # describe_instance_status() takes at most 100 instance IDs per call.
+                for response in gateway.call_in_batches(
+                        gateway.client.describe_instance_status,
+                        'InstanceIds',
+                        [i.id for i in self.instances],
+                        batch_size=100,
+                        IncludeAllInstances=True):
+                    for status in response['InstanceStatuses']:
+                        statuses[status['InstanceId']] = status
+                self._instance_statuses = statuses
+                self._instance_statuses_checked_at = time.time()
+            return self._instance_statuses
+
+    def host_is_booted(self, host: str) -> bool:
+        instances = [
+            i for i in self.instances
+            if host in [i.public_ip_address, i.private_ip_address]]
+        if not instances:
+            return True
+        instance = instances[0]
+
+        try:
+            status = self._get_instance_statuses().get(instance.id)
+        except botocore.exceptions.ClientError as e:
+            # Not every IAM policy allows this call. We can still connect without it.
+            if e.response['Error']['Code'] == 'UnauthorizedOperation':
+                return True
+            raise
+
+        if status is None or status['InstanceState']['Name'] != 'running':
+            return False
+
+        reachability = [
+            detail['Status'] for detail in status['InstanceStatus'].get('Details', [])
+            if detail['Name'] == 'reachability']
+        if 'failed' in reachability:
+            raise Error(
+                "Instance {i} ({h}) failed its EC2 reachability check."
+                .format(i=instance.id, h=host))
+        elif 'passed' in reachability:
+            return True
+        else:
+            running_for = (
+                datetime.now(tz=instance.launch_time.tzinfo) - instance.launch_time
+            ).total_seconds()
+            return running_for >= INSTANCE_BOOT_GRACE_PERIOD
+
+    @timeit
+    def destroy(self, *, state_cache: 'StateCache'=None):
+        """
+        Terminate the cluster's instances and delete its security group.
+
+        Instances take a while to release the group after they're terminated.
+        If a state cache is provided, we don't wait for them. We record the
+        group in the cache instead, and delete_pending_security_groups() deletes
+        it later.
+        """
         self.destroy_check()
         super().destroy()
-        ec2 = boto3.resource(service_name='ec2', region_name=self.region)
+        gateway = get_gateway(self.region)
+        instance_ids = [instance.id for instance in self.instances]
 
         # TODO: Centralize logic to get Flintrock base security group. (?)
-        flintrock_base_group = list(
-            ec2.security_groups.filter(
-                Filters=[
-                    {'Name': 'group-name', 'Values': ['flintrock']},
-                    {'Name': 'vpc-id', 'Values': [self.vpc_id]},
-                ]))[0]
+        flintrock_base_group = gateway.get_security_group(
+            name='flintrock',
+            vpc_id=self.vpc_id)
+        # TODO: Centralize logic to get cluster security group name from cluster name.
+        cluster_group = gateway.get_security_group(
+            name='flintrock-' + self.name,
+            vpc_id=self.vpc_id)
 
         # We "unassign" the cluster security group here (i.e. the
         # 'flintrock-clustername' group) so that we can immediately delete it once
         # the instances are terminated. If we don't do this, we get dependency
         # violations for a couple of minutes before we can actually delete the group.
-        # TODO: Is there a way to do this in one call for all instances?
-        #       Do we need to throttle these calls?
-        for instance in self.instances:
-            instance.modify_attribute(
+        # EC2 has no batch version of this call, so we split the instances into
+        # batches and work through the batches concurrently. Each batch is
+        # terminated as soon as its own instances are detached, instead of
+        # waiting for the whole cluster.
+        def detach(instance_id):
+            gateway.client.modify_instance_attribute(
+                InstanceId=instance_id,
                 Groups=[flintrock_base_group.id])
 
-        # TODO: Centralize logic to get cluster security group name from cluster name.
-        cluster_group = list(
-            ec2.security_groups.filter(
-                Filters=[
-                    {'Name': 'group-name', 'Values': ['flintrock-' + self.name]},
-                    {'Name': 'vpc-id', 'Values': [self.vpc_id]},
-                ]))[0]
-        cluster_group.delete()
-
-        (ec2.instances
-            .filter(InstanceIds=[instance.id for instance in self.instances])
-            .terminate())
+        num_terminated = 0
+        progress_lock = threading.Lock()
+
+        def detach_and_terminate(batch):
+            nonlocal num_terminated
+            for instance_id in batch:
+                try:
+                    gateway.call(detach, instance_id)
+                except botocore.exceptions.ClientError as e:
+                    # The instance will still release the group once it's terminated.
+                    print(
+                        "Could not detach {i} from {g}: {e}"
+                        .format(i=instance_id, g=cluster_group.group_name, e=e),
+                        file=sys.stderr)
+            gateway.call(gateway.client.terminate_instances, InstanceIds=batch)
+            with progress_lock:
+                num_terminated += len(batch)
+                print("{t} of {n} instances terminated.".format(
+                    t=num_terminated,
+                    n=len(instance_ids)))
+
+        # Small clusters get small batches, so that every call we're allowed to
+        # have in flight has an instance to work on.
+        batch_size = max(1, min(
+            TERMINATE_BATCH_SIZE,
+            math.ceil(len(instance_ids) / DEFAULT_MAX_PARALLEL_CALLS)))
+
+        print("Terminating {n} instances...".format(n=len(instance_ids)))
+        gateway.map(
+            detach_and_terminate,
+            [
+                instance_ids[start:start + batch_size]
+                for start in range(0, len(instance_ids), batch_size)])
+
+        if state_cache is None:
+            _delete_security_group(
+                gateway=gateway,
+                group=cluster_group,
+                timeout=SECURITY_GROUP_DELETE_TIMEOUT)
+        elif _try_delete_security_group(gateway=gateway, group_id=cluster_group.id):
+            print("Security group {g} deleted.".format(g=cluster_group.group_name))
+        else:
+            state_cache.add_pending_security_group(
+                provider='ec2',
+                region=self.region,
+                group_id=cluster_group.id,
+                group_name=cluster_group.group_name)
+            print(
+                "Security group {g} is still in use by the terminated instances. "
+                "Flintrock will delete it the next time you launch or destroy a "
+                "cluster in {r}."
+                .format(g=cluster_group.group_name, r=self.region))
 
     def start_check(self):
         if self.state == 'running':
@@ -178,18 +457,20 @@ class EC2Cluster(FlintrockCluster):
                 state=self.state)
 
     @timeit
-    def start(self, *, user: str, identity_file: str):
+    def start(self, *, user: str, identity_file: str, max_parallel: int=DEFAULT_MAX_PARALLEL):
         # TODO: Do these _check() methods make sense here?
         self.start_check()
-        ec2 = boto3.resource(service_name='ec2', region_name=self.region)
-        (ec2.instances
-            .filter(InstanceIds=[instance.id for instance in self.instances])
-            .start())
+        gateway = get_gateway(self.region)
+        gateway.call_in_batches(
+            gateway.client.start_instances,
+            'InstanceIds',
+            [instance.id for instance in self.instances])
         self.wait_for_state('running')
 
         super().start(
             user=user,
-            identity_file=identity_file)
+            identity_file=identity_file,
+            max_parallel=max_parallel)
 
     def stop_check(self):
         if self.state == 'stopped':
@@ -204,10 +485,11 @@ class EC2Cluster(FlintrockCluster):
         self.stop_check()
         super().stop()
 
-        ec2 = boto3.resource(service_name='ec2', region_name=self.region)
-        (ec2.instances
-            .filter(InstanceIds=[instance.id for instance in self.instances])
-            .stop())
+        gateway = get_gateway(self.region)
+        gateway.call_in_batches(
+            gateway.client.stop_instances,
+            'InstanceIds',
+            [instance.id for instance in self.instances])
         self.wait_for_state('stopped')
 
     def run_command_check(self):
@@ -217,13 +499,21 @@ class EC2Cluster(FlintrockCluster):
                 state=self.state)
 
     @timeit
-    def run_command(self, *, master_only, command, user, identity_file):
+    def run_command(
+            self,
+            *,
+            master_only,
+            command,
+            user,
+            identity_file,
+            max_parallel=DEFAULT_MAX_PARALLEL):
         self.run_command_check()
         super().run_command(
             master_only=master_only,
             user=user,
             identity_file=identity_file,
-            command=command)
+            command=command,
+            max_parallel=max_parallel)
 
     def copy_file_check(self):
         if self.state != 'running':
@@ -232,14 +522,23 @@ class EC2Cluster(FlintrockCluster):
                 state=self.state)
 
     @timeit
-    def copy_file(self, *, local_path, remote_path, master_only=False, user, identity_file):
+    def copy_file(
+            self,
+            *,
+            local_path,
+            remote_path,
+            master_only=False,
+            user,
+            identity_file,
+            max_parallel=DEFAULT_MAX_PARALLEL):
         self.copy_file_check()
         super().copy_file(
             master_only=master_only,
             user=user,
             identity_file=identity_file,
             local_path=local_path,
-            remote_path=remote_path)
+            remote_path=remote_path,
+            max_parallel=max_parallel)
 
     def print(self):
         """
@@ -257,18 +556,100 @@ class EC2Cluster(FlintrockCluster):
         if self.state == 'running':
             print('  master:', self.master_host)
             print('\n    - '.join(['  slaves:'] + self.slave_hosts))
+        if self.service_manifests is not None:
+            print('\n    - '.join(['  services:'] + [
+                '{n} {v}'.format(
+                    n=service_name,
+                    v=manifest.get('version') or manifest.get('git_commit'))
+                for (service_name, manifest) in self.service_manifests]))
         # print('...')
 
 
+def _delete_security_group(
+        *,
+        gateway: 'EC2Gateway',
+        group: 'boto3.resources.factory.ec2.SecurityGroup',
+        timeout: float):
+    """
+    Delete a security group, waiting for any instances still using it to let
+    go of it first.
+    """
+    start = time.time()
+    delay = 1
+
+    while not _try_delete_security_group(gateway=gateway, group_id=group.id):
+        if time.time() - start + delay > timeout:
+            raise Error(
+                "Could not delete security group {g} after {t} seconds. "
+                "It is still in use."
+                .format(g=group.group_name, t=timeout))
+        if delay == 1:
+            print("Waiting for instances to release security group {g}...".format(
+                g=group.group_name))
+        time.sleep(delay)
+        delay = min(delay * 2, 15)
+
+    print("Security group {g} deleted after {t:.1f} seconds.".format(
+        g=group.group_name,
+        t=time.time() - start))
+
+
+def _try_delete_security_group(*, gateway: 'EC2Gateway', group_id: str) -> bool:
+    """
+    Delete a security group unless something is still using it. Return whether
+    the group is gone.
+    """
+    try:
+        gateway.call(gateway.client.delete_security_group, GroupId=group_id)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == 'InvalidGroup.NotFound':
+            return True
+        elif e.response['Error']['Code'] == 'DependencyViolation':
+            return False
+        raise
+    return True
+
+
+def delete_pending_security_groups(*, region: str, state_cache: 'StateCache'):
+    """
+    Delete the security groups that destroy() left behind in a region, if
+    their instances have released them by now.
+
+    This is housekeeping for whatever command we're running, so we warn about
+    any group we can't delete and keep it for next time instead of failing.
+    """
+    pending_groups = state_cache.get_pending_security_groups(provider='ec2', region=region)
+    if not pending_groups:
+        return
+
+    gateway = get_gateway(region)
+    for (group_id, group_name) in sorted(pending_groups.items()):
+        try:
+            deleted = _try_delete_security_group(gateway=gateway, group_id=group_id)
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            print(
+                "Warning: Could not delete security group {g} left over from an "
+                "earlier destroy: {e}".format(g=group_name, e=e),
+                file=sys.stderr)
+            continue
+        if deleted:
+            state_cache.remove_pending_security_group(
+                provider='ec2',
+                region=region,
+                group_id=group_id)
+            print("Security group {g} deleted.".format(g=group_name))
+
+
 def get_default_vpc(region: str) -> 'boto3.resources.factory.ec2.Vpc':
     """
     Get the user's default VPC in the provided region.
     """
-    ec2 = boto3.resource(service_name='ec2', region_name=region)
+    gateway = get_gateway(region)
 
-    default_vpc = list(
-        ec2.vpcs.filter(
-            Filters=[{'Name': 'isDefault', 'Values': ['true']}]))
+    default_vpc = gateway.call(
+        lambda: list(
+            gateway.resource.vpcs.filter(
+                Filters=[{'Name': 'isDefault', 'Values': ['true']}])))
 
     if default_vpc:
         return default_vpc[0]
@@ -283,9 +664,13 @@ def check_network_config(*, region_name: str, vpc_id: str, subnet_id: str):
 
     Currently, Flintrock requires DNS names and public IPs to be enabled.
     """
-    ec2 = boto3.resource(service_name='ec2', region_name=region_name)
+    gateway = get_gateway(region_name)
 
-    if not ec2.Vpc(vpc_id).describe_attribute(Attribute='enableDnsHostnames')['EnableDnsHostnames']['Value']:
+    dns_hostnames = gateway.call(
+        gateway.client.describe_vpc_attribute,
+        VpcId=vpc_id,
+        Attribute='enableDnsHostnames')
+    if not dns_hostnames['EnableDnsHostnames']['Value']:
         raise ConfigurationNotSupported(
             "{v} does not have DNS hostnames enabled. "
             "Flintrock requires DNS hostnames to be enabled.\n"
@@ -303,7 +688,7 @@ def get_or_create_ec2_security_groups(
     If they do not already exist, create all the security groups needed for a
     Flintrock cluster.
     """
-    ec2 = boto3.resource(service_name='ec2', region_name=region)
+    gateway = get_gateway(region)
 
     SecurityGroupRule = namedtuple(
         'SecurityGroupRule', [
@@ -320,26 +705,19 @@ def get_or_create_ec2_security_groups(
 
     # The Flintrock group is common to all Flintrock clusters and authorizes client traffic
     # to them.
-    flintrock_group = list(
-        ec2.security_groups.filter(
-            Filters=[
-                {'Name': 'group-name', 'Values': [flintrock_group_name]},
-                {'Name': 'vpc-id', 'Values': [vpc_id]},
-            ]))
-    flintrock_group = flintrock_group[0] if flintrock_group else None
+    flintrock_group = gateway.get_security_group(
+        name=flintrock_group_name,
+        vpc_id=vpc_id)
 
     # The cluster group is specific to one Flintrock cluster and authorizes intra-cluster
     # communication.
-    cluster_group = list(
-        ec2.security_groups.filter(
-            Filters=[
-                {'Name': 'group-name', 'Values': [cluster_group_name]},
-                {'Name': 'vpc-id', 'Values': [vpc_id]},
-            ]))
-    cluster_group = cluster_group[0] if cluster_group else None
+    cluster_group = gateway.get_security_group(
+        name=cluster_group_name,
+        vpc_id=vpc_id)
 
     if not flintrock_group:
-        flintrock_group = ec2.create_security_group(
+        flintrock_group = gateway.call(
+            gateway.resource.create_security_group,
             GroupName=flintrock_group_name,
             Description="Flintrock base group",
             VpcId=vpc_id)
@@ -398,28 +776,55 @@ def get_or_create_ec2_security_groups(
                 src_group=None)
         ])
 
-    # TODO: Don't try adding rules that already exist.
-    # TODO: Add rules in one shot.
-    for rule in client_rules:
+    existing_rules = {
+        (permission['IpProtocol'],
+         permission.get('FromPort'),
+         permission.get('ToPort'),
+         ip_range['CidrIp'])
+        for permission in flintrock_group.ip_permissions
+        for ip_range in permission.get('IpRanges', [])}
+    new_rules = [
+        rule for rule in client_rules
+        if (rule.ip_protocol, rule.from_port, rule.to_port, rule.cidr_ip) not in existing_rules]
+
+    def authorize_client_rules(rules):
+        gateway.call(
+            flintrock_group.authorize_ingress,
+            IpPermissions=[
+                {
+                    'IpProtocol': rule.ip_protocol,
+                    'FromPort': rule.from_port,
+                    'ToPort': rule.to_port,
+                    'IpRanges': [{'CidrIp': rule.cidr_ip}]
+                }
+                for rule in rules])
+
+    if new_rules:
         try:
-            flintrock_group.authorize_ingress(
-                IpProtocol=rule.ip_protocol,
-                FromPort=rule.from_port,
-                ToPort=rule.to_port,
-                CidrIp=rule.cidr_ip)
+            authorize_client_rules(new_rules)
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] != 'InvalidPermission.Duplicate':
-                raise Exception("Error adding rule: {r}".format(r=rule))
+                raise Exception("Error adding rules: {r}".format(r=new_rules)) from e
+            # Someone else added one of these rules since we looked. EC2 rejects
+            # the whole batch in that case, so we fall back to one rule at a time.
+            for rule in new_rules:
+                try:
+                    authorize_client_rules([rule])
+                except botocore.exceptions.ClientError as e:
+                    if e.response['Error']['Code'] != 'InvalidPermission.Duplicate':
+                        raise Exception("Error adding rule: {r}".format(r=rule)) from e
 
     # Rules for internal cluster communication.
     if not cluster_group:
-        cluster_group = ec2.create_security_group(
+        cluster_group = gateway.call(
+            gateway.resource.create_security_group,
             GroupName=cluster_group_name,
             Description="Flintrock cluster group",
             VpcId=vpc_id)
 
     try:
-        cluster_group.authorize_ingress(
+        gateway.call(
+            cluster_group.authorize_ingress,
             IpPermissions=[
                 {
                     'IpProtocol': '-1',  # -1 means all
@@ -443,19 +848,16 @@ def get_ec2_block_device_mappings(
 
     This is how we configure storage on the instance.
     """
-    ec2 = boto3.resource(service_name='ec2', region_name=region)
+    gateway = get_gateway(region)
     block_device_mappings = []
     min_root_device_size_gb = 30
 
-    # An IndexError here is probably a sign of this problem:
-    # https://github.com/boto/boto3/issues/496
-    image = list(
-        ec2.images.filter(ImageIds=[ami]))[0]
+    image = gateway.get_image(ami)
 
-    if image.root_device_type == 'ebs':
+    if image['RootDeviceType'] == 'ebs':
         root_device = [
-            device for device in image.block_device_mappings
-            if device['DeviceName'] == image.root_device_name][0]
+            device for device in image['BlockDeviceMappings']
+            if device['DeviceName'] == image['RootDeviceName']][0]
         if root_device['Ebs']['VolumeSize'] < min_root_device_size_gb:
             root_device['Ebs'].update({
                 # Max root volume size for instance store-backed AMIs is 10 GiB.
@@ -499,9 +901,21 @@ def launch(
         placement_group,
         tenancy='default',
         ebs_optimized=False,
-        instance_initiated_shutdown_behavior='stop'):
+        instance_initiated_shutdown_behavior='stop',
+        max_parallel=DEFAULT_MAX_PARALLEL,
+        provision=True,
+        bootstrap=False,
+        bootstrap_timeout=DEFAULT_BOOTSTRAP_TIMEOUT) -> EC2Cluster:
     """
     Launch a cluster.
+
+    If provision is False, we launch the instances but leave setting them up
+    to the caller.
+
+    If bootstrap is True, we pass each instance a script as user data that has
+    it install the services itself when it boots, instead of installing them
+    over SSH. We wait up to bootstrap_timeout seconds for each instance to
+    finish.
     """
     if not vpc_id:
         vpc_id = get_default_vpc(region=region).id
@@ -544,7 +958,18 @@ def launch(
         else:
             raise
 
-    ec2 = boto3.resource(service_name='ec2', region_name=region)
+    gateway = get_gateway(region)
+    client = gateway.client
+
+    user_data = None
+    if bootstrap:
+        user_data = get_bootstrap_user_data(services=services, user=user)
+        if len(user_data) > MAX_USER_DATA_SIZE:
+            raise Error(
+                "The bootstrap script for these services is {s} bytes compressed, "
+                "which is more than the {m} bytes of user data EC2 accepts. "
+                "Launch without --bootstrap instead."
+                .format(s=len(user_data), m=MAX_USER_DATA_SIZE))
 
     num_instances = num_slaves + 1
     spot_requests = []
@@ -554,23 +979,28 @@ def launch(
         if spot_price:
             print("Requesting {c} spot instances at a max price of ${p}...".format(
                 c=num_instances, p=spot_price))
-            client = ec2.meta.client
-            spot_requests = client.request_spot_instances(
+            launch_specification = {
+                'ImageId': ami,
+                'KeyName': key_name,
+                'InstanceType': instance_type,
+                'BlockDeviceMappings': block_device_mappings,
+                'Placement': {
+                    'AvailabilityZone': availability_zone,
+                    'GroupName': placement_group},
+                'SecurityGroupIds': [sg.id for sg in security_groups],
+                'SubnetId': subnet_id,
+                'IamInstanceProfile': {
+                    'Name': instance_profile_name},
+                'EbsOptimized': ebs_optimized}
+            if user_data:
+                # Unlike create_instances(), this call doesn't encode user
+                # data for us.
+                launch_specification['UserData'] = base64.b64encode(user_data).decode('ascii')
+            spot_requests = gateway.call(
+                client.request_spot_instances,
                 SpotPrice=str(spot_price),
                 InstanceCount=num_instances,
-                LaunchSpecification={
-                    'ImageId': ami,
-                    'KeyName': key_name,
-                    'InstanceType': instance_type,
-                    'BlockDeviceMappings': block_device_mappings,
-                    'Placement': {
-                        'AvailabilityZone': availability_zone,
-                        'GroupName': placement_group},
-                    'SecurityGroupIds': [sg.id for sg in security_groups],
-                    'SubnetId': subnet_id,
-                    'IamInstanceProfile': {
-                        'Name': instance_profile_name},
-                    'EbsOptimized': ebs_optimized})['SpotInstanceRequests']
+                LaunchSpecification=launch_specification)['SpotInstanceRequests']
 
             request_ids = [r['SpotInstanceRequestId'] for r in spot_requests]
             pending_request_ids = request_ids
@@ -580,7 +1010,8 @@ def launch(
                     grant=num_instances - len(pending_request_ids),
                     req=num_instances))
                 time.sleep(30)
-                spot_requests = client.describe_spot_instance_requests(
+                spot_requests = gateway.call(
+                    client.describe_spot_instance_requests,
                     SpotInstanceRequestIds=request_ids)['SpotInstanceRequests']
 
                 failed_requests = [r for r in spot_requests if r['State'] == 'failed']
@@ -598,13 +1029,14 @@ def launch(
 
             print("All {c} instances granted.".format(c=num_instances))
 
-            cluster_instances = list(
-                ec2.instances.filter(
-                    InstanceIds=[r['InstanceId'] for r in spot_requests]))
+            cluster_instances = gateway.get_instances(
+                instance_ids=[r['InstanceId'] for r in spot_requests])
         else:
             print("Launching {c} instances...".format(c=num_instances))
 
-            cluster_instances = ec2.create_instances(
+            user_data_args = {'UserData': user_data} if user_data else {}
+            cluster_instances = gateway.call(
+                gateway.resource.create_instances,
                 MinCount=num_instances,
                 MaxCount=num_instances,
                 ImageId=ami,
@@ -620,25 +1052,28 @@ def launch(
                 IamInstanceProfile={
                     'Name': instance_profile_name},
                 EbsOptimized=ebs_optimized,
-                InstanceInitiatedShutdownBehavior=instance_initiated_shutdown_behavior)
+                InstanceInitiatedShutdownBehavior=instance_initiated_shutdown_behavior,
+                **user_data_args)
 
         time.sleep(10)  # AWS metadata eventual consistency tax.
 
         master_instance = cluster_instances[0]
         slave_instances = cluster_instances[1:]
 
-        (ec2.instances
-            .filter(InstanceIds=[master_instance.id])
-            .create_tags(
-                Tags=[
-                    {'Key': 'flintrock-role', 'Value': 'master'},
-                    {'Key': 'Name', 'Value': '{c}-master'.format(c=cluster_name)}]))
-        (ec2.instances
-            .filter(InstanceIds=[i.id for i in slave_instances])
-            .create_tags(
-                Tags=[
-                    {'Key': 'flintrock-role', 'Value': 'slave'},
-                    {'Key': 'Name', 'Value': '{c}-slave'.format(c=cluster_name)}]))
+        gateway.call_in_batches(
+            client.create_tags,
+            'Resources',
+            [master_instance.id],
+            Tags=[
+                {'Key': 'flintrock-role', 'Value': 'master'},
+                {'Key': 'Name', 'Value': '{c}-master'.format(c=cluster_name)}])
+        gateway.call_in_batches(
+            client.create_tags,
+            'Resources',
+            [i.id for i in slave_instances],
+            Tags=[
+                {'Key': 'flintrock-role', 'Value': 'slave'},
+                {'Key': 'Name', 'Value': '{c}-slave'.format(c=cluster_name)}])
 
         cluster = EC2Cluster(
             name=cluster_name,
@@ -648,13 +1083,18 @@ def launch(
             master_instance=master_instance,
             slave_instances=slave_instances)
 
-        cluster.wait_for_state('running')
-
-        provision_cluster(
-            cluster=cluster,
-            services=services,
-            user=user,
-            identity_file=identity_file)
+        if provision:
+            # We start provisioning each instance as soon as it's running, rather
+            # than waiting for the whole cluster to come up first.
+            provision_cluster(
+                cluster=cluster,
+                services=services,
+                user=user,
+                identity_file=identity_file,
+                hosts=cluster.iter_running_hosts(),
+                max_parallel=max_parallel,
+                bootstrap=bootstrap,
+                bootstrap_timeout=bootstrap_timeout)
 
     except (Exception, KeyboardInterrupt) as e:
         # TODO: Cleanup cluster security group here.
@@ -664,17 +1104,18 @@ def launch(
             request_ids = [r['SpotInstanceRequestId'] for r in spot_requests]
             if any([r['State'] != 'active' for r in spot_requests]):
                 print("Canceling spot instance requests...", file=sys.stderr)
-                client.cancel_spot_instance_requests(
+                gateway.call(
+                    client.cancel_spot_instance_requests,
                     SpotInstanceRequestIds=request_ids)
             # Make sure we have the latest information on any launched spot instances.
-            spot_requests = client.describe_spot_instance_requests(
+            spot_requests = gateway.call(
+                client.describe_spot_instance_requests,
                 SpotInstanceRequestIds=request_ids)['SpotInstanceRequests']
             instance_ids = [
                 r['InstanceId'] for r in spot_requests
                 if 'InstanceId' in r]
             if instance_ids:
-                cluster_instances = list(
-                    ec2.instances.filter(InstanceIds=instance_ids))
+                cluster_instances = gateway.get_instances(instance_ids=instance_ids)
 
         if cluster_instances:
             if not assume_yes:
@@ -686,33 +1127,174 @@ def launch(
 
             if assume_yes or yes:
                 print("Terminating instances...", file=sys.stderr)
-                (ec2.instances
-                    .filter(InstanceIds=[instance.id for instance in cluster_instances])
-                    .terminate())
+                gateway.call_in_batches(
+                    client.terminate_instances,
+                    'InstanceIds',
+                    [instance.id for instance in cluster_instances])
 
         raise
 
+    return cluster
+
 
-def get_cluster(*, cluster_name: str, region: str, vpc_id: str) -> EC2Cluster:
+def build_image(
+        *,
+        image_name: str,
+        services: list,
+        assume_yes: bool,
+        key_name: str,
+        identity_file: str,
+        instance_type: str,
+        region: str,
+        availability_zone: str,
+        ami: str,
+        user: str,
+        vpc_id: str,
+        subnet_id: str,
+        instance_profile_name: str) -> str:
+    """
+    Launch a builder instance, install the provided services on it, and make a
+    machine image from it. Clusters launched from the image skip installing
+    those services. Return the new image's ID.
+    """
+    gateway = get_gateway(region)
+    client = gateway.client
+
+    builder = launch(
+        cluster_name='image-builder-' + datetime.now().strftime('%Y%m%d%H%M%S'),
+        num_slaves=0,
+        services=services,
+        assume_yes=assume_yes,
+        key_name=key_name,
+        identity_file=identity_file,
+        instance_type=instance_type,
+        region=region,
+        availability_zone=availability_zone,
+        ami=ami,
+        user=user,
+        vpc_id=vpc_id,
+        subnet_id=subnet_id,
+        instance_profile_name=instance_profile_name,
+        placement_group='',
+        provision=False)
+
+    try:
+        builder.wait_for_state('running')
+        try:
+            bake_node(
+                services=services,
+                user=user,
+                host=builder.master_ip,
+                identity_file=identity_file,
+                cluster=builder)
+        finally:
+            builder.ssh_client_pool.close()
+
+        print("Creating image {n}...".format(n=image_name))
+        image_id = gateway.call(
+            client.create_image,
+            InstanceId=builder.master_instance.id,
+            Name=image_name,
+            Description="Flintrock image with {s}".format(
+                s=', '.join(
+                    '{n} {v}'.format(
+                        n=type(service).__name__,
+                        v=service.manifest.get('version') or service.manifest.get('git_commit'))
+                    for service in services)))['ImageId']
+        # Record what's on the image where people browsing their images can see it.
+        gateway.call(
+            client.create_tags,
+            Resources=[image_id],
+            Tags=[
+                {
+                    'Key': 'flintrock-baked-' + type(service).__name__.lower(),
+                    'Value': service.manifest.get('version') or service.manifest.get('git_commit'),
+                }
+                for service in services])
+
+        while True:
+            try:
+                image = gateway.call(client.describe_images, ImageIds=[image_id])['Images'][0]
+            except botocore.exceptions.ClientError as e:
+                # EC2 may not know about the image for a moment after it hands
+                # us its ID.
+                if e.response['Error']['Code'] != 'InvalidAMIID.NotFound':
+                    raise
+            else:
+                if image['State'] == 'available':
+                    break
+                elif image['State'] in ['failed', 'invalid', 'error']:
+                    raise Error(
+                        "EC2 failed to create image {i}: {r}".format(
+                            i=image_id,
+                            r=image.get('StateReason', {}).get('Message', image['State'])))
+            time.sleep(IMAGE_POLL_INTERVAL)
+
+        print("Image {i} is ready. Launch clusters with --ec2-ami {i} to use it.".format(i=image_id))
+        return image_id
+    finally:
+        print("Destroying image builder...")
+        builder.destroy()
+
+
+def get_cluster(
+        *,
+        cluster_name: str,
+        region: str,
+        vpc_id: str,
+        state_cache: 'StateCache'=None,
+        max_age: float=DEFAULT_TTL) -> EC2Cluster:
     """
     Get an existing EC2 cluster.
     """
     cluster = get_clusters(
         cluster_names=[cluster_name],
         region=region,
-        vpc_id=vpc_id)
+        vpc_id=vpc_id,
+        state_cache=state_cache,
+        max_age=max_age)
     return cluster[0]
 
 
-def get_clusters(*, cluster_names: list=[], region: str, vpc_id: str) -> list:
+def get_clusters(
+        *,
+        cluster_names: list=[],
+        region: str,
+        vpc_id: str,
+        state_cache: 'StateCache'=None,
+        max_age: float=DEFAULT_TTL) -> list:
     """
     Get all the named clusters. If no names are given, get all clusters.
 
     We do a little extra work here so that we only make one call to AWS
     regardless of how many clusters we have to look up. That's because querying
     AWS -- a network operation -- is by far the slowest step.
+
+    Better yet is not calling AWS at all. If a state cache is provided, we
+    answer from it when it has entries for all the clusters that are no older
+    than max_age seconds. Otherwise, we look the clusters up in AWS and record
+    them in the cache.
     """
-    ec2 = boto3.resource(service_name='ec2', region_name=region)
+    # We cache clusters under the VPC the caller asked for, which may be the
+    # default VPC, since looking up the default VPC would cost us a call.
+    cache_scope = {'provider': 'ec2', 'region': region, 'vpc_id': vpc_id}
+
+    if state_cache is not None and max_age > 0:
+        if cluster_names:
+            entries = {
+                name: state_cache.get_cluster(name=name, max_age=max_age, **cache_scope)
+                for name in cluster_names}
+            if None in entries.values():
+                entries = None
+        else:
+            entries = state_cache.get_clusters(max_age=max_age, **cache_scope)
+
+        if entries is not None:
+            return [
+                _compose_cluster_from_cache_entry(name=name, region=region, entry=entry)
+                for (name, entry) in entries.items()]
+
+    gateway = get_gateway(region)
     if not vpc_id:
         vpc_id = get_default_vpc(region=region).id
 
@@ -721,12 +1303,11 @@ def get_clusters(*, cluster_names: list=[], region: str, vpc_id: str) -> list:
     else:
         group_name_filter = ['flintrock']
 
-    all_clusters_instances = list(
-        ec2.instances.filter(
-            Filters=[
-                {'Name': 'instance.group-name', 'Values': group_name_filter},
-                {'Name': 'vpc-id', 'Values': [vpc_id]},
-            ]))
+    all_clusters_instances = gateway.get_instances(
+        filters=[
+            {'Name': 'instance.group-name', 'Values': group_name_filter},
+            {'Name': 'vpc-id', 'Values': [vpc_id]},
+        ])
 
     found_cluster_names = {
         _get_cluster_name(instance) for instance in all_clusters_instances}
@@ -747,9 +1328,36 @@ def get_clusters(*, cluster_names: list=[], region: str, vpc_id: str) -> list:
                 lambda x: _get_cluster_name(x) == cluster_name, all_clusters_instances)))
         for cluster_name in found_cluster_names]
 
+    if state_cache is not None:
+        # Cached clusters must not need to call AWS to work out their
+        # addresses, so we look up subnet privacy before caching them.
+        _look_up_subnet_privacy(clusters, gateway=gateway)
+        state_cache.put_clusters(
+            entries={cluster.name: cluster.get_cache_entry() for cluster in clusters},
+            complete=not cluster_names,
+            **cache_scope)
+
     return clusters
 
 
+def _look_up_subnet_privacy(clusters: list, *, gateway: 'EC2Gateway'):
+    """
+    Look up whether each cluster's subnet is private, with one call for all
+    the clusters' subnets.
+    """
+    subnet_ids = sorted({cluster.master_instance.subnet_id for cluster in clusters})
+    if not subnet_ids:
+        return
+    subnets = gateway.call(
+        gateway.client.describe_subnets,
+        SubnetIds=subnet_ids)['Subnets']
+    subnet_is_private = {
+        subnet['SubnetId']: not subnet['MapPublicIpOnLaunch'] for subnet in subnets}
+    for cluster in clusters:
+        subnet_id = cluster.master_instance.subnet_id
+        cluster._subnet_privacy = (subnet_id, subnet_is_private[subnet_id])
+
+
 def _get_cluster_name(instance: 'boto3.resources.factory.ec2.Instance') -> str:
     """
     Given an EC2 instance, get the name of the Flintrock cluster it belongs to.
@@ -763,10 +1371,15 @@ def _get_cluster_name(instance: 'boto3.resources.factory.ec2.Instance') -> str:
 
 
 def _get_cluster_master_slaves(
-        instances: list) -> ('boto3.resources.factory.ec2.Instance', list):
+        instances: list,
+        *,
+        allow_no_slaves: bool=False) -> ('boto3.resources.factory.ec2.Instance', list):
     """
     Get the master and slave instances from a set of raw EC2 instances representing
     a Flintrock cluster.
+
+    Set allow_no_slaves for clusters that were launched without any slaves, like
+    the one build_image() uses.
     """
     master_instance = None
     slave_instances = []
@@ -785,7 +1398,7 @@ def _get_cluster_master_slaves(
 
     if not master_instance:
         raise Exception("No master found.")
-    elif not slave_instances:
+    elif not slave_instances and not allow_no_slaves:
         raise Exception("No slaves found.")
 
     return (master_instance, slave_instances)
@@ -806,3 +1419,51 @@ def _compose_cluster(*, name: str, region: str, vpc_id: str, instances: list) ->
         slave_instances=slave_instances)
 
     return cluster
+
+
+def _compose_cluster_from_cache_entry(*, name: str, region: str, entry: dict) -> EC2Cluster:
+    """
+    Compose an EC2Cluster object from an entry in the state cache made by
+    EC2Cluster.get_cache_entry().
+    """
+    def load_instance(instance: dict) -> CachedInstance:
+        return CachedInstance(**dict(instance, state={'Name': instance['state']}))
+
+    cluster = EC2Cluster(
+        name=name,
+        region=region,
+        vpc_id=entry['vpc_id'],
+        master_instance=load_instance(entry['master']),
+        slave_instances=[load_instance(i) for i in entry['slaves']])
+
+    if entry['subnet_is_private'] is not None:
+        cluster._subnet_privacy = (
+            cluster.master_instance.subnet_id,
+            entry['subnet_is_private'])
+    cluster.service_manifests = entry['manifest']
+
+    return cluster
+
+
+def cache_cluster(
+        cluster: EC2Cluster,
+        *,
+        state_cache: 'StateCache',
+        vpc_id: str,
+        services: list=None):
+    """
+    Record a cluster in the state cache after we've changed it, along with the
+    services we installed on it, if we know them.
+
+    vpc_id is the VPC the user asked for, which may be empty for the default
+    VPC. See get_clusters().
+    """
+    state_cache.put_cluster(
+        provider='ec2',
+        region=cluster.region,
+        vpc_id=vpc_id,
+        name=cluster.name,
+        entry=cluster.get_cache_entry(),
+        manifest=(
+            [get_service_manifest(service) for service in services]
+            if services is not None else None))
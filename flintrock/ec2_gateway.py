@@ -0,0 +1,256 @@
+import concurrent.futures
+import copy
+import random
+import threading
+import time
+
+# External modules
+import boto3
+import botocore
+
+# Flintrock modules
+from . import api_stats
+
+# Error codes EC2 uses to tell us we're calling it too fast.
+# See: http://docs.aws.amazon.com/AWSEC2/latest/APIReference/query-api-troubleshooting.html
+THROTTLING_ERROR_CODES = {
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+}
+
+# The maximum number of per-resource calls we have in flight at once.
+DEFAULT_MAX_PARALLEL_CALLS = 16
+
+
+def is_throttling_error(error: Exception) -> bool:
+    return (
+        isinstance(error, botocore.exceptions.ClientError) and
+        error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES)
+
+
+class AdaptiveRateLimiter:
+    """
+    A client-side limit on how fast we call an API, which adapts to how fast
+    the API will let us go.
+
+    Every throttled call cuts the rate in half, and every successful call
+    raises it a little, up to max_rate. That way a large cluster operation
+    slows down as soon as it hits the account's limit, instead of retrying
+    into a wall of throttling errors.
+    """
+    def __init__(
+            self,
+            *,
+            rate: float=20,
+            min_rate: float=0.5,
+            max_rate: float=50,
+            burst: int=5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._next_slot = 0
+
+    def acquire(self):
+        """
+        Block until we're allowed to make another call.
+        """
+        with self._lock:
+            now = time.monotonic()
+            # Let calls that haven't been made recently go out in a short burst.
+            self._next_slot = max(self._next_slot, now - self.burst / self.rate)
+            wait = self._next_slot - now
+            self._next_slot += 1 / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 0.1)
+
+
+class EC2Gateway:
+    """
+    The one way Flintrock talks to EC2 in a given region.
+
+    Every call made through this gateway's client or resource waits its turn
+    with a shared AdaptiveRateLimiter. botocore's own retries of a call don't
+    wait on the limiter, since botocore has no per-attempt event we can hook
+    into in the version we pin. They back off on their own, though, and every
+    throttled attempt slows down the limiter for the calls that follow.
+    call() retries throttled calls with jittered backoff once botocore gives up,
+    and map() dispatches per-resource calls concurrently.
+    """
+    def __init__(
+            self,
+            region: str,
+            *,
+            max_attempts: int=8,
+            rate_limiter: AdaptiveRateLimiter=None):
+        self.region = region
+        self.max_attempts = max_attempts
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+
+        self.session = boto3.session.Session(region_name=region)
+        self.session.events.register(
+            'before-call.ec2', self._before_call, unique_id='flintrock-before-call')
+        self.session.events.register(
+            'needs-retry.ec2', self._needs_retry, unique_id='flintrock-needs-retry')
+        self.session.events.register(
+            'after-call.ec2', self._after_call, unique_id='flintrock-after-call')
+        api_stats.register_session(self.session)
+
+        self.resource = self.session.resource(service_name='ec2')
+        self.client = self.resource.meta.client
+
+        self._images = {}
+
+    def _before_call(self, **kwargs):
+        self.rate_limiter.acquire()
+
+    def _needs_retry(self, response=None, **kwargs):
+        # botocore retries throttled calls on its own. We just need to hear
+        # about them so we can slow down.
+        if response is not None:
+            (http_response, parsed) = response
+            if parsed.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+                self.rate_limiter.on_throttle()
+
+    def _after_call(self, parsed, **kwargs):
+        if 'Error' not in parsed:
+            self.rate_limiter.on_success()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func, which should make a single call to EC2 via this gateway, and
+        retry it with jittered backoff if it keeps getting throttled.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except botocore.exceptions.ClientError as e:
+                attempt += 1
+                if not is_throttling_error(e) or attempt >= self.max_attempts:
+                    raise
+                self.rate_limiter.on_throttle()
+                # See: https://www.awsarchitectureblog.com/2015/03/backoff.html
+                time.sleep(random.uniform(0, min(20, 2 ** attempt)))
+
+    def call_in_batches(
+            self,
+            func,
+            ids_param: str,
+            ids: list,
+            *,
+            batch_size: int=500,
+            **kwargs) -> list:
+        """
+        call() func with as many of the provided resource IDs at once as EC2
+        allows, passing them in as ids_param. Return each batch's response.
+        """
+        return [
+            self.call(func, **dict(kwargs, **{ids_param: ids[start:start + batch_size]}))
+            for start in range(0, len(ids), batch_size)]
+
+    def map(
+            self,
+            func,
+            items: list,
+            *,
+            max_parallel: int=DEFAULT_MAX_PARALLEL_CALLS) -> list:
+        """
+        call() func on each item concurrently, and return the results in the
+        same order as the items. If any call failed, raise the first error once
+        all the calls are done.
+
+        func should use this gateway's client, since boto3 resources are not
+        safe to share across threads.
+        """
+        if not items:
+            return []
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            futures = [executor.submit(self.call, func, item) for item in items]
+            concurrent.futures.wait(futures)
+
+        return [future.result() for future in futures]
+
+    def get_instances(
+            self,
+            *,
+            instance_ids: list=None,
+            filters: list=None) -> 'List[boto3.resources.factory.ec2.Instance]':
+        """
+        Look up instances by ID or by filter, in as few calls as EC2 allows.
+        """
+        filter_args = {}
+        if filters:
+            filter_args['Filters'] = filters
+
+        if instance_ids is None:
+            return self.call(
+                lambda: list(self.resource.instances.filter(**filter_args)))
+
+        instances = []
+        # Keep each request comfortably under EC2's limit on request size.
+        for start in range(0, len(instance_ids), 200):
+            instances.extend(
+                self.call(
+                    lambda: list(
+                        self.resource.instances.filter(
+                            InstanceIds=instance_ids[start:start + 200],
+                            **filter_args))))
+        return instances
+
+    def get_image(self, image_id: str) -> dict:
+        """
+        Describe an AMI. Images don't change, so we only look each one up once.
+        The caller gets its own copy of the description to modify.
+        """
+        if image_id not in self._images:
+            images = self.call(
+                self.client.describe_images,
+                ImageIds=[image_id])['Images']
+            # An IndexError here is probably a sign of this problem:
+            # https://github.com/boto/boto3/issues/496
+            self._images[image_id] = images[0]
+        return copy.deepcopy(self._images[image_id])
+
+    def get_security_group(
+            self,
+            *,
+            name: str,
+            vpc_id: str) -> 'boto3.resources.factory.ec2.SecurityGroup':
+        """
+        Look up a security group by name, or return None if it doesn't exist.
+        """
+        security_groups = self.call(
+            lambda: list(
+                self.resource.security_groups.filter(
+                    Filters=[
+                        {'Name': 'group-name', 'Values': [name]},
+                        {'Name': 'vpc-id', 'Values': [vpc_id]},
+                    ])))
+        return security_groups[0] if security_groups else None
+
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(region: str) -> EC2Gateway:
+    """
+    Get the shared gateway for the provided region, so that every call to a
+    region counts against the same rate limit.
+    """
+    with _gateways_lock:
+        if region not in _gateways:
+            _gateways[region] = EC2Gateway(region)
+        return _gateways[region]
@@ -41,3 +41,11 @@ class SSHError(Error):
             "[{h}] {m}".format(h=host, m=message))
         self.host = host
         self.message = message
+
+
+class ServiceNotReady(Error):
+    def __init__(self, *, service: str, message: str):
+        super().__init__(
+            "{s} did not become ready: {m}".format(s=service, m=message))
+        self.service = service
+        self.message = message
@@ -1,6 +1,7 @@
 import os
 import posixpath
 import errno
+import functools
 import json
 import resource
 import sys
@@ -15,14 +16,24 @@ import click
 import yaml
 
 # Flintrock modules
-from . import ec2
+# NOTE: Providers and services pull in boto3 and Paramiko, which are slow to
+#       import, so we import them only in the commands that use them. That
+#       keeps `flintrock --help` and scripted calls to Flintrock quick.
+from . import api_stats
+from . import tracing
 from .exceptions import (
     UsageError,
     UnsupportedProviderError,
     NothingToDo,
     Error)
 from flintrock import __version__
-from .services import HDFS, Spark  # TODO: Remove this dependency.
+from .artifacts import (
+    DEFAULT_HADOOP_DOWNLOAD_SOURCE,
+    LocalArtifactStore,
+    get_hadoop_artifact,
+    get_spark_artifact)
+from .defaults import DEFAULT_BOOTSTRAP_TIMEOUT, DEFAULT_MAX_PARALLEL
+from .state_cache import DEFAULT_TTL, StateCache
 
 FROZEN = getattr(sys, 'frozen', False)
 
@@ -153,9 +164,14 @@ def get_config_file() -> str:
 @click.group()
 @click.option('--config', default=get_config_file())
 @click.option('--provider', default='ec2', type=click.Choice(['ec2']))
+@click.option('--trace-file', type=click.Path(dir_okay=False, writable=True),
+              help="Record how long each phase takes on each host, and write the "
+                   "results to this file as a trace you can open in chrome://tracing.")
+@click.option('--api-stats', 'print_api_stats', is_flag=True, default=False,
+              help="Count the calls made to AWS, and print a summary of them when done.")
 @click.version_option(version=__version__)
 @click.pass_context
-def cli(cli_context, config, provider):
+def cli(cli_context, config, provider, trace_file, print_api_stats):
     """
     Flintrock
 
@@ -163,6 +179,18 @@ def cli(cli_context, config, provider):
     """
     cli_context.obj['provider'] = provider
 
+    if trace_file:
+        tracing.enable()
+    if trace_file or print_api_stats:
+        api_stats.enable()
+        # We report even if the command fails, since that's when we're most
+        # likely to want to know what happened.
+        cli_context.call_on_close(
+            functools.partial(
+                report_stats,
+                trace_file=trace_file,
+                print_api_stats=print_api_stats))
+
     if os.path.isfile(config):
         with open(config) as f:
             config_raw = yaml.safe_load(f)
@@ -174,6 +202,82 @@ def cli(cli_context, config, provider):
             raise FileNotFoundError(errno.ENOENT, 'No such file', config)
 
 
+def get_services(
+        *,
+        install_hdfs: bool,
+        hdfs_version: str,
+        hdfs_download_source: str,
+        hdfs_artifact_store: str,
+        install_spark: bool,
+        spark_version: str,
+        spark_git_commit: str,
+        spark_git_repository: str,
+        spark_git_build_cache: str,
+        spark_git_build_cache_s3_endpoint: str,
+        spark_artifact_store: str,
+        distribute_artifacts: bool=False) -> list:
+    """
+    Validate the service options shared by launch and build-image, and get
+    the services they call for.
+    """
+    services = []
+
+    option_requires(
+        option='--install-hdfs',
+        requires_all=['--hdfs-version'],
+        scope=locals())
+    option_requires(
+        option='--install-spark',
+        requires_any=[
+            '--spark-version',
+            '--spark-git-commit'],
+        scope=locals())
+    mutually_exclusive(
+        options=[
+            '--spark-version',
+            '--spark-git-commit'],
+        scope=locals())
+
+    from .services import HDFS, Spark
+
+    if install_hdfs:
+        hdfs = HDFS(
+            version=hdfs_version,
+            download_source=hdfs_download_source,
+            distribute_artifacts=distribute_artifacts,
+            artifact_store=hdfs_artifact_store)
+        services += [hdfs]
+    if install_spark:
+        if spark_version:
+            spark = Spark(
+                version=spark_version,
+                distribute_artifacts=distribute_artifacts,
+                artifact_store=spark_artifact_store)
+        elif spark_git_commit:
+            print(
+                "Warning: Building Spark takes a long time. "
+                "e.g. 15-20 minutes on an m3.xlarge instance on EC2.")
+            if spark_git_commit == 'latest':
+                spark_git_commit = get_latest_commit(spark_git_repository)
+                print("Building Spark at latest commit: {c}".format(c=spark_git_commit))
+            spark = Spark(
+                git_commit=spark_git_commit,
+                git_repository=spark_git_repository,
+                git_build_cache=spark_git_build_cache,
+                git_build_cache_s3_endpoint=spark_git_build_cache_s3_endpoint)
+        services += [spark]
+
+    return services
+
+
+def report_stats(*, trace_file: str, print_api_stats: bool):
+    stats = api_stats.get_stats()
+    if trace_file:
+        tracing.write_trace(trace_file, metadata={'api_stats': stats.get_stats()})
+    if print_api_stats:
+        print(stats.format_summary(), file=sys.stderr)
+
+
 @cli.command()
 @click.argument('cluster-name')
 @click.option('--num-slaves', type=int, required=True)
@@ -181,8 +285,11 @@ def cli(cli_context, config, provider):
 @click.option('--hdfs-version')
 @click.option('--hdfs-download-source',
               help="URL to download Hadoop from.",
-              default='http://www.apache.org/dyn/closer.lua/hadoop/common/hadoop-{v}/hadoop-{v}.tar.gz?as_json',
+              default=DEFAULT_HADOOP_DOWNLOAD_SOURCE,
               show_default=True)
+@click.option('--hdfs-artifact-store',
+              help="Download Hadoop from this artifact store instead of the internet. "
+                   "Can be an http://, https://, or s3:// URL.")
 @click.option('--install-spark/--no-install-spark', default=True)
 @click.option('--spark-version',
               help="Spark release version to install.")
@@ -194,6 +301,16 @@ def cli(cli_context, config, provider):
               help="Git repository to clone Spark from.",
               default='https://github.com/apache/spark',
               show_default=True)
+@click.option('--spark-git-build-cache',
+              help="Where to cache Spark builds from Git, so that we only build each "
+                   "commit once. Can be a local directory, an http:// or https:// URL, "
+                   "or an s3:// URL.")
+@click.option('--spark-git-build-cache-s3-endpoint',
+              help="Endpoint URL of the service holding an s3:// Spark build cache, "
+                   "if it's not AWS. e.g. http://minio.example.com:9000")
+@click.option('--spark-artifact-store',
+              help="Download Spark from this artifact store instead of the internet. "
+                   "Can be an http://, https://, or s3:// URL.")
 @click.option('--assume-yes/--no-assume-yes', default=False)
 @click.option('--ec2-key-name')
 @click.option('--ec2-identity-file',
@@ -215,6 +332,21 @@ def cli(cli_context, config, provider):
 @click.option('--ec2-ebs-optimized/--no-ec2-ebs-optimized', default=False)
 @click.option('--ec2-instance-initiated-shutdown-behavior', default='stop',
               type=click.Choice(['stop', 'terminate']))
+@click.option('--max-parallel', type=click.IntRange(min=1), default=DEFAULT_MAX_PARALLEL,
+              show_default=True,
+              help="Maximum number of nodes to work on at once.")
+@click.option('--distribute-artifacts/--no-distribute-artifacts', default=False,
+              help="Download HDFS and Spark once on the master and pass them on to "
+                   "the slaves over the cluster's private network, instead of "
+                   "downloading them on every node.")
+@click.option('--bootstrap/--no-bootstrap', default=False,
+              help="Have each node install services on its own when it boots, "
+                   "instead of installing them over SSH from here. This takes "
+                   "load off this machine when launching large clusters.")
+@click.option('--bootstrap-timeout', type=int, default=DEFAULT_BOOTSTRAP_TIMEOUT // 60,
+              show_default=True,
+              help="Minutes to give each node to bootstrap itself before failing "
+                   "the launch.")
 @click.pass_context
 def launch(
         cli_context,
@@ -223,10 +355,14 @@ def launch(
         install_hdfs,
         hdfs_version,
         hdfs_download_source,
+        hdfs_artifact_store,
         install_spark,
         spark_version,
         spark_git_commit,
         spark_git_repository,
+        spark_git_build_cache,
+        spark_git_build_cache_s3_endpoint,
+        spark_artifact_store,
         assume_yes,
         ec2_key_name,
         ec2_identity_file,
@@ -242,28 +378,16 @@ def launch(
         ec2_placement_group,
         ec2_tenancy,
         ec2_ebs_optimized,
-        ec2_instance_initiated_shutdown_behavior):
+        ec2_instance_initiated_shutdown_behavior,
+        max_parallel,
+        distribute_artifacts,
+        bootstrap,
+        bootstrap_timeout):
     """
     Launch a new cluster.
     """
     provider = cli_context.obj['provider']
-    services = []
 
-    option_requires(
-        option='--install-hdfs',
-        requires_all=['--hdfs-version'],
-        scope=locals())
-    option_requires(
-        option='--install-spark',
-        requires_any=[
-            '--spark-version',
-            '--spark-git-commit'],
-        scope=locals())
-    mutually_exclusive(
-        options=[
-            '--spark-version',
-            '--spark-git-commit'],
-        scope=locals())
     option_requires(
         option='--provider',
         conditional_value='ec2',
@@ -284,26 +408,26 @@ def launch(
         requires_all=['--ec2-subnet-id'],
         scope=locals())
 
-    if install_hdfs:
-        hdfs = HDFS(version=hdfs_version, download_source=hdfs_download_source)
-        services += [hdfs]
-    if install_spark:
-        if spark_version:
-            spark = Spark(version=spark_version)
-        elif spark_git_commit:
-            print(
-                "Warning: Building Spark takes a long time. "
-                "e.g. 15-20 minutes on an m3.xlarge instance on EC2.")
-            if spark_git_commit == 'latest':
-                spark_git_commit = get_latest_commit(spark_git_repository)
-                print("Building Spark at latest commit: {c}".format(c=spark_git_commit))
-            spark = Spark(
-                git_commit=spark_git_commit,
-                git_repository=spark_git_repository)
-        services += [spark]
+    services = get_services(
+        install_hdfs=install_hdfs,
+        hdfs_version=hdfs_version,
+        hdfs_download_source=hdfs_download_source,
+        hdfs_artifact_store=hdfs_artifact_store,
+        install_spark=install_spark,
+        spark_version=spark_version,
+        spark_git_commit=spark_git_commit,
+        spark_git_repository=spark_git_repository,
+        spark_git_build_cache=spark_git_build_cache,
+        spark_git_build_cache_s3_endpoint=spark_git_build_cache_s3_endpoint,
+        spark_artifact_store=spark_artifact_store,
+        distribute_artifacts=distribute_artifacts)
 
     if provider == 'ec2':
-        return ec2.launch(
+        from . import ec2
+
+        state_cache = StateCache()
+        ec2.delete_pending_security_groups(region=ec2_region, state_cache=state_cache)
+        cluster = ec2.launch(
             cluster_name=cluster_name,
             num_slaves=num_slaves,
             services=services,
@@ -322,7 +446,147 @@ def launch(
             placement_group=ec2_placement_group,
             tenancy=ec2_tenancy,
             ebs_optimized=ec2_ebs_optimized,
-            instance_initiated_shutdown_behavior=ec2_instance_initiated_shutdown_behavior)
+            instance_initiated_shutdown_behavior=ec2_instance_initiated_shutdown_behavior,
+            max_parallel=max_parallel,
+            bootstrap=bootstrap,
+            bootstrap_timeout=bootstrap_timeout * 60)
+        ec2.cache_cluster(
+            cluster,
+            state_cache=state_cache,
+            vpc_id=ec2_vpc_id,
+            services=services)
+        return cluster
+    else:
+        raise UnsupportedProviderError(provider)
+
+
+@cli.command(name='build-image')
+@click.argument('image-name')
+@click.option('--install-hdfs/--no-install-hdfs', default=False)
+@click.option('--hdfs-version')
+@click.option('--hdfs-download-source',
+              help="URL to download Hadoop from.",
+              default=DEFAULT_HADOOP_DOWNLOAD_SOURCE,
+              show_default=True)
+@click.option('--hdfs-artifact-store',
+              help="Download Hadoop from this artifact store instead of the internet. "
+                   "Can be an http://, https://, or s3:// URL.")
+@click.option('--install-spark/--no-install-spark', default=True)
+@click.option('--spark-version',
+              help="Spark release version to install.")
+@click.option('--spark-git-commit',
+              help="Git commit to build Spark from. "
+                   "Set to 'latest' to build Spark from the latest commit on the "
+                   "repository's default branch.")
+@click.option('--spark-git-repository',
+              help="Git repository to clone Spark from.",
+              default='https://github.com/apache/spark',
+              show_default=True)
+@click.option('--spark-git-build-cache',
+              help="Where to cache Spark builds from Git, so that we only build each "
+                   "commit once. Can be a local directory, an http:// or https:// URL, "
+                   "or an s3:// URL.")
+@click.option('--spark-git-build-cache-s3-endpoint',
+              help="Endpoint URL of the service holding an s3:// Spark build cache, "
+                   "if it's not AWS. e.g. http://minio.example.com:9000")
+@click.option('--spark-artifact-store',
+              help="Download Spark from this artifact store instead of the internet. "
+                   "Can be an http://, https://, or s3:// URL.")
+@click.option('--assume-yes/--no-assume-yes', default=False)
+@click.option('--ec2-key-name')
+@click.option('--ec2-identity-file',
+              type=click.Path(exists=True, dir_okay=False),
+              help="Path to SSH .pem file for accessing nodes.")
+@click.option('--ec2-instance-type', default='m3.medium', show_default=True)
+@click.option('--ec2-region', default='us-east-1', show_default=True)
+@click.option('--ec2-availability-zone', default='')
+@click.option('--ec2-ami', help="The image to build on.")
+@click.option('--ec2-user')
+@click.option('--ec2-vpc-id', default='', help="Leave empty for default VPC.")
+@click.option('--ec2-subnet-id', default='')
+@click.option('--ec2-instance-profile-name', default='')
+@click.pass_context
+def build_image(
+        cli_context,
+        image_name,
+        install_hdfs,
+        hdfs_version,
+        hdfs_download_source,
+        hdfs_artifact_store,
+        install_spark,
+        spark_version,
+        spark_git_commit,
+        spark_git_repository,
+        spark_git_build_cache,
+        spark_git_build_cache_s3_endpoint,
+        spark_artifact_store,
+        assume_yes,
+        ec2_key_name,
+        ec2_identity_file,
+        ec2_instance_type,
+        ec2_region,
+        ec2_availability_zone,
+        ec2_ami,
+        ec2_user,
+        ec2_vpc_id,
+        ec2_subnet_id,
+        ec2_instance_profile_name):
+    """
+    Build a machine image with services pre-installed.
+
+    Clusters launched from the image with the same services skip downloading
+    and installing them, and launch much faster.
+    """
+    provider = cli_context.obj['provider']
+
+    option_requires(
+        option='--provider',
+        conditional_value='ec2',
+        requires_all=[
+            '--ec2-key-name',
+            '--ec2-identity-file',
+            '--ec2-instance-type',
+            '--ec2-region',
+            '--ec2-ami',
+            '--ec2-user'],
+        scope=locals())
+    option_requires(
+        option='--ec2-vpc-id',
+        requires_all=['--ec2-subnet-id'],
+        scope=locals())
+
+    services = get_services(
+        install_hdfs=install_hdfs,
+        hdfs_version=hdfs_version,
+        hdfs_download_source=hdfs_download_source,
+        hdfs_artifact_store=hdfs_artifact_store,
+        install_spark=install_spark,
+        spark_version=spark_version,
+        spark_git_commit=spark_git_commit,
+        spark_git_repository=spark_git_repository,
+        spark_git_build_cache=spark_git_build_cache,
+        spark_git_build_cache_s3_endpoint=spark_git_build_cache_s3_endpoint,
+        spark_artifact_store=spark_artifact_store)
+    if not services:
+        raise UsageError("Error: There are no services to build an image with.")
+
+    if provider == 'ec2':
+        from . import ec2
+
+        ec2.build_image(
+            image_name=image_name,
+            services=services,
+            assume_yes=assume_yes,
+            key_name=ec2_key_name,
+            identity_file=ec2_identity_file,
+            instance_type=ec2_instance_type,
+            region=ec2_region,
+            availability_zone=ec2_availability_zone,
+            ami=ec2_ami,
+            user=ec2_user,
+            vpc_id=ec2_vpc_id,
+            subnet_id=ec2_subnet_id,
+            instance_profile_name=ec2_instance_profile_name)
     else:
         raise UnsupportedProviderError(provider)
 
@@ -370,10 +634,15 @@ def destroy(cli_context, cluster_name, assume_yes, ec2_region, ec2_vpc_id):
         scope=locals())
 
     if provider == 'ec2':
+        from . import ec2
+
+        state_cache = StateCache()
         cluster = ec2.get_cluster(
             cluster_name=cluster_name,
             region=ec2_region,
-            vpc_id=ec2_vpc_id)
+            vpc_id=ec2_vpc_id,
+            state_cache=state_cache,
+            max_age=0)
     else:
         raise UnsupportedProviderError(provider)
 
@@ -384,7 +653,13 @@ def destroy(cli_context, cluster_name, assume_yes, ec2_region, ec2_vpc_id):
             abort=True)
 
     print("Destroying {c}...".format(c=cluster.name))
-    cluster.destroy()
+    ec2.delete_pending_security_groups(region=ec2_region, state_cache=state_cache)
+    cluster.destroy(state_cache=state_cache)
+    state_cache.delete_cluster(
+        provider=provider,
+        region=ec2_region,
+        vpc_id=ec2_vpc_id,
+        name=cluster.name)
 
 
 @cli.command()
@@ -392,13 +667,17 @@ def destroy(cli_context, cluster_name, assume_yes, ec2_region, ec2_vpc_id):
 @click.option('--master-hostname-only', is_flag=True, default=False)
 @click.option('--ec2-region', default='us-east-1', show_default=True)
 @click.option('--ec2-vpc-id', default='', help="Leave empty for default VPC.")
+@click.option('--refresh', is_flag=True, default=False,
+              help="Look clusters up in EC2 instead of using what Flintrock "
+                   "cached about them in the last {t} minutes.".format(t=DEFAULT_TTL // 60))
 @click.pass_context
 def describe(
         cli_context,
         cluster_name,
         master_hostname_only,
         ec2_region,
-        ec2_vpc_id):
+        ec2_vpc_id,
+        refresh):
     """
     Describe an existing cluster.
 
@@ -422,11 +701,15 @@ def describe(
         cluster_names = []
 
     if provider == 'ec2':
+        from . import ec2
+
         search_area = "in region {r}".format(r=ec2_region)
         clusters = ec2.get_clusters(
             cluster_names=cluster_names,
             region=ec2_region,
-            vpc_id=ec2_vpc_id)
+            vpc_id=ec2_vpc_id,
+            state_cache=StateCache(),
+            max_age=0 if refresh else DEFAULT_TTL)
     else:
         raise UnsupportedProviderError(provider)
 
@@ -462,8 +745,18 @@ def describe(
               type=click.Path(exists=True, dir_okay=False),
               help="Path to SSH .pem file for accessing nodes.")
 @click.option('--ec2-user')
+@click.option('--refresh', is_flag=True, default=False,
+              help="Look the cluster up in EC2 instead of using what Flintrock "
+                   "cached about it in the last {t} minutes.".format(t=DEFAULT_TTL // 60))
 @click.pass_context
-def login(cli_context, cluster_name, ec2_region, ec2_vpc_id, ec2_identity_file, ec2_user):
+def login(
+        cli_context,
+        cluster_name,
+        ec2_region,
+        ec2_vpc_id,
+        ec2_identity_file,
+        ec2_user,
+        refresh):
     """
     Login to the master of an existing cluster.
     """
@@ -479,10 +772,14 @@ def login(cli_context, cluster_name, ec2_region, ec2_vpc_id, ec2_identity_file,
         scope=locals())
 
     if provider == 'ec2':
+        from . import ec2
+
         cluster = ec2.get_cluster(
             cluster_name=cluster_name,
             region=ec2_region,
-            vpc_id=ec2_vpc_id)
+            vpc_id=ec2_vpc_id,
+            state_cache=StateCache(),
+            max_age=0 if refresh else DEFAULT_TTL)
         user = ec2_user
         identity_file = ec2_identity_file
     else:
@@ -502,8 +799,18 @@ def login(cli_context, cluster_name, ec2_region, ec2_vpc_id, ec2_identity_file,
               type=click.Path(exists=True, dir_okay=False),
               help="Path to SSH .pem file for accessing nodes.")
 @click.option('--ec2-user')
+@click.option('--max-parallel', type=click.IntRange(min=1), default=DEFAULT_MAX_PARALLEL,
+              show_default=True,
+              help="Maximum number of nodes to work on at once.")
 @click.pass_context
-def start(cli_context, cluster_name, ec2_region, ec2_vpc_id, ec2_identity_file, ec2_user):
+def start(
+        cli_context,
+        cluster_name,
+        ec2_region,
+        ec2_vpc_id,
+        ec2_identity_file,
+        ec2_user,
+        max_parallel):
     """
     Start an existing, stopped cluster.
     """
@@ -519,10 +826,15 @@ def start(cli_context, cluster_name, ec2_region, ec2_vpc_id, ec2_identity_file,
         scope=locals())
 
     if provider == 'ec2':
+        from . import ec2
+
+        state_cache = StateCache()
         cluster = ec2.get_cluster(
             cluster_name=cluster_name,
             region=ec2_region,
-            vpc_id=ec2_vpc_id)
+            vpc_id=ec2_vpc_id,
+            state_cache=state_cache,
+            max_age=0)
         user = ec2_user
         identity_file = ec2_identity_file
     else:
@@ -530,7 +842,8 @@ def start(cli_context, cluster_name, ec2_region, ec2_vpc_id, ec2_identity_file,
 
     cluster.start_check()
     print("Starting {c}...".format(c=cluster_name))
-    cluster.start(user=user, identity_file=identity_file)
+    cluster.start(user=user, identity_file=identity_file, max_parallel=max_parallel)
+    ec2.cache_cluster(cluster, state_cache=state_cache, vpc_id=ec2_vpc_id)
 
 
 @cli.command()
@@ -552,10 +865,15 @@ def stop(cli_context, cluster_name, ec2_region, ec2_vpc_id, assume_yes):
         scope=locals())
 
     if provider == 'ec2':
+        from . import ec2
+
+        state_cache = StateCache()
         cluster = ec2.get_cluster(
             cluster_name=cluster_name,
             region=ec2_region,
-            vpc_id=ec2_vpc_id)
+            vpc_id=ec2_vpc_id,
+            state_cache=state_cache,
+            max_age=0)
     else:
         raise UnsupportedProviderError(provider)
 
@@ -569,6 +887,7 @@ def stop(cli_context, cluster_name, ec2_region, ec2_vpc_id, assume_yes):
 
     print("Stopping {c}...".format(c=cluster_name))
     cluster.stop()
+    ec2.cache_cluster(cluster, state_cache=state_cache, vpc_id=ec2_vpc_id)
     print("{c} is now stopped.".format(c=cluster_name))
 
 
@@ -582,6 +901,12 @@ def stop(cli_context, cluster_name, ec2_region, ec2_vpc_id, assume_yes):
               type=click.Path(exists=True, dir_okay=False),
               help="Path to SSH .pem file for accessing nodes.")
 @click.option('--ec2-user')
+@click.option('--refresh', is_flag=True, default=False,
+              help="Look the cluster up in EC2 instead of using what Flintrock "
+                   "cached about it in the last {t} minutes.".format(t=DEFAULT_TTL // 60))
+@click.option('--max-parallel', type=click.IntRange(min=1), default=DEFAULT_MAX_PARALLEL,
+              show_default=True,
+              help="Maximum number of nodes to work on at once.")
 @click.pass_context
 def run_command(
         cli_context,
@@ -591,7 +916,9 @@ def run_command(
         ec2_region,
         ec2_vpc_id,
         ec2_identity_file,
-        ec2_user):
+        ec2_user,
+        refresh,
+        max_parallel):
     """
     Run a shell command on a cluster.
 
@@ -615,10 +942,14 @@ def run_command(
         scope=locals())
 
     if provider == 'ec2':
+        from . import ec2
+
         cluster = ec2.get_cluster(
             cluster_name=cluster_name,
             region=ec2_region,
-            vpc_id=ec2_vpc_id)
+            vpc_id=ec2_vpc_id,
+            state_cache=StateCache(),
+            max_age=0 if refresh else DEFAULT_TTL)
         user = ec2_user
         identity_file = ec2_identity_file
     else:
@@ -633,7 +964,8 @@ def run_command(
         command=command,
         master_only=master_only,
         user=user,
-        identity_file=identity_file)
+        identity_file=identity_file,
+        max_parallel=max_parallel)
 
 
 @cli.command(name='copy-file')
@@ -648,6 +980,12 @@ def run_command(
               help="Path to SSH .pem file for accessing nodes.")
 @click.option('--ec2-user')
 @click.option('--assume-yes/--no-assume-yes', default=False, help="Prompt before large uploads.")
+@click.option('--refresh', is_flag=True, default=False,
+              help="Look the cluster up in EC2 instead of using what Flintrock "
+                   "cached about it in the last {t} minutes.".format(t=DEFAULT_TTL // 60))
+@click.option('--max-parallel', type=click.IntRange(min=1), default=DEFAULT_MAX_PARALLEL,
+              show_default=True,
+              help="Maximum number of nodes to work on at once.")
 @click.pass_context
 def copy_file(
         cli_context,
@@ -659,7 +997,9 @@ def copy_file(
         ec2_vpc_id,
         ec2_identity_file,
         ec2_user,
-        assume_yes):
+        assume_yes,
+        refresh,
+        max_parallel):
     """
     Copy a local file up to a cluster.
 
@@ -689,10 +1029,14 @@ def copy_file(
         remote_path = posixpath.join(remote_path, os.path.basename(local_path))
 
     if provider == 'ec2':
+        from . import ec2
+
         cluster = ec2.get_cluster(
             cluster_name=cluster_name,
             region=ec2_region,
-            vpc_id=ec2_vpc_id)
+            vpc_id=ec2_vpc_id,
+            state_cache=StateCache(),
+            max_age=0 if refresh else DEFAULT_TTL)
         user = ec2_user
         identity_file = ec2_identity_file
     else:
@@ -735,7 +1079,81 @@ def copy_file(
         remote_path=remote_path,
         master_only=master_only,
         user=user,
-        identity_file=identity_file)
+        identity_file=identity_file,
+        max_parallel=max_parallel)
+
+
+@cli.group()
+def artifacts():
+    """
+    Manage a local store of the packages Flintrock installs.
+
+    Fetch packages into a local directory once, copy the directory to a bucket
+    or web server your clusters can reach, and point launches at it with
+    --spark-artifact-store and --hdfs-artifact-store. Launches then don't
+    depend on upstream mirrors, and each node checks what it downloads against
+    the checksum recorded when the package was fetched.
+    """
+    pass
+
+
+@artifacts.command(name='fetch')
+@click.option('--store', required=True, type=click.Path(file_okay=False),
+              help="Local directory to fetch packages into.")
+@click.option('--spark-version',
+              help="Spark release version to fetch.")
+@click.option('--hdfs-version',
+              help="Hadoop release version to fetch.")
+@click.option('--hdfs-download-source',
+              help="URL to download Hadoop from.",
+              default=DEFAULT_HADOOP_DOWNLOAD_SOURCE,
+              show_default=True)
+def artifacts_fetch(store, spark_version, hdfs_version, hdfs_download_source):
+    """
+    Fetch packages into a local artifact store.
+    """
+    to_fetch = []
+    if spark_version:
+        from .services import Spark
+
+        to_fetch.append(
+            get_spark_artifact(
+                version=spark_version,
+                distribution=Spark(version=spark_version).distribution))
+    if hdfs_version:
+        to_fetch.append(
+            get_hadoop_artifact(
+                version=hdfs_version,
+                download_source=hdfs_download_source))
+
+    if not to_fetch:
+        raise UsageError(
+            "Error: Provide at least one of \"--spark-version\" or \"--hdfs-version\".")
+
+    local_store = LocalArtifactStore(store)
+    for artifact in to_fetch:
+        if local_store.contains(artifact):
+            print("{n} is already in the store.".format(n=artifact.name))
+            continue
+        print("Fetching {n}...".format(n=artifact.name))
+        entry = local_store.fetch(artifact)
+        print("Fetched {n} from {s}.".format(n=artifact.name, s=entry['source']))
+
+
+@artifacts.command(name='list')
+@click.option('--store', required=True, type=click.Path(file_okay=False),
+              help="Local directory to list packages in.")
+def artifacts_list(store):
+    """
+    List the packages in a local artifact store.
+    """
+    index = LocalArtifactStore(store).get_index()
+    for (name, entry) in sorted(index.items()):
+        print("{n}:".format(n=name))
+        print("  size: {s}".format(s=entry['size']))
+        print("  sha512: {c}".format(c=entry['sha512']))
+        print("  source: {s}".format(s=entry['source']))
+        print("  verified: {v}".format(v=entry['verified']))
 
 
 def normalize_keys(obj):
@@ -777,6 +1195,9 @@ def config_to_click(config: dict) -> dict:
             list(config['launch'].items()) +
             list(ec2_configs.items()) +
             list(service_configs.items())),
+        'build-image': dict(
+            list(ec2_configs.items()) +
+            list(service_configs.items())),
         'describe': ec2_configs,
         'destroy': ec2_configs,
         'login': ec2_configs,
@@ -784,6 +1205,10 @@ def config_to_click(config: dict) -> dict:
         'stop': ec2_configs,
         'run-command': ec2_configs,
         'copy-file': ec2_configs,
+        # Fetch whatever versions we launch with by default.
+        'artifacts': {
+            'fetch': service_configs,
+        },
     }
 
     return click_map
@@ -0,0 +1,228 @@
+"""
+Distribute a file from this node to other nodes in the cluster over the
+cluster's private network.
+
+We serve the file over HTTP, and each peer downloads it from the node above
+it in a tree, so no node serves more than a few peers. Each peer serves the
+file in turn to the peers below it. Once a peer has the file, we run a command
+on it to do something with the file, like unpack it.
+
+We reach peers via SSH using the cluster's own key, so this script must run on
+a node that can SSH into all the others -- typically the master.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import platform
+import subprocess
+import sys
+import threading
+
+if sys.version_info < (3, 0):
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from pipes import quote
+else:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from shlex import quote
+
+# Where peers keep the file. We serve this directory and nothing else.
+PEER_DIR = '.flintrock-artifacts'
+
+# The server peers run for the peers below them. It works with Python 2 and 3.
+PEER_SERVER = """
+import os, sys
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+os.chdir(sys.argv[2])
+HTTPServer(('', int(sys.argv[1])), QuietHandler).serve_forever()
+"""
+
+SSH_OPTIONS = ['-o', 'StrictHostKeyChecking=no', '-o', 'BatchMode=yes']
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(path):
+    """
+    Make a request handler that serves only the file at path.
+    """
+    name = os.path.basename(path)
+
+    class SingleFileHandler(SimpleHTTPRequestHandler):
+        def translate_path(self, request_path):
+            if request_path.split('?')[0] == '/' + name:
+                return path
+            return os.path.join(os.path.dirname(path), '.flintrock-does-not-exist')
+
+        def log_message(self, *args):
+            pass
+
+    return SingleFileHandler
+
+
+def get_parent(index, fanout):
+    """
+    Get the index of the node that the node at the provided index downloads
+    from. The source is index 0, and peers are numbered from 1.
+    """
+    return (index - 1) // fanout
+
+
+def get_peer_command(source, port, name, serve, then):
+    command = """
+        set -e
+        mkdir -p {d}
+        cd {d}
+        curl --fail --silent --show-error --retry 5 --retry-delay 1 \\
+            --output {n}.partial http://{s}:{p}/{n}
+        mv {n}.partial {n}
+    """.format(d=PEER_DIR, n=quote(name), s=quote(source), p=port)
+
+    if serve:
+        command += """
+        nohup python -c {server} {p} . > /dev/null 2>&1 < /dev/null &
+        echo $! > server.pid
+        """.format(server=quote(PEER_SERVER), p=port)
+
+    command += """
+        cd "$HOME"
+        export ARTIFACT={d}/{n}
+        {then}
+    """.format(d=PEER_DIR, n=quote(name), then=then)
+
+    return command
+
+
+def ssh(host, command):
+    process = subprocess.Popen(
+        ['ssh'] + SSH_OPTIONS + [host, 'bash -c ' + quote(command)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    return (process.returncode, output.decode('utf-8', 'replace'))
+
+
+def distribute(path, source, hosts, port, fanout, parallel, then):
+    name = os.path.basename(path)
+
+    server = ThreadingHTTPServer(('', port), make_handler(os.path.abspath(path)))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    # Node 0 is this node, which has the file from the start.
+    nodes = [source] + hosts
+    done = [threading.Event() for _ in nodes]
+    succeeded = [True] + [False for _ in hosts]
+    done[0].set()
+    ssh_slots = threading.BoundedSemaphore(parallel)
+    failures = []
+
+    def has_children(index):
+        return index * fanout + 1 < len(nodes)
+
+    def fetch(index):
+        parent = get_parent(index, fanout)
+        done[parent].wait()
+        # If a peer failed to get the file, the peers below it get it from
+        # the source instead.
+        if not succeeded[parent]:
+            parent = 0
+
+        def fetch_from(parent):
+            with ssh_slots:
+                return ssh(
+                    nodes[index],
+                    get_peer_command(
+                        source=nodes[parent],
+                        port=port,
+                        name=name,
+                        serve=has_children(index),
+                        then=then))
+
+        (returncode, output) = fetch_from(parent)
+        if returncode != 0 and parent != 0:
+            (returncode, output) = fetch_from(0)
+
+        if returncode == 0:
+            succeeded[index] = True
+        else:
+            failures.append((nodes[index], output))
+        done[index].set()
+
+    threads = [threading.Thread(target=fetch, args=(i,)) for i in range(1, len(nodes))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    server.shutdown()
+
+    # Stop the peers' servers and clean up after them.
+    def clean_up(index):
+        with ssh_slots:
+            ssh(nodes[index], """
+                if [ -e {d}/server.pid ]; then
+                    kill "$(cat {d}/server.pid)" || true
+                fi
+                rm -rf {d}
+            """.format(d=PEER_DIR))
+
+    threads = [
+        threading.Thread(target=clean_up, args=(i,))
+        for i in range(1, len(nodes)) if succeeded[i]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return failures
+
+
+if __name__ == '__main__':
+    if sys.version_info < (2, 7) or ((3, 0) <= sys.version_info < (3, 4)):
+        raise Exception(
+            "This script is only supported on Python 2.7+ and 3.4+. "
+            "You are running Python {v}.".format(v=platform.python_version()))
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--source', required=True,
+                        help="The address peers should use to reach this node.")
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--fanout', type=int, default=4,
+                        help="How many peers each node serves.")
+    parser.add_argument('--parallel', type=int, default=64,
+                        help="How many peers we talk to via SSH at once.")
+    parser.add_argument('--then', default='true',
+                        help="A command to run on each peer once it has the file. "
+                             "$ARTIFACT holds the path to the file.")
+    parser.add_argument('path')
+    parser.add_argument('hosts', nargs='*')
+    args = parser.parse_args()
+
+    failures = distribute(
+        path=args.path,
+        source=args.source,
+        hosts=args.hosts,
+        port=args.port,
+        fanout=args.fanout,
+        parallel=args.parallel,
+        then=args.then)
+
+    for (host, output) in failures:
+        print("[{h}] Failed to get {p}:\n{o}".format(h=host, p=args.path, o=output),
+              file=sys.stderr)
+
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,418 @@
+"""
+Download a package, like a Hadoop or Spark release, as fast as we can.
+
+We probe the candidate mirrors and download from whichever sends us the start
+of the package fastest. If it supports HTTP Range requests, we download the
+package in several segments at once, and resume each segment on its own --
+from another mirror if need be -- when it fails.
+
+Segments are passed along in order as they come in, straight to where the
+package is going -- into tar to extract it, or to a file that gzip checks as it
+goes by -- and we compute the package's SHA-512 checksum along the way, so we
+read it only once. If a digest is published for the package, we check the
+download against it.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+if sys.version_info < (3, 0):
+    from httplib import HTTPException
+    from urllib2 import Request, urlopen
+else:
+    from http.client import HTTPException
+    from urllib.request import Request, urlopen
+
+# Errors that mean a download failed, but might work if we try again.
+DOWNLOAD_ERRORS = (IOError, OSError, ValueError, HTTPException)
+
+# Apache keeps every release in its archive, so we fall back to it for
+# releases that are too old for the mirrors to carry.
+APACHE_ARCHIVE = 'https://archive.apache.org/dist/'
+
+# How many of the mirrors Apache lists we probe, besides the preferred one.
+MAX_PROBED_MIRRORS = 5
+
+CHUNK_SIZE = 1024 * 1024
+PROBE_SIZE = 256 * 1024
+
+Mirror = collections.namedtuple(
+    'Mirror', ['url', 'latency', 'throughput', 'elapsed', 'size', 'supports_ranges'])
+
+
+def parse_sha512(digest_file):
+    """
+    Find the SHA-512 checksum in a digest file in any of the formats Apache
+    uses, or return None if there isn't one.
+    """
+    # Some formats split the checksum into groups across several lines.
+    for hex_run in re.findall(r'[0-9a-fA-F]+', re.sub(r'\s', '', digest_file)):
+        if len(hex_run) == 128:
+            return hex_run.lower()
+    return None
+
+
+def get_published_sha512(digest_urls):
+    """
+    Get the SHA-512 checksum from the first of the provided digest files that
+    we can fetch and that has one, or return None if none do.
+    """
+    for digest_url in digest_urls:
+        try:
+            digest_file = urlopen(digest_url, timeout=30).read()
+        except DOWNLOAD_ERRORS:
+            continue
+        # Mirrors may answer with an error page, and older releases publish
+        # digests in formats without a SHA-512.
+        checksum = parse_sha512(digest_file.decode('utf-8', 'replace'))
+        if checksum:
+            return checksum
+    return None
+
+
+def get_candidate_urls(urls):
+    """
+    Expand any Apache closer.lua URLs among the provided URLs into the mirrors
+    they list, plus the Apache archive.
+    """
+    candidates = []
+    for url in urls:
+        if 'closer.lua/' not in url:
+            candidates.append(url)
+            continue
+
+        path = url.split('closer.lua/', 1)[1].split('?', 1)[0]
+        mirrors = []
+        try:
+            mirror_info = json.loads(urlopen(url, timeout=30).read().decode('utf-8'))
+            mirrors = (
+                [mirror_info['preferred']] +
+                mirror_info.get('http', [])[:MAX_PROBED_MIRRORS] +
+                mirror_info.get('backup', []))
+        except (DOWNLOAD_ERRORS + (KeyError,)) as e:
+            print("Could not get the list of mirrors from {u}: {e}".format(u=url, e=e),
+                  file=sys.stderr)
+        mirrors.append(APACHE_ARCHIVE)
+
+        candidates.extend(mirror.rstrip('/') + '/' + path for mirror in mirrors)
+
+    # Drop duplicates, but keep the order.
+    seen = set()
+    return [url for url in candidates if not (url in seen or seen.add(url))]
+
+
+def probe(url):
+    """
+    Time how long a mirror takes to send us the start of the package, and find
+    out how big the package is and whether the mirror supports Range requests.
+    Return None if the mirror can't send us the package.
+    """
+    start = time.time()
+    try:
+        response = urlopen(
+            Request(url, headers={'Range': 'bytes=0-{e}'.format(e=PROBE_SIZE - 1)}),
+            timeout=10)
+        try:
+            latency = time.time() - start
+            received = len(response.read(PROBE_SIZE))
+            headers = response.info()
+            if response.getcode() == 206:
+                supports_ranges = True
+                total = headers.get('Content-Range', '').rpartition('/')[2]
+                size = int(total) if total.isdigit() else None
+            else:
+                supports_ranges = False
+                size = int(headers.get('Content-Length') or 0) or None
+        finally:
+            response.close()
+    except DOWNLOAD_ERRORS:
+        return None
+
+    elapsed = time.time() - start
+    return Mirror(
+        url=url,
+        latency=latency,
+        throughput=received / max(elapsed - latency, 0.001),
+        elapsed=elapsed,
+        size=size,
+        supports_ranges=supports_ranges)
+
+
+def rank_mirrors(urls):
+    """
+    Probe the mirrors at the provided URLs all at once, and return the ones
+    that can send us the package, fastest first.
+    """
+    results = [None for _ in urls]
+
+    def probe_into(index):
+        results[index] = probe(urls[index])
+
+    threads = [threading.Thread(target=probe_into, args=(i,)) for i in range(len(urls))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    mirrors = sorted((m for m in results if m), key=lambda m: m.elapsed)
+    for mirror in mirrors:
+        print("  {l:5.0f} ms, {t:6.1f} MB/s: {u}".format(
+            l=mirror.latency * 1000,
+            t=mirror.throughput / 1024 / 1024,
+            u=mirror.url))
+    return mirrors
+
+
+def fetch_segment(urls, start, end, attempts=5):
+    """
+    Download bytes start through end of the package. If a request fails, we
+    pick up where it left off, trying each of the provided mirrors in turn.
+    """
+    expected = end - start + 1
+    data = bytearray()
+    attempt = 0
+    while len(data) < expected:
+        url = urls[attempt % len(urls)]
+        try:
+            response = urlopen(
+                Request(url, headers={
+                    'Range': 'bytes={s}-{e}'.format(s=start + len(data), e=end)}),
+                timeout=30)
+            try:
+                if response.getcode() != 206:
+                    raise ValueError("{u} ignored our Range request.".format(u=url))
+                while len(data) < expected:
+                    chunk = response.read(min(CHUNK_SIZE, expected - len(data)))
+                    if not chunk:
+                        raise ValueError("{u} closed the connection early.".format(u=url))
+                    data.extend(chunk)
+            finally:
+                response.close()
+        except DOWNLOAD_ERRORS:
+            attempt += 1
+            if attempt >= attempts:
+                raise
+            time.sleep(min(2 ** attempt, 10))
+    return bytes(data)
+
+
+def fetch_segments(urls, size, write, parallel, segment_size):
+    """
+    Download the package in segments, parallel at a time, and write() each
+    segment in order as soon as it and the ones before it have come in.
+
+    Fetchers only work a few segments ahead of the writer, so we never hold
+    more than a handful of segments in memory no matter how big the package is.
+    """
+    segments = [
+        (start, min(start + segment_size, size) - 1)
+        for start in range(0, size, segment_size)]
+    window = parallel * 2
+
+    condition = threading.Condition()
+    fetched = {}
+    errors = []
+    state = {'next_to_fetch': 0, 'next_to_write': 0}
+
+    def fetch():
+        while True:
+            with condition:
+                while (not errors and
+                        state['next_to_fetch'] < len(segments) and
+                        state['next_to_fetch'] >= state['next_to_write'] + window):
+                    condition.wait()
+                if errors or state['next_to_fetch'] >= len(segments):
+                    return
+                index = state['next_to_fetch']
+                state['next_to_fetch'] += 1
+
+            try:
+                data = fetch_segment(urls, *segments[index])
+            except Exception as e:
+                with condition:
+                    errors.append(e)
+                    condition.notify_all()
+                return
+
+            with condition:
+                fetched[index] = data
+                condition.notify_all()
+
+    threads = [threading.Thread(target=fetch) for _ in range(min(parallel, len(segments)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        for index in range(len(segments)):
+            with condition:
+                while index not in fetched and not errors:
+                    condition.wait()
+                if errors:
+                    raise errors[0]
+                data = fetched.pop(index)
+                state['next_to_write'] = index + 1
+                condition.notify_all()
+            write(data)
+    except BaseException as e:
+        # Tell the fetchers to stop. They may be in the middle of a request,
+        # so we don't wait for them.
+        with condition:
+            errors.append(e)
+            condition.notify_all()
+        raise
+
+    for thread in threads:
+        thread.join()
+
+
+def stream(url, write):
+    response = urlopen(url, timeout=60)
+    try:
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            write(chunk)
+    finally:
+        response.close()
+
+
+def download(mirrors, output, extract_to, parallel, segment_size):
+    """
+    Download the package from the best of the provided mirrors, and either
+    extract it into extract_to or save it to output. Return the SHA-512
+    checksum of what we downloaded, or None if the download failed.
+    """
+    file = None
+    if extract_to:
+        os.mkdir(extract_to)
+        # strip-components puts the files in the root of extract_to
+        process = subprocess.Popen(
+            ['tar', 'xzf', '-', '-C', extract_to, '--strip-components=1'],
+            stdin=subprocess.PIPE)
+        sinks = [process.stdin]
+    else:
+        process = subprocess.Popen(['gzip', '--test'], stdin=subprocess.PIPE)
+        file = open(output, 'wb')
+        sinks = [file, process.stdin]
+
+    checksum = hashlib.sha512()
+
+    def write(data):
+        checksum.update(data)
+        for sink in sinks:
+            sink.write(data)
+
+    best = mirrors[0]
+    try:
+        if best.supports_ranges and best.size:
+            print("Downloading file at {u} in {p} parallel segments.".format(
+                u=best.url, p=parallel))
+            # Any mirror with the same package can fill in for the best one.
+            urls = [m.url for m in mirrors if m.supports_ranges and m.size == best.size]
+            fetch_segments(urls, best.size, write, parallel, segment_size)
+        else:
+            print("Downloading file at:", best.url)
+            stream(best.url, write)
+    except DOWNLOAD_ERRORS as e:
+        print("Download failed:", e, file=sys.stderr)
+        checksum = None
+    finally:
+        try:
+            process.stdin.close()
+        except (IOError, OSError):
+            pass
+        if file:
+            file.close()
+
+    if process.wait() != 0:
+        checksum = None
+
+    return checksum.hexdigest() if checksum else None
+
+
+def clean_up(output, extract_to):
+    if extract_to:
+        shutil.rmtree(extract_to, ignore_errors=True)
+    elif os.path.exists(output):
+        os.remove(output)
+
+
+if __name__ == '__main__':
+    if sys.version_info < (2, 7) or ((3, 0) <= sys.version_info < (3, 4)):
+        raise Exception(
+            "This script is only supported on Python 2.7+ and 3.4+. "
+            "You are running Python {v}.".format(v=platform.python_version()))
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', action='append', required=True,
+                        help="Where to download the package from. Repeat this to "
+                             "provide several mirrors. An Apache closer.lua URL "
+                             "stands for all the mirrors it lists.")
+    parser.add_argument('--digest-url', action='append', default=[],
+                        help="Where to get the package's published SHA-512 digest. "
+                             "Repeat this to provide fallbacks.")
+    destination = parser.add_mutually_exclusive_group(required=True)
+    destination.add_argument('--output',
+                             help="Save the package to this file.")
+    destination.add_argument('--extract-to',
+                             help="Extract the package into this directory.")
+    parser.add_argument('--parallel', type=int, default=4,
+                        help="How many segments to download at once.")
+    parser.add_argument('--segment-size', type=int, default=8 * 1024 * 1024)
+    args = parser.parse_args()
+
+    name = os.path.basename(args.url[0].split('?', 1)[0])
+
+    expected_checksum = get_published_sha512(args.digest_url)
+    if not expected_checksum:
+        print("Warning: Could not get the published checksum for {n}. "
+              "Relying on gzip's own check.".format(n=name), file=sys.stderr)
+
+    candidate_urls = get_candidate_urls(args.url)
+    bad_urls = set()
+
+    tries = 0
+    while tries < 3:
+        tries += 1
+
+        print("Probing mirrors for {f}...".format(f=name))
+        mirrors = rank_mirrors([url for url in candidate_urls if url not in bad_urls])
+        if not mirrors:
+            print("No mirror could send us {f}. Retrying...".format(f=name))
+            time.sleep(tries)
+            continue
+
+        checksum = download(
+            mirrors=mirrors,
+            output=args.output,
+            extract_to=args.extract_to,
+            parallel=args.parallel,
+            segment_size=args.segment_size)
+
+        if checksum and (not expected_checksum or checksum == expected_checksum):
+            sys.exit(0)
+
+        if checksum:
+            print("Checksum does not match the published checksum. Retrying download...")
+            # Whatever the best mirror has, it's not the package we want.
+            bad_urls.add(mirrors[0].url)
+        else:
+            print("Download failed. Retrying download...")
+        clean_up(args.output, args.extract_to)
+
+    sys.exit(1)
@@ -0,0 +1,75 @@
+"""
+Run batches of shell commands sent by Flintrock over a single SSH channel.
+
+Flintrock starts this script once per connection to a host, and then writes
+one line of JSON to its stdin for each batch of steps it wants to run. A batch
+is a list of steps, and each step is an object with a `command` to run with
+bash and an optional `input` to feed that command on stdin.
+
+For each step we run, we write one line of JSON back to stdout with the step's
+exit status, output, and duration. We stop working on a batch at the first
+step that fails, and then wait for the next batch.
+
+WARNING: Be conscious about what this script prints to stdout, as that
+         output is parsed by Flintrock.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import platform
+import subprocess
+import sys
+import time
+
+
+def run_step(step):
+    """
+    Run a single step and return a report on how it went.
+    """
+    start = time.time()
+    process = subprocess.Popen(
+        ['bash', '-c', step['command']],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    stdout_raw, stderr_raw = process.communicate(
+        input=(step.get('input') or '').encode('utf-8'))
+    return {
+        'exit_status': process.returncode,
+        'stdout': stdout_raw.decode('utf-8', 'replace'),
+        'stderr': stderr_raw.decode('utf-8', 'replace'),
+        'duration': time.time() - start,
+    }
+
+
+def send(message):
+    sys.stdout.write(json.dumps(message) + '\n')
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    if sys.version_info < (2, 7) or ((3, 0) <= sys.version_info < (3, 4)):
+        raise Exception(
+            "This script is only supported on Python 2.7+ and 3.4+. "
+            "You are running Python {v}.".format(v=platform.python_version()))
+
+    # Flintrock runs us under a pseudo-terminal since some distributions
+    # configure sudo to require one. We put the terminal in raw mode so that it
+    # doesn't echo our input back or mangle the JSON going in either direction.
+    if sys.stdin.isatty():
+        import tty
+        tty.setraw(sys.stdin.fileno())
+
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+
+    send({'ready': True})
+
+    for line in iter(stdin.readline, b''):
+        if not line.strip():
+            continue
+        for step in json.loads(line.decode('utf-8')):
+            result = run_step(step)
+            send(result)
+            if result['exit_status'] != 0:
+                break
@@ -140,8 +140,10 @@ def mount_devices(devices):
             'sudo', 'mount', '--source', device.name])
         # NOTE: `mount` changes the mount point owner to root, so we have
         #       to set it to what we want here, after `mount` runs.
+        # NOTE: We use `id -un` and not `logname` since there is no login
+        #       session when a node runs this from its bootstrap script.
         subprocess.check_output(
-            'sudo chown "$(logname):$(logname)" {m}'.format(m=device.mount_point),
+            'sudo chown "$(id -un):$(id -un)" {m}'.format(m=device.mount_point),
             shell=True)
 
 
@@ -154,7 +156,7 @@ def create_root_dir():
     subprocess.check_output([
         'sudo', 'mkdir', '-p', path])
     subprocess.check_output(
-        'sudo chown "$(logname):$(logname)" {p}'.format(p=path),
+        'sudo chown "$(id -un):$(id -un)" {p}'.format(p=path),
         shell=True)
     return path
 
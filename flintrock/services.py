@@ -1,16 +1,25 @@
+import base64
+import functools
+import io
 import json
 import os
 import shlex
 import sys
+import tarfile
 import textwrap
+import time
+import urllib.error
 import urllib.request
 
 # External modules
 import paramiko
 
 # Flintrock modules
-from .core import FlintrockCluster
-from .ssh import ssh_check_output
+from .artifacts import Artifact, get_artifact_store, get_hadoop_artifact, get_spark_artifact
+from .build_cache import get_build_cache, get_build_key
+from .core import FlintrockCluster, register_service
+from .exceptions import ServiceNotReady
+from .ssh import RemoteStep, ssh_check_output, ssh_check_steps
 
 FROZEN = getattr(sys, 'frozen', False)
 
@@ -21,14 +30,135 @@ else:
 
 SCRIPTS_DIR = os.path.join(THIS_DIR, 'scripts')
 
+# How long we wait for a service to report that all its slaves are up.
+DEFAULT_READY_TIMEOUT = 300
 
-# TODO: Cache these files. (?) They are being read potentially tens or
-#       hundreds of times. Maybe it doesn't matter because the files
-#       are so small.
-def get_formatted_template(path: str, mapping: dict) -> str:
+# The port nodes serve artifacts to each other on while we distribute them.
+ARTIFACT_DISTRIBUTION_PORT = 8999
+
+
+@functools.lru_cache(maxsize=None)
+def _read_template(path: str) -> str:
     with open(path) as f:
-        formatted = f.read().format(**mapping)
-    return formatted
+        return f.read()
+
+
+def get_formatted_template(path: str, mapping: dict) -> str:
+    return _read_template(path).format(**mapping)
+
+
+def get_config_archive(*, template_dir: str, mapping: dict) -> str:
+    """
+    Render every template under the provided directory in Flintrock's templates
+    folder, and return the results as a base64-encoded, gzipped tar archive.
+
+    The paths in the archive are relative to the templates folder, which mirrors
+    the layout of the home directory on each node. That way we can ship a
+    service's entire configuration to a node and unpack it with one command.
+
+    Archives are cached, since every node in a cluster gets the same one.
+    """
+    return _render_config_archive(
+        template_dir=template_dir,
+        mapping_items=tuple(sorted(mapping.items())))
+
+
+@functools.lru_cache(maxsize=16)
+def _render_config_archive(*, template_dir: str, mapping_items: tuple) -> str:
+    templates_root = os.path.join(THIS_DIR, 'templates')
+    mapping = dict(mapping_items)
+    mtime = time.time()
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+        for (dirpath, dirnames, filenames) in os.walk(os.path.join(templates_root, template_dir)):
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                contents = get_formatted_template(path=path, mapping=mapping).encode('utf-8')
+
+                info = tarfile.TarInfo(
+                    name=os.path.relpath(path, templates_root).replace(os.sep, '/'))
+                info.size = len(contents)
+                info.mode = os.stat(path).st_mode & 0o777
+                info.mtime = mtime
+                tar.addfile(info, io.BytesIO(contents))
+
+    return base64.b64encode(archive.getvalue()).decode('ascii')
+
+
+def get_config_archive_step(*, name: str, template_dir: str, mapping: dict) -> RemoteStep:
+    """
+    Get a step that unpacks a service's rendered configuration on a node.
+    """
+    return RemoteStep(
+        name=name,
+        command="""
+            set -e
+            set -o pipefail
+            base64 --decode | tar xzf -
+        """,
+        input=get_config_archive(template_dir=template_dir, mapping=mapping))
+
+
+def get_distribute_artifact_step(
+        *,
+        name: str,
+        path: str,
+        cluster: FlintrockCluster,
+        then: str) -> RemoteStep:
+    """
+    Get a step that, run on the cluster master, gets the file at path on the
+    master to every slave and then runs the provided command on each slave.
+    $ARTIFACT holds the path to the file on the slave.
+
+    The master serves the file over the cluster's private network, and slaves
+    pass it on to each other, so only the master needs to download it from
+    outside the cluster.
+    """
+    with open(os.path.join(SCRIPTS_DIR, 'distribute-artifact.py')) as f:
+        distribute_artifact_script = f.read()
+
+    return RemoteStep(
+        name=name,
+        command="""
+            python - --source {source} --port {port} --then {then} {path} {hosts}
+        """.format(
+            source=shlex.quote(cluster.master_host),
+            port=ARTIFACT_DISTRIBUTION_PORT,
+            then=shlex.quote(then),
+            path=shlex.quote(path),
+            hosts=' '.join(shlex.quote(h) for h in cluster.slave_hosts)),
+        input=distribute_artifact_script)
+
+
+def get_download_package_step(
+        *,
+        name: str,
+        artifact: Artifact,
+        output: str=None,
+        extract_to: str=None) -> RemoteStep:
+    """
+    Get a step that downloads an artifact from the fastest of its mirrors,
+    checks it against the first of its published SHA-512 digests that's
+    available, and either extracts it into extract_to or saves it to output.
+    """
+    assert bool(output) ^ bool(extract_to)
+
+    with open(os.path.join(SCRIPTS_DIR, 'download-package.py')) as f:
+        download_package_script = f.read()
+
+    return RemoteStep(
+        name=name,
+        command="""
+            python - {urls} {digest_urls} {destination}
+        """.format(
+            urls=' '.join('--url ' + shlex.quote(url) for url in artifact.urls),
+            digest_urls=' '.join(
+                '--digest-url ' + shlex.quote(url) for url in artifact.digest_urls),
+            destination=(
+                '--output ' + shlex.quote(output) if output
+                else '--extract-to ' + shlex.quote(extract_to))),
+        input=download_package_script)
 
 
 class FlintrockService:
@@ -58,6 +188,32 @@ class FlintrockService:
         """
         raise NotImplementedError
 
+    def get_install_steps(self) -> 'List[RemoteStep]':
+        """
+        Get the steps install() runs on each node. They must not depend on the
+        rest of the cluster, so that nodes can also run them on their own when
+        they first boot.
+
+        Services that do their installation work in install_master() return no
+        steps.
+        """
+        raise NotImplementedError
+
+    def install_master(
+            self,
+            ssh_client: paramiko.client.SSHClient,
+            cluster: FlintrockCluster):
+        """
+        Do any installation work that only needs to happen once per cluster, like
+        building the service from source, via the provided SSH client. Services
+        that do this work here are responsible for getting the results onto the
+        slaves.
+
+        This method is meant to be called once on the cluster master, after
+        install() has run on every node and before configure() runs on any.
+        """
+        pass
+
     def configure(
             self,
             ssh_client: paramiko.client.SSHClient,
@@ -98,6 +254,54 @@ class FlintrockService:
         """
         raise NotImplementedError
 
+    def is_ready(
+            self,
+            master_host: str,
+            num_slaves: int) -> bool:
+        """
+        Check whether the service is up and all of its slaves have registered
+        with the master. Return False if they haven't yet.
+
+        This method may raise an exception if the master can't be reached, and
+        callers should treat that as not being ready.
+        """
+        raise NotImplementedError
+
+    def wait_for_ready(
+            self,
+            *,
+            master_host: str,
+            num_slaves: int,
+            timeout: float=DEFAULT_READY_TIMEOUT) -> float:
+        """
+        Poll the service with is_ready() until it's ready, backing off between
+        attempts. Return how long we waited, or raise ServiceNotReady if the
+        service isn't ready before the timeout.
+        """
+        service_name = type(self).__name__
+        start = time.time()
+        deadline = start + timeout
+        delay = 0.5
+        reason = "no slaves have registered yet"
+
+        while True:
+            try:
+                if self.is_ready(master_host=master_host, num_slaves=num_slaves):
+                    break
+            except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+                reason = str(e)
+            else:
+                reason = "not all {n} slaves have registered".format(n=num_slaves)
+
+            if time.time() + delay > deadline:
+                raise ServiceNotReady(service=service_name, message=reason)
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+
+        waited = time.time() - start
+        print("{s} ready after {t:.1f} seconds.".format(s=service_name, t=waited))
+        return waited
+
     def health_check(
             self,
             master_host: str):
@@ -107,61 +311,119 @@ class FlintrockService:
         raise NotImplementedError
 
 
+@register_service
 class HDFS(FlintrockService):
-    def __init__(self, version, download_source):
+    def __init__(
+            self,
+            version,
+            download_source,
+            distribute_artifacts=False,
+            artifact_store=None):
         self.version = version
         self.download_source = download_source
+        # How we get the package onto the nodes doesn't matter once it's there,
+        # so we leave these out of the manifest.
+        self.distribute_artifacts = distribute_artifacts
+        self.artifact = get_hadoop_artifact(version=version, download_source=download_source)
+        if artifact_store:
+            self.artifact = get_artifact_store(artifact_store).get_artifact(self.artifact)
         self.manifest = {'version': version, 'download_source': download_source}
 
+    # Unpack the Hadoop package at $ARTIFACT.
+    extract_command = """
+        set -e
+
+        mkdir "hadoop"
+        mkdir "hadoop/conf"
+
+        tar xzf "$ARTIFACT" -C "hadoop" --strip-components=1
+    """
+
     def install(
             self,
             ssh_client: paramiko.client.SSHClient,
             cluster: FlintrockCluster):
+        steps = self.get_install_steps()
+        if not steps:
+            return
+
         print("[{h}] Installing HDFS...".format(
             h=ssh_client.get_transport().getpeername()[0]))
 
-        with ssh_client.open_sftp() as sftp:
-            sftp.put(
-                localpath=os.path.join(SCRIPTS_DIR, 'download-hadoop.py'),
-                remotepath='/tmp/download-hadoop.py')
+        ssh_check_steps(client=ssh_client, steps=steps)
 
-        ssh_check_output(
-            client=ssh_client,
-            command="""
-                set -e
+    def get_install_steps(self) -> 'List[RemoteStep]':
+        if self.distribute_artifacts:
+            # We download the package once on the master in install_master()
+            # and distribute it from there.
+            return []
 
-                python /tmp/download-hadoop.py "{version}" "{download_source}"
+        return [
+            self._get_download_step(extract=True),
+            RemoteStep(
+                name='hdfs-conf',
+                command="""
+                    mkdir "hadoop/conf"
+                """),
+        ]
 
-                mkdir "hadoop"
-                mkdir "hadoop/conf"
+    def install_master(
+            self,
+            ssh_client: paramiko.client.SSHClient,
+            cluster: FlintrockCluster):
+        if not self.distribute_artifacts:
+            return
 
-                tar xzf "hadoop-{version}.tar.gz" -C "hadoop" --strip-components=1
-                rm "hadoop-{version}.tar.gz"
-            """.format(version=self.version, download_source=self.download_source))
+        host = ssh_client.get_transport().getpeername()[0]
+        print("[{h}] Installing HDFS and distributing it to {n} slaves...".format(
+            h=host,
+            n=len(cluster.slave_hosts)))
+
+        steps = [self._get_download_step()]
+        if cluster.slave_hosts:
+            steps.append(
+                get_distribute_artifact_step(
+                    name='hdfs-distribute',
+                    path=self.artifact.name,
+                    cluster=cluster,
+                    then=self.extract_command))
+        steps.append(self._get_extract_step())
+
+        ssh_check_steps(client=ssh_client, steps=steps)
+
+    def _get_download_step(self, *, extract: bool=False) -> RemoteStep:
+        """
+        Get a step that downloads Hadoop and either extracts it straight into
+        ~/hadoop as it comes in or, if we need the package itself, saves it.
+        """
+        return get_download_package_step(
+            name='hdfs-install' if extract else 'hdfs-download',
+            artifact=self.artifact,
+            output=None if extract else self.artifact.name,
+            extract_to='hadoop' if extract else None)
+
+    def _get_extract_step(self) -> RemoteStep:
+        return RemoteStep(
+            name='hdfs-extract',
+            command="""
+                export ARTIFACT={package}
+                {extract}
+                rm "$ARTIFACT"
+            """.format(
+                package=shlex.quote(self.artifact.name),
+                extract=self.extract_command))
 
     def configure(
             self,
             ssh_client: paramiko.client.SSHClient,
             cluster: FlintrockCluster):
-        # TODO: os.walk() through these files.
-        template_paths = [
-            'hadoop/conf/masters',
-            'hadoop/conf/slaves',
-            'hadoop/conf/hadoop-env.sh',
-            'hadoop/conf/core-site.xml',
-            'hadoop/conf/hdfs-site.xml']
-
-        for template_path in template_paths:
-            ssh_check_output(
-                client=ssh_client,
-                command="""
-                    echo {f} > {p}
-                """.format(
-                    f=shlex.quote(
-                        get_formatted_template(
-                            path=os.path.join(THIS_DIR, "templates", template_path),
-                            mapping=cluster.generate_template_mapping(service='hdfs'))),
-                    p=shlex.quote(template_path)))
+        ssh_check_steps(
+            client=ssh_client,
+            steps=[
+                get_config_archive_step(
+                    name='hdfs-configure',
+                    template_dir='hadoop/conf',
+                    mapping=cluster.generate_template_mapping(service='hdfs'))])
 
     # TODO: Convert this into start_master() and split master- or slave-specific
     #       stuff out of configure() into configure_master() and configure_slave().
@@ -179,6 +441,15 @@ class HDFS(FlintrockService):
                 ./hadoop/sbin/start-dfs.sh
             """)
 
+    def is_ready(self, master_host: str, num_slaves: int) -> bool:
+        namenode_jmx = (
+            'http://{m}:50070/jmx?qry=Hadoop:service=NameNode,name=FSNamesystemState'
+            .format(m=master_host))
+
+        namenode_state = json.loads(
+            urllib.request.urlopen(namenode_jmx, timeout=5).read().decode('utf-8'))
+        return namenode_state['beans'][0]['NumLiveDataNodes'] >= num_slaves
+
     def health_check(self, master_host: str):
         # This info is not helpful as a detailed health check, but it gives us
         # an up / not up signal.
@@ -197,8 +468,17 @@ class HDFS(FlintrockService):
         print("HDFS online.")
 
 
+@register_service
 class Spark(FlintrockService):
-    def __init__(self, version: str=None, git_commit: str=None, git_repository: str=None):
+    def __init__(
+            self,
+            version: str=None,
+            git_commit: str=None,
+            git_repository: str=None,
+            git_build_cache: str=None,
+            git_build_cache_s3_endpoint: str=None,
+            distribute_artifacts: bool=False,
+            artifact_store: str=None):
         # TODO: Convert these checks into something that throws a proper exception.
         #       Perhaps reuse logic from CLI.
         assert bool(version) ^ bool(git_commit)
@@ -208,6 +488,18 @@ class Spark(FlintrockService):
         self.version = version
         self.git_commit = git_commit
         self.git_repository = git_repository
+        # The build cache and how we get Spark onto the nodes only matter at
+        # install time, so we leave them out of the manifest.
+        self.git_build_cache = git_build_cache
+        self.git_build_cache_s3_endpoint = git_build_cache_s3_endpoint
+        self.distribute_artifacts = distribute_artifacts
+        # TODO: Allow users to specify the Spark "distribution". (?)
+        self.distribution = 'hadoop2.6'
+        self.artifact = None
+        if version:
+            self.artifact = get_spark_artifact(version=version, distribution=self.distribution)
+            if artifact_store:
+                self.artifact = get_artifact_store(artifact_store).get_artifact(self.artifact)
 
         self.manifest = {
             'version': version,
@@ -218,75 +510,249 @@ class Spark(FlintrockService):
             self,
             ssh_client: paramiko.client.SSHClient,
             cluster: FlintrockCluster):
-        # TODO: Allow users to specify the Spark "distribution". (?)
-        distribution = 'hadoop2.6'
+        steps = self.get_install_steps()
+        if not steps:
+            return
 
         print("[{h}] Installing Spark...".format(
             h=ssh_client.get_transport().getpeername()[0]))
 
         try:
-            if self.version:
-                with ssh_client.open_sftp() as sftp:
-                    sftp.put(
-                        localpath=os.path.join(SCRIPTS_DIR, 'install-spark.sh'),
-                        remotepath='/tmp/install-spark.sh')
-                    sftp.chmod(path='/tmp/install-spark.sh', mode=0o755)
-                ssh_check_output(
+            ssh_check_steps(client=ssh_client, steps=steps)
+        except Exception as e:
+            # TODO: This should be a more specific exception.
+            print("Error: Failed to install Spark.", file=sys.stderr)
+            print(e, file=sys.stderr)
+            raise
+
+    def get_install_steps(self) -> 'List[RemoteStep]':
+        if self.git_commit or self.distribute_artifacts:
+            # We build or download Spark once on the master in install_master()
+            # and distribute it from there.
+            return []
+
+        return [self._get_install_step()]
+
+    def install_master(
+            self,
+            ssh_client: paramiko.client.SSHClient,
+            cluster: FlintrockCluster):
+        if self.git_commit:
+            self._install_master_from_git(ssh_client=ssh_client, cluster=cluster)
+        elif self.distribute_artifacts:
+            self._install_master_from_release(ssh_client=ssh_client, cluster=cluster)
+
+    def _get_install_step(self, *, download_only: bool=False) -> RemoteStep:
+        """
+        Get a step that downloads Spark and either extracts it straight into
+        ~/spark as it comes in or, if we need the package itself, saves it.
+        """
+        return get_download_package_step(
+            name='spark-download' if download_only else 'spark-install',
+            artifact=self.artifact,
+            output=self.artifact.name if download_only else None,
+            extract_to=None if download_only else 'spark')
+
+    def _install_master_from_release(
+            self,
+            *,
+            ssh_client: paramiko.client.SSHClient,
+            cluster: FlintrockCluster):
+        host = ssh_client.get_transport().getpeername()[0]
+        print("[{h}] Installing Spark and distributing it to {n} slaves...".format(
+            h=host,
+            n=len(cluster.slave_hosts)))
+
+        package = self.artifact.name
+        # strip-components puts the files in the root of spark/
+        extract_command = """
+            set -e
+            mkdir "spark"
+            tar xzf "$ARTIFACT" -C "spark" --strip-components=1
+        """
+
+        steps = [self._get_install_step(download_only=True)]
+        if cluster.slave_hosts:
+            steps.append(
+                get_distribute_artifact_step(
+                    name='spark-distribute',
+                    path=package,
+                    cluster=cluster,
+                    then=extract_command))
+        steps.append(
+            RemoteStep(
+                name='spark-extract',
+                command="""
+                    export ARTIFACT={package}
+                    {extract}
+                    rm "$ARTIFACT"
+                """.format(
+                    package=shlex.quote(package),
+                    extract=extract_command)))
+
+        try:
+            ssh_check_steps(client=ssh_client, steps=steps)
+        except Exception as e:
+            # TODO: This should be a more specific exception.
+            print("Error: Failed to install Spark.", file=sys.stderr)
+            print(e, file=sys.stderr)
+            raise
+
+    def _install_master_from_git(
+            self,
+            *,
+            ssh_client: paramiko.client.SSHClient,
+            cluster: FlintrockCluster):
+        host = ssh_client.get_transport().getpeername()[0]
+        hadoop_profile = 'hadoop-2.6'
+
+        build_cache = None
+        if self.git_build_cache:
+            build_cache = get_build_cache(
+                self.git_build_cache,
+                s3_endpoint_url=self.git_build_cache_s3_endpoint)
+            build_key = get_build_key(
+                repository=self.git_repository,
+                commit=self.git_commit,
+                profile=hadoop_profile)
+
+        try:
+            if build_cache and build_cache.contains(build_key):
+                print("[{h}] Fetching Spark build of {c} from cache...".format(
+                    h=host, c=self.git_commit))
+                build_cache.fetch(
+                    key=build_key,
+                    ssh_client=ssh_client,
+                    remote_path='spark-dist.tgz')
+                ssh_check_steps(
                     client=ssh_client,
-                    command="""
-                        set -e
-                        /tmp/install-spark.sh {spark_version} {distribution}
-                        rm -f /tmp/install-spark.sh
-                    """.format(
-                            spark_version=shlex.quote(self.version),
-                            distribution=shlex.quote(distribution)))
+                    steps=[
+                        RemoteStep(
+                            name='spark-unpack',
+                            command="""
+                                set -e
+                                rm -rf spark
+                                mkdir spark
+                                tar xzf spark-dist.tgz -C spark
+                            """),
+                    ])
             else:
-                ssh_check_output(
+                self._build(ssh_client=ssh_client, hadoop_profile=hadoop_profile)
+                if build_cache:
+                    print("[{h}] Storing Spark build of {c} in cache...".format(
+                        h=host, c=self.git_commit))
+                    try:
+                        build_cache.store(
+                            key=build_key,
+                            ssh_client=ssh_client,
+                            remote_path='spark-dist.tgz')
+                    except Exception as e:
+                        # The cluster is fine without the cache, so we carry on.
+                        print(
+                            "[{h}] Could not store Spark build in cache: {e}".format(h=host, e=e),
+                            file=sys.stderr)
+
+            if cluster.slave_hosts:
+                print("[{h}] Distributing Spark build to {n} slaves...".format(
+                    h=host,
+                    n=len(cluster.slave_hosts)))
+                ssh_check_steps(
                     client=ssh_client,
+                    steps=[
+                        get_distribute_artifact_step(
+                            name='spark-distribute',
+                            path='spark-dist.tgz',
+                            cluster=cluster,
+                            then="""
+                                set -e
+                                rm -rf spark
+                                mkdir spark
+                                tar xzf "$ARTIFACT" -C spark
+                            """),
+                    ])
+
+            ssh_check_output(
+                client=ssh_client,
+                command="""
+                    rm spark-dist.tgz
+                """)
+        except Exception as e:
+            # TODO: This should be a more specific exception.
+            print("Error: Failed to build Spark.", file=sys.stderr)
+            print(e, file=sys.stderr)
+            raise
+
+    def _build(
+            self,
+            *,
+            ssh_client: paramiko.client.SSHClient,
+            hadoop_profile: str):
+        """
+        Build Spark on a node, install the distribution as ~/spark, and package
+        it up as ~/spark-dist.tgz.
+        """
+        host = ssh_client.get_transport().getpeername()[0]
+        print("[{h}] Building Spark at {c}...".format(h=host, c=self.git_commit))
+
+        ssh_check_steps(
+            client=ssh_client,
+            steps=[
+                RemoteStep(
+                    name='spark-build-dependencies',
                     command="""
                         set -e
                         sudo yum install -y git
                         sudo yum install -y java-devel
-                        """)
-                ssh_check_output(
-                    client=ssh_client,
+                    """),
+                # We fetch just the commit we need instead of cloning the
+                # whole repository. Not every Git server lets us fetch an
+                # arbitrary commit, so we fall back to a full fetch.
+                RemoteStep(
+                    name='spark-fetch',
                     command="""
                         set -e
-                        git clone {repo} spark
-                        cd spark
-                        git reset --hard {commit}
+                        rm -rf spark-src
+                        mkdir spark-src
+                        cd spark-src
+                        git init --quiet
+                        git remote add origin {repo}
+                        git fetch --quiet --depth 1 origin {commit} || git fetch --quiet origin
+                        git -c advice.detachedHead=false checkout --quiet {commit}
+                    """.format(
+                        repo=shlex.quote(self.git_repository),
+                        commit=shlex.quote(self.git_commit))),
+                RemoteStep(
+                    name='spark-build',
+                    command="""
+                        set -e
+                        cd spark-src
                         if [ -e "make-distribution.sh" ]; then
-                            ./make-distribution.sh -Phadoop-2.6
+                            make_distribution="./make-distribution.sh"
                         else
-                            ./dev/make-distribution.sh -Phadoop-2.6
+                            make_distribution="./dev/make-distribution.sh"
                         fi
-                    """.format(
-                        repo=shlex.quote(self.git_repository),
-                        commit=shlex.quote(self.git_commit)))
-        except Exception as e:
-            # TODO: This should be a more specific exception.
-            print("Error: Failed to install Spark.", file=sys.stderr)
-            print(e, file=sys.stderr)
-            raise
+                        if ! "$make_distribution" -P{profile} > ../spark-build.log 2>&1; then
+                            tail -n 100 ../spark-build.log >&2
+                            exit 1
+                        fi
+                        cd ..
+                        rm -rf spark
+                        mv spark-src/dist spark
+                        tar czf spark-dist.tgz -C spark .
+                    """.format(profile=shlex.quote(hadoop_profile))),
+            ])
 
     def configure(
             self,
             ssh_client: paramiko.client.SSHClient,
             cluster: FlintrockCluster):
-        template_paths = [
-            'spark/conf/spark-env.sh',
-            'spark/conf/slaves']
-        for template_path in template_paths:
-            ssh_check_output(
-                client=ssh_client,
-                command="""
-                    echo {f} > {p}
-                """.format(
-                    f=shlex.quote(
-                        get_formatted_template(
-                            path=os.path.join(THIS_DIR, "templates", template_path),
-                            mapping=cluster.generate_template_mapping(service='spark'))),
-                    p=shlex.quote(template_path)))
+        ssh_check_steps(
+            client=ssh_client,
+            steps=[
+                get_config_archive_step(
+                    name='spark-configure',
+                    template_dir='spark/conf',
+                    mapping=cluster.generate_template_mapping(service='spark'))])
 
     # TODO: Convert this into start_master() and split master- or slave-specific
     #       stuff out of configure() into configure_master() and configure_slave().
@@ -301,7 +767,6 @@ class Spark(FlintrockService):
 
         # TODO: Maybe move this shell script out to some separate file/folder
         #       for the Spark service.
-        # TODO: Add some timeout for waiting on master UI to come up.
         ssh_check_output(
             client=ssh_client,
             command="""
@@ -312,8 +777,14 @@ class Spark(FlintrockService):
                 set +e
 
                 master_ui_response_code=0
+                seconds_waited=0
                 while [ "$master_ui_response_code" -ne 200 ]; do
+                    if [ "$seconds_waited" -ge {timeout} ]; then
+                        echo "Spark master UI did not come up after {timeout} seconds." >&2
+                        exit 1
+                    fi
                     sleep 1
+                    seconds_waited=$((seconds_waited + 1))
                     master_ui_response_code="$(
                         curl --head --silent --output /dev/null \
                              --write-out "%{{http_code}}" {m}:8080
@@ -324,7 +795,16 @@ class Spark(FlintrockService):
 
                 spark/sbin/start-slaves.sh
             """.format(
-                m=shlex.quote(cluster.master_host)))
+                m=shlex.quote(cluster.master_host),
+                timeout=DEFAULT_READY_TIMEOUT))
+
+    def is_ready(self, master_host: str, num_slaves: int) -> bool:
+        spark_master_ui = 'http://{m}:8080/json/'.format(m=master_host)
+
+        spark_ui_info = json.loads(
+            urllib.request.urlopen(spark_master_ui, timeout=5).read().decode('utf-8'))
+        alive_workers = [w for w in spark_ui_info['workers'] if w['state'] == 'ALIVE']
+        return len(alive_workers) >= num_slaves
 
     def health_check(self, master_host: str):
         spark_master_ui = 'http://{m}:8080/json/'.format(m=master_host)
@@ -1,17 +1,40 @@
+import contextlib
 import errno
+import json
 import os
+import random
+import shlex
 import socket
 import subprocess
+import sys
 import tempfile
+import threading
 import time
+import weakref
 from collections import namedtuple
 
 # External modules
 import paramiko
 
 # Flintrock modules
+from . import tracing
 from .exceptions import SSHError
 
+FROZEN = getattr(sys, 'frozen', False)
+
+if FROZEN:
+    THIS_DIR = sys._MEIPASS
+else:
+    THIS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+SCRIPTS_DIR = os.path.join(THIS_DIR, 'scripts')
+
+# How long we wait for a host to accept SSH connections before giving up.
+DEFAULT_SSH_WAIT_TIMEOUT = 600
+# Some AMIs accept connections before the login user's keys are in place, so
+# we retry authentication failures for this long after SSH first answers.
+AUTH_FAILURE_GRACE_PERIOD = 60
+
 
 def generate_ssh_key_pair() -> namedtuple('KeyPair', ['public', 'private']):
     """
@@ -41,11 +64,20 @@ def get_ssh_client(
         user: str,
         host: str,
         identity_file: str,
+        port: int=22,
         wait: bool=False,
-        print_status: bool=None) -> paramiko.client.SSHClient:
+        print_status: bool=None,
+        timeout: float=DEFAULT_SSH_WAIT_TIMEOUT,
+        is_booted: 'Callable[[], bool]'=None) -> paramiko.client.SSHClient:
     """
     Get an SSH client for the provided host, waiting as necessary for SSH to become
     available.
+
+    When waiting, we back off exponentially with full jitter between attempts,
+    so that a large cluster's worth of hosts don't all retry in lockstep, and we
+    give up after timeout seconds. If is_booted is provided, we don't try to
+    connect until it returns True. Providers can use it to hold off until they
+    know the host has booted.
     """
     if print_status is None:
         print_status = wait
@@ -55,41 +87,186 @@ def get_ssh_client(
     client.load_system_host_keys()
     client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
 
-    if wait:
-        tries = 100
-    else:
-        tries = 1
+    start = time.time()
+    deadline = start + timeout
+    first_auth_failure = None
+    attempt = 0
 
-    while tries > 0:
-        try:
-            tries -= 1
-            client.connect(
-                username=user,
-                hostname=host,
-                key_filename=identity_file,
-                look_for_keys=False,
-                timeout=3)
-            if print_status:
-                print("[{h}] SSH online.".format(h=host))
-            break
-        except socket.timeout as e:
-            time.sleep(5)
-        except socket.error as e:
-            if e.errno != errno.ECONNREFUSED:
-                raise
-            time.sleep(5)
-        # We get this exception during startup with CentOS but not Amazon Linux,
-        # for some reason.
-        except paramiko.ssh_exception.AuthenticationException as e:
-            time.sleep(5)
-    else:
-        raise SSHError(
-            host=host,
-            message="Could not connect via SSH.")
+    while True:
+        if not wait or is_booted is None or is_booted():
+            try:
+                client.connect(
+                    username=user,
+                    hostname=host,
+                    port=port,
+                    key_filename=identity_file,
+                    look_for_keys=False,
+                    timeout=3)
+                break
+            except socket.timeout as e:
+                failure = e
+            except socket.error as e:
+                # Newer versions of Paramiko wrap connection errors in a
+                # NoValidConnectionsError, which has no errno of its own.
+                if e.errno not in [errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ECONNRESET] \
+                        and not getattr(e, 'errors', None):
+                    raise
+                failure = e
+            # We get this exception during startup with CentOS but not Amazon Linux,
+            # for some reason.
+            except paramiko.ssh_exception.AuthenticationException as e:
+                if first_auth_failure is None:
+                    first_auth_failure = time.time()
+                if time.time() - first_auth_failure > AUTH_FAILURE_GRACE_PERIOD:
+                    raise SSHError(
+                        host=host,
+                        message="Could not authenticate via SSH as {u}.".format(u=user))
+                failure = e
+            # sshd may drop connections while it's still starting up.
+            except paramiko.ssh_exception.SSHException as e:
+                failure = e
+
+            if not wait:
+                raise SSHError(
+                    host=host,
+                    message="Could not connect via SSH: {e}".format(e=failure))
+
+        # See: https://www.awsarchitectureblog.com/2015/03/backoff.html
+        delay = random.uniform(0, min(30, 2 ** attempt))
+        attempt += 1
+        if time.time() + delay > deadline:
+            raise SSHError(
+                host=host,
+                message="Could not connect via SSH after {t} seconds.".format(t=timeout))
+        time.sleep(delay)
+
+    if print_status:
+        print("[{h}] SSH online after {t:.1f} seconds.".format(
+            h=host,
+            t=time.time() - start))
 
     return client
 
 
+class SSHClientPool:
+    """
+    A pool of open SSH clients, keyed by (user, host, identity file).
+
+    Connecting to a host means paying for a TCP handshake, a key exchange, and
+    authentication. A cluster operation usually talks to each node several times,
+    so we connect once and lend the same client out to each caller.
+
+    Clients are kept alive with SSH keepalives, checked for health before they are
+    lent out, and closed once they have sat idle for max_idle seconds.
+
+    Paramiko clients can carry several channels at once, so a client may be lent
+    to more than one caller at a time.
+    """
+    def __init__(
+            self,
+            *,
+            keepalive_interval: int=30,
+            max_idle: int=300,
+            connect=get_ssh_client):
+        self.keepalive_interval = keepalive_interval
+        self.max_idle = max_idle
+        self.connect = connect
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        # key -> [client, number of active borrowers, time last returned]
+        self._entries = {}
+
+    @staticmethod
+    def _is_healthy(client: paramiko.client.SSHClient) -> bool:
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _evict_idle(self):
+        now = time.time()
+        with self._lock:
+            idle_keys = [
+                key for key, (client, borrowers, last_used) in self._entries.items()
+                if borrowers == 0 and now - last_used > self.max_idle]
+            idle_clients = [self._entries.pop(key)[0] for key in idle_keys]
+        for client in idle_clients:
+            client.close()
+
+    def _checkout(self, *, user: str, host: str, identity_file: str, **kwargs):
+        key = (user, host, identity_file)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # We hold a per-key lock while connecting so that concurrent callers for
+        # the same host share one connection, without blocking callers for other
+        # hosts.
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+
+            if entry is not None and not self._is_healthy(entry[0]):
+                with self._lock:
+                    self._entries.pop(key, None)
+                entry[0].close()
+                entry = None
+
+            if entry is None:
+                with tracing.span('ssh-wait' if kwargs.get('wait') else 'ssh-connect', host=host):
+                    client = self.connect(
+                        user=user,
+                        host=host,
+                        identity_file=identity_file,
+                        **kwargs)
+                client.get_transport().set_keepalive(self.keepalive_interval)
+                entry = [client, 0, time.time()]
+                with self._lock:
+                    self._entries[key] = entry
+
+            with self._lock:
+                entry[1] += 1
+
+        return (key, entry)
+
+    def _checkin(self, key, entry):
+        with self._lock:
+            entry[1] -= 1
+            entry[2] = time.time()
+            if not self._is_healthy(entry[0]) and self._entries.get(key) is entry:
+                del self._entries[key]
+
+    @contextlib.contextmanager
+    def borrow(self, *, user: str, host: str, identity_file: str, **kwargs):
+        """
+        Borrow an SSH client for the provided host, connecting to it first if
+        there's no healthy client for it in the pool.
+
+        Any extra keyword arguments, like `wait`, are passed on to the connect
+        function when we need a new connection.
+
+        The client remains open when the borrower is done with it.
+        """
+        self._evict_idle()
+        key, entry = self._checkout(
+            user=user,
+            host=host,
+            identity_file=identity_file,
+            **kwargs)
+        try:
+            yield entry[0]
+        finally:
+            self._checkin(key, entry)
+
+    def close(self):
+        """
+        Close every client in the pool.
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for client, _, _ in entries:
+            client.close()
+
+
 def ssh_check_output(client: paramiko.client.SSHClient, command: str):
     """
     Run a command via the provided SSH client and return the output captured
@@ -118,6 +295,162 @@ def ssh_check_output(client: paramiko.client.SSHClient, command: str):
     return stdout_output
 
 
+class RemoteStep:
+    """
+    A shell command to run on a remote host as part of a batch of steps.
+
+    input, if provided, is fed to the command on stdin. name is used to
+    identify the step in reports.
+    """
+    def __init__(self, command: str, *, input: str=None, name: str=None):
+        self.command = command
+        self.input = input
+        self.name = name
+
+
+StepResult = namedtuple('StepResult', ['name', 'output', 'duration'])
+
+
+class RemoteAgent:
+    """
+    A small Python agent running on a remote host that runs batches of steps
+    for us over a single SSH channel.
+
+    Every exec_command() opens a new channel, which costs us a few round trips
+    before the command even starts. The agent is started once per SSH client,
+    and then we stream whole batches of steps to it and read back the results
+    as they complete.
+
+    We pass the agent's source inline when we start it, so there is nothing to
+    upload first.
+    """
+    def __init__(self, client: paramiko.client.SSHClient):
+        self.host = client.get_transport().getpeername()[0]
+        self._lock = threading.Lock()
+
+        with open(os.path.join(SCRIPTS_DIR, 'remote-agent.py')) as f:
+            source = f.read()
+
+        # NOTE: We need a pty for the same reason as ssh_check_output(). The agent
+        #       puts the pty into raw mode before it tells us it's ready.
+        stdin, stdout, stderr = client.exec_command(
+            'python -u -c ' + shlex.quote(source),
+            get_pty=True)
+        self._stdin = stdin
+        self._stdout = stdout
+
+        noise = []
+        while True:
+            line = self._read_line()
+            if line is None:
+                raise SSHError(
+                    host=self.host,
+                    message="Could not start the remote agent.\n" + '\n'.join(noise))
+            try:
+                if json.loads(line) == {'ready': True}:
+                    break
+            except ValueError:
+                noise.append(line)
+
+    def _read_line(self) -> str:
+        while True:
+            line = self._stdout.readline()
+            if not line:
+                return None
+            if isinstance(line, bytes):
+                line = line.decode('utf8')
+            line = line.strip()
+            if line:
+                return line
+
+    @property
+    def is_alive(self) -> bool:
+        channel = self._stdout.channel
+        return not channel.closed and not channel.exit_status_ready()
+
+    def run(self, steps: 'List[RemoteStep]') -> 'List[StepResult]':
+        """
+        Run a batch of steps in order, stopping at the first one that fails.
+
+        Raise an exception if any step returns a non-zero code.
+        """
+        with self._lock:
+            self._stdin.write(
+                json.dumps([
+                    {'command': step.command, 'input': step.input}
+                    for step in steps]) + '\n')
+            self._stdin.flush()
+
+            results = []
+            for step in steps:
+                line = self._read_line()
+                if line is None:
+                    raise SSHError(
+                        host=self.host,
+                        message="The remote agent exited unexpectedly.")
+                report = json.loads(line)
+                # The agent times each step on the host, and we have only just
+                # heard that the step ended.
+                tracing.add_span(
+                    step.name or 'step',
+                    start=time.time() - report['duration'],
+                    duration=report['duration'],
+                    host=self.host,
+                    exit_status=report['exit_status'])
+                stdout_output = report['stdout'].rstrip('\n')
+                stderr_output = report['stderr'].rstrip('\n')
+
+                if report['exit_status']:
+                    raise SSHError(
+                        host=self.host,
+                        message=stdout_output + stderr_output)
+
+                results.append(
+                    StepResult(
+                        name=step.name,
+                        output=stdout_output,
+                        duration=report['duration']))
+
+        return results
+
+
+_remote_agents = weakref.WeakKeyDictionary()
+_remote_agents_lock = threading.Lock()
+
+
+def get_remote_agent(client: paramiko.client.SSHClient) -> RemoteAgent:
+    """
+    Get the remote agent for the provided SSH client, starting it if necessary.
+    """
+    with _remote_agents_lock:
+        agent = _remote_agents.get(client)
+
+    if agent is None or not agent.is_alive:
+        agent = RemoteAgent(client)
+        with _remote_agents_lock:
+            _remote_agents[client] = agent
+
+    return agent
+
+
+def ssh_check_steps(
+        client: paramiko.client.SSHClient,
+        steps: 'List[RemoteStep]') -> 'List[StepResult]':
+    """
+    Run a batch of steps on the host via the provided SSH client, and return
+    what each step output to stdout along with how long it took.
+
+    Steps may be RemoteStep instances or plain command strings.
+
+    Raise an exception if any of the steps returns a non-zero code. Steps after
+    the failed step are not run.
+    """
+    steps = [
+        step if isinstance(step, RemoteStep) else RemoteStep(step)
+        for step in steps]
+    return get_remote_agent(client).run(steps)
+
+
 def ssh(*, user: str, host: str, identity_file: str):
     """
     SSH into a host for interactive use.
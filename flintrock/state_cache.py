@@ -0,0 +1,285 @@
+"""
+Remember what we know about clusters -- their nodes, roles, addresses, and
+installed services -- in a local SQLite database, so that commands like
+describe and login don't have to look clusters up in the provider every time.
+
+The cache is only ever a shortcut. We ignore entries older than the TTL, and
+commands that change a cluster always look it up in the provider first and
+then record what they did here.
+
+Clusters are cached per provider, region, and VPC as the user asked for them,
+so a cluster looked up in the default VPC is cached under an empty VPC ID.
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# External modules
+import click
+
+# How long, in seconds, we trust what we've cached about a cluster.
+DEFAULT_TTL = 5 * 60
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS clusters (
+        provider TEXT NOT NULL,
+        region TEXT NOT NULL,
+        vpc_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        entry TEXT NOT NULL,
+        manifest TEXT,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (provider, region, vpc_id, name)
+    );
+
+    -- When we last listed every cluster in a region and VPC. Until the listing
+    -- expires, the clusters table has every cluster there.
+    CREATE TABLE IF NOT EXISTS listings (
+        provider TEXT NOT NULL,
+        region TEXT NOT NULL,
+        vpc_id TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (provider, region, vpc_id)
+    );
+
+    -- Security groups we couldn't delete when we destroyed their cluster
+    -- because its instances were still shutting down.
+    CREATE TABLE IF NOT EXISTS pending_security_groups (
+        provider TEXT NOT NULL,
+        region TEXT NOT NULL,
+        group_id TEXT NOT NULL,
+        group_name TEXT NOT NULL,
+        added_at REAL NOT NULL,
+        PRIMARY KEY (provider, region, group_id)
+    );
+"""
+
+
+def get_state_file() -> str:
+    """
+    Get the path to the cache, which lives next to Flintrock's default
+    configuration file.
+    """
+    return os.path.join(click.get_app_dir(app_name='Flintrock'), 'state.db')
+
+
+class StateCache:
+    """
+    The entries we cache are whatever the provider needs to rebuild a cluster
+    without calling out to the cloud, as a dict that can be serialized to
+    JSON. Manifests are the service manifests from the cluster's master.
+
+    Problems with the cache itself, like a corrupt database file, are reported
+    as warnings and otherwise treated like a cache miss.
+    """
+    def __init__(self, path: str=None):
+        self.path = path or get_state_file()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10)
+        try:
+            connection.executescript(SCHEMA)
+            # Commit everything we do in one transaction, or nothing if we fail.
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @contextlib.contextmanager
+    def _ignore_errors(self):
+        try:
+            yield
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(
+                "Warning: Could not use the cluster state cache at {p}: {e}"
+                .format(p=self.path, e=e),
+                file=sys.stderr)
+
+    def get_cluster(
+            self,
+            *,
+            provider: str,
+            region: str,
+            vpc_id: str,
+            name: str,
+            max_age: float=DEFAULT_TTL) -> dict:
+        """
+        Get the cached entry for a cluster, with its manifest under the
+        'manifest' key, or None if we don't have a fresh one.
+        """
+        with self._ignore_errors():
+            with self._connect() as connection:
+                row = connection.execute(
+                    """
+                    SELECT entry, manifest FROM clusters
+                    WHERE provider = ? AND region = ? AND vpc_id = ? AND name = ?
+                        AND updated_at >= ?
+                    """,
+                    (provider, region, vpc_id, name, time.time() - max_age)).fetchone()
+            if row is not None:
+                return _load_entry(*row)
+        return None
+
+    def get_clusters(
+            self,
+            *,
+            provider: str,
+            region: str,
+            vpc_id: str,
+            max_age: float=DEFAULT_TTL) -> 'Dict[str, dict]':
+        """
+        Get the cached entries for every cluster in a region and VPC, keyed by
+        cluster name, or None if we haven't listed every cluster there
+        recently.
+        """
+        with self._ignore_errors():
+            with self._connect() as connection:
+                min_updated_at = time.time() - max_age
+                listing = connection.execute(
+                    """
+                    SELECT 1 FROM listings
+                    WHERE provider = ? AND region = ? AND vpc_id = ? AND updated_at >= ?
+                    """,
+                    (provider, region, vpc_id, min_updated_at)).fetchone()
+                if listing is None:
+                    return None
+                rows = connection.execute(
+                    """
+                    SELECT name, entry, manifest, updated_at FROM clusters
+                    WHERE provider = ? AND region = ? AND vpc_id = ?
+                    """,
+                    (provider, region, vpc_id)).fetchall()
+            # Clusters we've recorded since the listing are fresher than it,
+            # so if any entry has expired, so has the listing.
+            if any(updated_at < min_updated_at for (_, _, _, updated_at) in rows):
+                return None
+            return {
+                name: _load_entry(entry, manifest)
+                for (name, entry, manifest, _) in rows}
+        return None
+
+    def put_clusters(
+            self,
+            *,
+            provider: str,
+            region: str,
+            vpc_id: str,
+            entries: 'Dict[str, dict]',
+            complete: bool=False,
+            manifests: 'Dict[str, list]'={}):
+        """
+        Record the provided entries, keyed by cluster name. If complete is
+        True, these are all the clusters in the region and VPC, and we forget
+        any others.
+
+        We keep the manifest we already have for a cluster unless a new one is
+        provided.
+        """
+        now = time.time()
+        with self._ignore_errors():
+            with self._connect() as connection:
+                old_manifests = dict(connection.execute(
+                    """
+                    SELECT name, manifest FROM clusters
+                    WHERE provider = ? AND region = ? AND vpc_id = ?
+                    """,
+                    (provider, region, vpc_id)).fetchall())
+                if complete:
+                    connection.execute(
+                        "DELETE FROM clusters WHERE provider = ? AND region = ? AND vpc_id = ?",
+                        (provider, region, vpc_id))
+                    connection.execute(
+                        "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)",
+                        (provider, region, vpc_id, now))
+                connection.executemany(
+                    "INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            provider, region, vpc_id, name,
+                            json.dumps(entry, sort_keys=True),
+                            json.dumps(manifests[name]) if name in manifests
+                            else old_manifests.get(name),
+                            now)
+                        for (name, entry) in entries.items()])
+
+    def put_cluster(
+            self,
+            *,
+            provider: str,
+            region: str,
+            vpc_id: str,
+            name: str,
+            entry: dict,
+            manifest: list=None):
+        self.put_clusters(
+            provider=provider,
+            region=region,
+            vpc_id=vpc_id,
+            entries={name: entry},
+            manifests={name: manifest} if manifest is not None else {})
+
+    def delete_cluster(self, *, provider: str, region: str, vpc_id: str, name: str):
+        with self._ignore_errors():
+            with self._connect() as connection:
+                connection.execute(
+                    """
+                    DELETE FROM clusters
+                    WHERE provider = ? AND region = ? AND vpc_id = ? AND name = ?
+                    """,
+                    (provider, region, vpc_id, name))
+
+    def add_pending_security_group(
+            self,
+            *,
+            provider: str,
+            region: str,
+            group_id: str,
+            group_name: str):
+        """
+        Remember a security group to delete once nothing is using it anymore.
+        """
+        with self._ignore_errors():
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO pending_security_groups VALUES (?, ?, ?, ?, ?)",
+                    (provider, region, group_id, group_name, time.time()))
+
+    def get_pending_security_groups(
+            self,
+            *,
+            provider: str,
+            region: str) -> 'Dict[str, str]':
+        """
+        Get the names of the security groups waiting to be deleted in a
+        region, keyed by group ID.
+        """
+        with self._ignore_errors():
+            with self._connect() as connection:
+                return dict(connection.execute(
+                    """
+                    SELECT group_id, group_name FROM pending_security_groups
+                    WHERE provider = ? AND region = ?
+                    """,
+                    (provider, region)).fetchall())
+        return {}
+
+    def remove_pending_security_group(self, *, provider: str, region: str, group_id: str):
+        with self._ignore_errors():
+            with self._connect() as connection:
+                connection.execute(
+                    """
+                    DELETE FROM pending_security_groups
+                    WHERE provider = ? AND region = ? AND group_id = ?
+                    """,
+                    (provider, region, group_id))
+
+
+def _load_entry(entry_raw: str, manifest_raw: str) -> dict:
+    entry = json.loads(entry_raw)
+    entry['manifest'] = json.loads(manifest_raw) if manifest_raw else None
+    return entry
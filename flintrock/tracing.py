@@ -0,0 +1,110 @@
+"""
+Record how long each phase of an operation takes on each host, and export the
+results as a trace that Chrome's trace viewer (chrome://tracing) or Perfetto
+can open.
+
+Each host gets its own row in the trace, and work that isn't tied to a host,
+like waiting on a whole cluster, goes on a row for the client. Tracing is off
+until enable() is called, so spans cost next to nothing otherwise.
+
+See: https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+
+# The row we put spans that aren't tied to a host on.
+CLIENT_ROW = 'flintrock'
+
+_lock = threading.Lock()
+_enabled = False
+_events = []
+_rows = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _get_row(host: str) -> int:
+    """
+    Get the thread ID we use in the trace for the provided host, naming the
+    row after the host the first time we see it. Must be called with _lock
+    held.
+    """
+    host = host or CLIENT_ROW
+    if host not in _rows:
+        _rows[host] = len(_rows)
+        _events.append({
+            'name': 'thread_name',
+            'ph': 'M',
+            'pid': os.getpid(),
+            'tid': _rows[host],
+            'args': {'name': host},
+        })
+    return _rows[host]
+
+
+def add_span(name: str, *, start: float, duration: float, host: str=None, **args):
+    """
+    Record a span that has already finished. start is a time.time() timestamp,
+    and duration is in seconds.
+    """
+    if not _enabled:
+        return
+
+    with _lock:
+        _events.append({
+            'name': name,
+            'cat': 'host' if host else 'client',
+            'ph': 'X',
+            'pid': os.getpid(),
+            'tid': _get_row(host),
+            # The trace event format counts in microseconds.
+            'ts': int(start * 1000000),
+            'dur': int(duration * 1000000),
+            'args': args,
+        })
+
+
+@contextlib.contextmanager
+def span(name: str, *, host: str=None, **args):
+    """
+    Record how long the body of this context manager takes. Spans that end
+    with an exception are marked as failed.
+    """
+    if not _enabled:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    except BaseException as e:
+        args['error'] = type(e).__name__
+        raise
+    finally:
+        add_span(name, start=start, duration=time.time() - start, host=host, **args)
+
+
+def write_trace(path: str, *, metadata: dict=None):
+    """
+    Write every span recorded so far to the provided path in the trace event
+    format, along with any metadata about the run.
+    """
+    with _lock:
+        trace = {
+            'traceEvents': list(_events),
+            'displayTimeUnit': 'ms',
+        }
+    if metadata:
+        trace['metadata'] = metadata
+    with open(path, 'w') as f:
+        json.dump(trace, f)
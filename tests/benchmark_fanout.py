@@ -0,0 +1,166 @@
+"""
+Benchmark Flintrock's orchestration overhead on simulated clusters of growing
+size, and report the wall time, peak thread count, and peak memory use of each
+operation.
+
+Nothing is launched. See simulator.py for how the simulated hosts behave.
+
+    python tests/benchmark_fanout.py --sizes 10,100,1000 --latency 0.05
+
+Each run happens in its own process so that peak memory use isn't carried over
+from one run to the next.
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+OPERATIONS = ['provision', 'start', 'run-command', 'copy-file']
+
+
+class ThreadMonitor:
+    """
+    Sample the number of live threads in the background, and keep the highest
+    count seen.
+    """
+    def __init__(self, interval: float=0.01):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+
+
+def get_peak_rss() -> int:
+    """
+    Get the peak resident memory of this process, in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and macOS reports bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_operation(*, operation: str, size: int, config: dict, max_parallel: int) -> dict:
+    # Flintrock modules
+    from flintrock.core import provision_cluster
+    from simulator import SimulatedCluster, SimulatedNetwork, SimulatedService, SimulationConfig
+
+    network = SimulatedNetwork(SimulationConfig(**config))
+    cluster = SimulatedCluster(name='benchmark', num_slaves=size - 1, network=network)
+    services = [SimulatedService()]
+    common = {'user': 'ec2-user', 'identity_file': '/dev/null', 'max_parallel': max_parallel}
+
+    if operation != 'provision':
+        # Every operation besides provisioning needs a provisioned cluster. We
+        # don't count the time it takes.
+        provision_cluster(cluster=cluster, services=services, **common)
+
+    with tempfile.NamedTemporaryFile() as local_file, \
+            open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull), \
+            ThreadMonitor() as threads:
+        local_file.write(b'x' * 1024)
+        local_file.flush()
+
+        start = time.time()
+        if operation == 'provision':
+            provision_cluster(cluster=cluster, services=services, **common)
+        elif operation == 'start':
+            cluster.start(**common)
+        elif operation == 'run-command':
+            cluster.run_command(master_only=False, command=('true',), **common)
+        elif operation == 'copy-file':
+            cluster.copy_file(
+                master_only=False,
+                local_path=local_file.name,
+                remote_path='/home/ec2-user/file',
+                **common)
+        wall_time = time.time() - start
+
+    return {
+        'operation': operation,
+        'size': size,
+        'wall_time': wall_time,
+        'peak_threads': threads.peak,
+        'peak_rss': get_peak_rss(),
+        'connections': network.connections,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,1000', help="Comma-separated cluster sizes.")
+    parser.add_argument('--operations', default=','.join(OPERATIONS))
+    parser.add_argument('--latency', type=float, default=0.01, help="Seconds per round trip.")
+    parser.add_argument('--boot-time', type=float, nargs=2, default=[0, 0], metavar=('MIN', 'MAX'))
+    parser.add_argument('--connect-failure-rate', type=float, default=0)
+    parser.add_argument('--step-time', type=float, default=0)
+    parser.add_argument('--max-parallel', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON lines.")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_operation(**json.loads(args.worker))))
+        return
+
+    # Flintrock modules
+    from flintrock.defaults import DEFAULT_MAX_PARALLEL
+
+    config = {
+        'latency': args.latency,
+        'boot_time': args.boot_time,
+        'connect_failure_rate': args.connect_failure_rate,
+        'step_time': args.step_time,
+        'seed': 0,
+    }
+
+    if not args.json:
+        print('{o:<12} {s:>6} {w:>10} {t:>8} {r:>10} {c:>12}'.format(
+            o='operation', s='nodes', w='wall (s)', t='threads', r='rss (MiB)', c='connections'))
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        for operation in args.operations.split(','):
+            worker = json.dumps({
+                'operation': operation,
+                'size': size,
+                'config': config,
+                'max_parallel': args.max_parallel or DEFAULT_MAX_PARALLEL,
+            })
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--worker', worker],
+                universal_newlines=True)
+            result = json.loads(output.splitlines()[-1])
+
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print('{o:<12} {s:>6} {w:>10.2f} {t:>8} {r:>10.1f} {c:>12}'.format(
+                    o=operation,
+                    s=size,
+                    w=result['wall_time'],
+                    t=result['peak_threads'],
+                    r=result['peak_rss'] / 1024 / 1024,
+                    c=result['connections']))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
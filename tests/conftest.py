@@ -169,3 +169,29 @@ def local_file(request):
     request.addfinalizer(destroy)
 
     return file.name
+
+
+@pytest.fixture
+def local_ssh_servers(request, tmpdir):
+    """
+    Return a function that starts SSH servers on localhost, one per node, for
+    the test to run Flintrock against.
+    """
+    from ssh_server import LocalSSHServers
+
+    started = []
+
+    def start(num_servers, **kwargs):
+        servers = LocalSSHServers(
+            num_servers=num_servers,
+            directory=str(tmpdir.mkdir('servers-{n}'.format(n=len(started)))),
+            **kwargs)
+        started.append(servers)
+        return servers
+
+    def stop():
+        for servers in started:
+            servers.close()
+    request.addfinalizer(stop)
+
+    return start
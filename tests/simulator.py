@@ -0,0 +1,375 @@
+"""
+Simulate clusters of thousands of nodes on one machine, so we can measure how
+Flintrock's own orchestration overhead scales without launching anything.
+
+A SimulatedCluster is a FlintrockCluster whose SSH client pool connects to
+simulated hosts instead of real ones. Simulated hosts take a while to boot,
+answer each round trip after a configurable latency, fail a configurable share
+of connection attempts and commands, and keep just enough state -- the files
+Flintrock writes and reads back -- for provisioning, start, run-command, and
+copy-file to work against them.
+
+Commands aren't run. Hosts recognize the few whose output Flintrock parses, and
+everything else succeeds with no output.
+"""
+import collections
+import io
+import json
+import random
+import re
+import shlex
+import threading
+import time
+
+# Flintrock modules
+from flintrock.core import BAKED_SERVICES_FILE, FlintrockCluster, register_service
+from flintrock.exceptions import SSHError
+from flintrock.services import FlintrockService
+from flintrock.ssh import SSHClientPool, RemoteStep, ssh_check_output, ssh_check_steps
+
+KeyPair = collections.namedtuple('KeyPair', ['public', 'private'])
+
+
+class SimulationConfig:
+    """
+    How simulated hosts behave. Times are in seconds.
+
+    boot_time is a (min, max) range each host's boot time is picked from.
+    connect_failure_rate is the chance that an attempt to connect to a host
+    we're waiting on fails and has to be retried, like when sshd isn't quite up
+    yet. command_failure_rate is
+    the chance that a command fails outright.
+    """
+    def __init__(
+            self,
+            *,
+            latency: float=0.01,
+            boot_time: tuple=(0, 0),
+            connect_failure_rate: float=0,
+            command_failure_rate: float=0,
+            step_time: float=0,
+            upload_bandwidth: float=100 * 1024 * 1024,
+            seed: int=None):
+        self.latency = latency
+        self.boot_time = boot_time
+        self.connect_failure_rate = connect_failure_rate
+        self.command_failure_rate = command_failure_rate
+        self.step_time = step_time
+        self.upload_bandwidth = upload_bandwidth
+        self.random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def chance(self, rate: float) -> bool:
+        with self._random_lock:
+            return self.random.random() < rate
+
+    def pick_boot_time(self) -> float:
+        with self._random_lock:
+            return self.random.uniform(*self.boot_time)
+
+
+class SimulatedHost:
+    def __init__(self, *, address: str, config: SimulationConfig, launched_at: float):
+        self.address = address
+        self.config = config
+        self.booted_at = launched_at + config.pick_boot_time()
+        self.files = {}
+        self.commands_run = 0
+        self._lock = threading.Lock()
+
+    def is_booted(self) -> bool:
+        return time.time() >= self.booted_at
+
+    def run(self, command: str, input: str=None) -> (int, str):
+        """
+        Pretend to run a command, and return its exit status and output.
+        """
+        with self._lock:
+            self.commands_run += 1
+        if self.config.step_time:
+            time.sleep(self.config.step_time)
+        if self.config.chance(self.config.command_failure_rate):
+            return (1, 'Simulated failure.')
+
+        command = command.strip()
+        if command == 'python -' and input:
+            # This is setup-ephemeral-storage.py.
+            return (0, json.dumps({'root': '/media/root', 'ephemeral': []}))
+        if command == 'echo "$JAVA_HOME"':
+            return (0, '/usr/lib/jvm/jre')
+        if BAKED_SERVICES_FILE in command:
+            return (0, self.files.get(BAKED_SERVICES_FILE, '{"services": []}'))
+
+        # Flintrock writes files with `echo content > path` and reads them back
+        # with `cat path`.
+        match = re.match(r'echo (.*) > (\S+)$', command, re.DOTALL)
+        if match:
+            self.files[match.group(2)] = shlex.split(match.group(1))[0]
+            return (0, '')
+        match = re.match(r'cat (\S+)$', command)
+        if match:
+            if match.group(1) not in self.files:
+                return (1, 'cat: {p}: No such file or directory'.format(p=match.group(1)))
+            return (0, self.files[match.group(1)])
+
+        return (0, '')
+
+
+class SimulatedChannel:
+    def __init__(self, exit_status: int=None):
+        self.closed = False
+        self.exit_status = exit_status
+
+    def exit_status_ready(self) -> bool:
+        return self.exit_status is not None
+
+    def recv_exit_status(self) -> int:
+        return self.exit_status
+
+
+class SimulatedOutput:
+    """
+    The stdout or stderr of a simulated command.
+    """
+    def __init__(self, channel: SimulatedChannel, data: str=''):
+        self.channel = channel
+        self._lines = collections.deque(io.StringIO(data).readlines())
+        self._condition = threading.Condition()
+
+    def push(self, data: str):
+        with self._condition:
+            self._lines.extend(io.StringIO(data).readlines())
+            self._condition.notify_all()
+
+    def readline(self) -> str:
+        with self._condition:
+            while not self._lines and not self.channel.closed:
+                self._condition.wait()
+            return self._lines.popleft() if self._lines else ''
+
+    def read(self) -> bytes:
+        with self._condition:
+            data = ''.join(self._lines)
+            self._lines.clear()
+        return data.encode('utf8')
+
+    def close(self):
+        with self._condition:
+            self.channel.closed = True
+            self._condition.notify_all()
+
+
+class SimulatedAgentInput:
+    """
+    The stdin of a simulated remote agent. It runs each batch of steps as soon
+    as it's written, like the real agent would, and writes back a report for
+    each one.
+    """
+    def __init__(self, *, host: SimulatedHost, stdout: SimulatedOutput):
+        self.host = host
+        self.stdout = stdout
+
+    def write(self, data: str):
+        time.sleep(self.host.config.latency)
+        for step in json.loads(data):
+            start = time.time()
+            (exit_status, output) = self.host.run(step['command'], step.get('input'))
+            self.stdout.push(json.dumps({
+                'exit_status': exit_status,
+                'stdout': output,
+                'stderr': '',
+                'duration': time.time() - start,
+            }) + '\n')
+            if exit_status:
+                break
+
+    def flush(self):
+        pass
+
+
+class SimulatedSFTPClient:
+    def __init__(self, host: SimulatedHost):
+        self.host = host
+
+    def put(self, *, localpath: str, remotepath: str):
+        with open(localpath, 'rb') as f:
+            size = len(f.read())
+        time.sleep(self.host.config.latency + size / self.host.config.upload_bandwidth)
+        self.host.files[remotepath] = '<{n} bytes>'.format(n=size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class SimulatedTransport:
+    def __init__(self, host: SimulatedHost):
+        self.host = host
+        self.active = True
+        self.keepalive = None
+
+    def getpeername(self) -> tuple:
+        return (self.host.address, 22)
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def set_keepalive(self, interval: int):
+        self.keepalive = interval
+
+
+class SimulatedSSHClient:
+    def __init__(self, host: SimulatedHost):
+        self.host = host
+        self.transport = SimulatedTransport(host)
+        self._outputs = []
+
+    def get_transport(self) -> SimulatedTransport:
+        return self.transport
+
+    def exec_command(self, command: str, get_pty: bool=False):
+        time.sleep(self.host.config.latency)
+
+        if command.startswith('python -u -c '):
+            # Flintrock is starting its remote agent.
+            stdout = SimulatedOutput(SimulatedChannel(), '{"ready": true}\n')
+            self._outputs.append(stdout)
+            return (SimulatedAgentInput(host=self.host, stdout=stdout), stdout, None)
+
+        (exit_status, output) = self.host.run(command)
+        channel = SimulatedChannel(exit_status)
+        stdout = SimulatedOutput(channel, output + '\n' if exit_status == 0 else '')
+        stderr = SimulatedOutput(channel, '' if exit_status == 0 else output)
+        return (None, stdout, stderr)
+
+    def open_sftp(self) -> SimulatedSFTPClient:
+        time.sleep(self.host.config.latency)
+        return SimulatedSFTPClient(self.host)
+
+    def close(self):
+        self.transport.active = False
+        for output in self._outputs:
+            output.close()
+
+
+class SimulatedNetwork:
+    """
+    A set of simulated hosts, and a function to connect to them that stands in
+    for flintrock.ssh.get_ssh_client().
+    """
+    def __init__(self, config: SimulationConfig):
+        self.config = config
+        self.hosts = {}
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def launch(self, num_hosts: int) -> 'List[str]':
+        """
+        Launch simulated hosts, and return their addresses.
+        """
+        launched_at = time.time()
+        with self._lock:
+            start = len(self.hosts)
+            addresses = [
+                '10.{a}.{b}.{c}'.format(a=(i >> 16) & 255, b=(i >> 8) & 255, c=i & 255)
+                for i in range(start + 1, start + num_hosts + 1)]
+            for address in addresses:
+                self.hosts[address] = SimulatedHost(
+                    address=address,
+                    config=self.config,
+                    launched_at=launched_at)
+        return addresses
+
+    def connect(
+            self,
+            *,
+            user: str,
+            host: str,
+            identity_file: str,
+            wait: bool=False,
+            is_booted: 'Callable[[], bool]'=None,
+            **kwargs) -> SimulatedSSHClient:
+        simulated_host = self.hosts[host]
+        while True:
+            if simulated_host.is_booted():
+                # A TCP handshake, a key exchange, and authentication.
+                time.sleep(self.config.latency * 3)
+                if not wait or not self.config.chance(self.config.connect_failure_rate):
+                    break
+            elif not wait:
+                raise SSHError(host=host, message="Could not connect via SSH: Host is down.")
+            time.sleep(min(0.1, max(0, simulated_host.booted_at - time.time())) or 0.01)
+
+        with self._lock:
+            self.connections += 1
+        return SimulatedSSHClient(simulated_host)
+
+
+class SimulatedCluster(FlintrockCluster):
+    def __init__(self, *, name: str, num_slaves: int, network: SimulatedNetwork):
+        super().__init__(
+            name=name,
+            ssh_key_pair=KeyPair(public='ssh-rsa simulated', private='simulated'))
+        self.network = network
+        self.ssh_client_pool = SSHClientPool(connect=network.connect)
+        [self._master_ip, *self._slave_ips] = network.launch(num_slaves + 1)
+
+    @property
+    def master_ip(self) -> str:
+        return self._master_ip
+
+    @property
+    def master_host(self) -> str:
+        return self._master_ip
+
+    @property
+    def slave_ips(self) -> 'List[str]':
+        return self._slave_ips
+
+    @property
+    def slave_hosts(self) -> 'List[str]':
+        return self._slave_ips
+
+    @property
+    def subnet_is_private(self) -> bool:
+        return False
+
+    def host_is_booted(self, host: str) -> bool:
+        return self.network.hosts[host].is_booted()
+
+
+@register_service
+class SimulatedService(FlintrockService):
+    """
+    A service that installs and configures itself with a few no-op steps, and
+    is ready as soon as it's started.
+    """
+    def __init__(self, *, steps: int=2):
+        self.steps = steps
+        self.manifest = {'steps': steps}
+
+    def get_install_steps(self) -> 'List[RemoteStep]':
+        return [
+            RemoteStep(name='simulated-install-{i}'.format(i=i), command=':')
+            for i in range(self.steps)]
+
+    def install(self, ssh_client, cluster):
+        ssh_check_steps(client=ssh_client, steps=self.get_install_steps())
+
+    def configure(self, ssh_client, cluster):
+        ssh_check_steps(
+            client=ssh_client,
+            steps=[
+                RemoteStep(name='simulated-configure-{i}'.format(i=i), command=':')
+                for i in range(self.steps)])
+
+    def configure_master(self, ssh_client, cluster):
+        ssh_check_output(client=ssh_client, command=':')
+
+    def is_ready(self, master_host: str, num_slaves: int) -> bool:
+        return True
+
+    def health_check(self, master_host: str):
+        pass
@@ -0,0 +1,363 @@
+"""
+Run real SSH servers on localhost, so we can exercise and benchmark Flintrock's
+actual Paramiko code paths -- connecting, running commands and batches of
+steps, and copying files over SFTP -- without launching anything.
+
+Each server runs in-process on its own port and works out of its own sandbox
+directory, which stands in for the remote user's home directory. Paths under
+/home/<user> in commands and SFTP requests are mapped into the sandbox, and
+SFTP requests for paths elsewhere are refused.
+
+Commands really run, with bash in the sandbox, but with a few shims ahead of
+the real commands on the PATH: sudo doesn't escalate and keeps /media inside
+the sandbox, lsblk reports just a root device, and python is the Python
+running the tests. That's enough for Flintrock to provision a node with
+services that don't need root, like the ones in simulator.py.
+"""
+import os
+import shlex
+import socket
+import stat
+import subprocess
+import sys
+import threading
+
+# External modules
+import paramiko
+
+# Flintrock modules
+from flintrock.core import FlintrockCluster
+from flintrock.ssh import SSHClientPool, get_ssh_client
+
+from simulator import KeyPair
+
+SHIMS = {
+    'python': 'exec {python} "$@"\n'.format(python=shlex.quote(sys.executable)),
+    'sudo': (
+        'args=()\n'
+        'for arg in "$@"; do args+=("${arg/#\\/media\\//$HOME/media/}"); done\n'
+        'exec "${args[@]}"\n'),
+    'lsblk': 'echo "/dev/sandbox /"\n',
+}
+
+_host_key = None
+_host_key_lock = threading.Lock()
+
+
+def get_host_key() -> paramiko.RSAKey:
+    """
+    Get a host key for the servers. Generating one is slow, so every server
+    shares the same one.
+    """
+    global _host_key
+    with _host_key_lock:
+        if _host_key is None:
+            _host_key = paramiko.RSAKey.generate(2048)
+        return _host_key
+
+
+def generate_identity_file(path: str) -> paramiko.RSAKey:
+    """
+    Generate a key pair to log in to the servers with, and write the private
+    key to the provided path.
+    """
+    key = paramiko.RSAKey.generate(2048)
+    key.write_private_key_file(path)
+    return key
+
+
+class SandboxServer(paramiko.ServerInterface):
+    def __init__(self, local_server: 'LocalSSHServer'):
+        self.local_server = local_server
+
+    def get_allowed_auths(self, username: str) -> str:
+        return 'publickey'
+
+    def check_auth_publickey(self, username: str, key: paramiko.PKey) -> int:
+        if username == self.local_server.user and (
+                self.local_server.authorized_key is None or
+                key == self.local_server.authorized_key):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, *args) -> bool:
+        return True
+
+    def check_channel_exec_request(self, channel: paramiko.Channel, command: bytes) -> bool:
+        threading.Thread(
+            target=self.local_server.run_command,
+            args=(channel, command.decode('utf8')),
+            daemon=True).start()
+        return True
+
+
+class SandboxSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class SandboxSFTPServer(paramiko.SFTPServerInterface):
+    def __init__(self, server: SandboxServer, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.local_server = server.local_server
+
+    def _to_local(self, path: str) -> str:
+        local_path = self.local_server.to_local_path(path)
+        if local_path is None:
+            raise PermissionError(path)
+        return local_path
+
+    def _call(self, func, *args):
+        try:
+            return func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno or 1)
+
+    def canonicalize(self, path: str) -> str:
+        return path if path.startswith('/') else self.local_server.remote_home + '/' + path
+
+    def open(self, path: str, flags: int, attr):
+        def _open():
+            fd = os.open(self._to_local(path), flags, 0o644)
+            mode = 'r+b' if flags & os.O_RDWR else 'wb' if flags & os.O_WRONLY else 'rb'
+            handle = SandboxSFTPHandle(flags)
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+        return self._call(_open)
+
+    def stat(self, path: str):
+        return self._call(
+            lambda: paramiko.SFTPAttributes.from_stat(os.stat(self._to_local(path))))
+
+    def lstat(self, path: str):
+        return self._call(
+            lambda: paramiko.SFTPAttributes.from_stat(os.lstat(self._to_local(path))))
+
+    def chattr(self, path: str, attr):
+        def _chattr():
+            if attr.st_mode is not None:
+                os.chmod(self._to_local(path), stat.S_IMODE(attr.st_mode))
+            return paramiko.SFTP_OK
+        return self._call(_chattr)
+
+    def list_folder(self, path: str):
+        def _list_folder():
+            local_path = self._to_local(path)
+            attrs = []
+            for name in os.listdir(local_path):
+                attr = paramiko.SFTPAttributes.from_stat(
+                    os.lstat(os.path.join(local_path, name)))
+                attr.filename = name
+                attrs.append(attr)
+            return attrs
+        return self._call(_list_folder)
+
+    def remove(self, path: str):
+        return self._call(lambda: os.remove(self._to_local(path)) or paramiko.SFTP_OK)
+
+    def mkdir(self, path: str, attr):
+        return self._call(lambda: os.mkdir(self._to_local(path)) or paramiko.SFTP_OK)
+
+
+class LocalSSHServer:
+    """
+    An SSH and SFTP server on localhost that only lets the provided user in,
+    and only with the provided key if there is one.
+    """
+    def __init__(
+            self,
+            *,
+            sandbox: str,
+            user: str='ec2-user',
+            authorized_key: paramiko.PKey=None,
+            env: dict=None,
+            shims: dict=SHIMS):
+        self.sandbox = os.path.realpath(sandbox)
+        self.user = user
+        self.remote_home = '/home/{u}'.format(u=user)
+        self.authorized_key = authorized_key
+        self.commands_run = 0
+        self._transports = []
+        self._lock = threading.Lock()
+
+        bin_dir = os.path.join(self.sandbox, '.sandbox', 'bin')
+        os.makedirs(bin_dir, exist_ok=True)
+        os.makedirs(os.path.join(self.sandbox, '.ssh'), exist_ok=True)
+        for (name, script) in shims.items():
+            path = os.path.join(bin_dir, name)
+            with open(path, 'w') as f:
+                f.write('#!/bin/bash\n' + script)
+            os.chmod(path, 0o755)
+
+        self.env = {
+            'HOME': self.sandbox,
+            'USER': user,
+            'PATH': bin_dir + os.pathsep + os.environ.get('PATH', os.defpath),
+            # Flintrock installs Java on nodes that don't have it.
+            'JAVA_HOME': '/usr/lib/jvm/jre',
+        }
+        self.env.update(env or {})
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(128)
+        (self.host, self.port) = self._socket.getsockname()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self) -> str:
+        return '{h}:{p}'.format(h=self.host, p=self.port)
+
+    def to_local_path(self, path: str) -> str:
+        """
+        Map a remote path to its place in the sandbox, or return None if it's
+        outside the sandbox.
+        """
+        if not path.startswith('/'):
+            path = self.remote_home + '/' + path
+        path = os.path.normpath(path)
+        if path != self.remote_home and not path.startswith(self.remote_home + '/'):
+            return None
+        return self.sandbox + path[len(self.remote_home):]
+
+    def _serve(self):
+        while True:
+            try:
+                (client_socket, _) = self._socket.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client_socket)
+            transport.add_server_key(get_host_key())
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, SandboxSFTPServer)
+            with self._lock:
+                self._transports.append(transport)
+            try:
+                transport.start_server(server=SandboxServer(self))
+            except (paramiko.SSHException, EOFError):
+                transport.close()
+
+    def run_command(self, channel: paramiko.Channel, command: str):
+        with self._lock:
+            self.commands_run += 1
+        command = command.replace(self.remote_home, self.sandbox)
+        process = subprocess.Popen(
+            ['bash', '-c', command],
+            cwd=self.sandbox,
+            env=self.env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+
+        def forward_input():
+            try:
+                for data in iter(lambda: channel.recv(32768), b''):
+                    process.stdin.write(data)
+                    process.stdin.flush()
+            except (OSError, EOFError):
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+
+        def forward_output(stream, send):
+            for data in iter(lambda: stream.read1(32768), b''):
+                try:
+                    send(data)
+                except (OSError, EOFError):
+                    pass
+
+        threads = [
+            threading.Thread(target=forward_input, daemon=True),
+            threading.Thread(target=forward_output, args=(process.stdout, channel.sendall)),
+            threading.Thread(
+                target=forward_output, args=(process.stderr, channel.sendall_stderr)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads[1:]:
+            thread.join()
+        channel.send_exit_status(process.wait())
+        channel.close()
+
+    def close(self):
+        self._socket.close()
+        with self._lock:
+            transports = list(self._transports)
+        for transport in transports:
+            transport.close()
+
+
+class LocalSSHServers:
+    """
+    A group of local SSH servers, one per simulated node, and a function to
+    connect to them that stands in for flintrock.ssh.get_ssh_client().
+
+    Nodes are addressed as host:port.
+    """
+    def __init__(self, *, num_servers: int, directory: str, **kwargs):
+        self.identity_file = os.path.join(directory, 'identity')
+        key = generate_identity_file(self.identity_file)
+        self.servers = {}
+        try:
+            for i in range(num_servers):
+                sandbox = os.path.join(directory, 'node-{i}'.format(i=i))
+                os.makedirs(sandbox)
+                server = LocalSSHServer(sandbox=sandbox, authorized_key=key, **kwargs)
+                self.servers[server.address] = server
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def addresses(self) -> 'List[str]':
+        return list(self.servers)
+
+    def connect(self, *, host: str, **kwargs) -> paramiko.client.SSHClient:
+        server = self.servers[host]
+        return get_ssh_client(host=server.host, port=server.port, **kwargs)
+
+    def close(self):
+        for server in self.servers.values():
+            server.close()
+
+
+class LocalCluster(FlintrockCluster):
+    def __init__(self, *, name: str, servers: LocalSSHServers):
+        super().__init__(
+            name=name,
+            ssh_key_pair=KeyPair(public='ssh-rsa local', private='local'))
+        self.servers = servers
+        self.ssh_client_pool = SSHClientPool(connect=servers.connect)
+        [self._master_ip, *self._slave_ips] = servers.addresses
+
+    @property
+    def master_ip(self) -> str:
+        return self._master_ip
+
+    @property
+    def master_host(self) -> str:
+        return self._master_ip
+
+    @property
+    def slave_ips(self) -> 'List[str]':
+        return self._slave_ips
+
+    @property
+    def slave_hosts(self) -> 'List[str]':
+        return self._slave_ips
+
+    @property
+    def subnet_is_private(self) -> bool:
+        return False
+
+    def host_is_booted(self, host: str) -> bool:
+        return True
@@ -0,0 +1,111 @@
+import http.server
+import threading
+from types import SimpleNamespace
+
+# External modules
+import boto3
+import botocore.hooks
+import pytest
+
+# Flintrock modules
+from flintrock.api_stats import ApiStats
+
+
+class ThrottlingEC2Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers every EC2 call with an empty list of regions, but throttles the
+    first request it gets.
+    """
+    requests_received = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        type(self).requests_received += 1
+
+        if self.requests_received == 1:
+            self.send_response(503)
+            body = (
+                b'<Response><Errors><Error><Code>RequestLimitExceeded</Code>'
+                b'<Message>Request limit exceeded.</Message></Error></Errors>'
+                b'<RequestID>1</RequestID></Response>')
+        else:
+            self.send_response(200)
+            body = (
+                b'<DescribeRegionsResponse xmlns="http://ec2.amazonaws.com/doc/2016-11-15/">'
+                b'<requestId>2</requestId><regionInfo/></DescribeRegionsResponse>')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ec2_endpoint():
+    server = http.server.HTTPServer(('127.0.0.1', 0), ThrottlingEC2Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{p}'.format(p=server.server_address[1])
+    server.shutdown()
+
+
+def test_api_stats(ec2_endpoint):
+    stats = ApiStats()
+    session = boto3.session.Session(
+        region_name='us-east-1',
+        aws_access_key_id='key',
+        aws_secret_access_key='secret')
+    stats.register(session.events)
+    client = session.client('ec2', endpoint_url=ec2_endpoint)
+
+    client.describe_regions()
+    client.describe_regions()
+
+    describe_regions = stats.get_stats()['ec2.DescribeRegions']
+    assert describe_regions['calls'] == 2
+    assert describe_regions['retries'] == 1
+    assert describe_regions['throttles'] == 1
+    assert describe_regions['errors'] == 0
+    assert sum(describe_regions['latency_histogram'].values()) == 2
+    assert describe_regions['latency_max'] >= describe_regions['latency_p50']
+
+    summary = stats.format_summary().splitlines()
+    assert summary[1].split()[:5] == ['ec2.DescribeRegions', '2', '1', '1', '0']
+    assert summary[-1].split() == ['total', '2', '1', '1', '0']
+
+
+def test_api_stats_with_botocore_1_4_events():
+    """
+    botocore 1.4, which we pin, doesn't pass request_dict to needs-retry
+    handlers.
+    """
+    stats = ApiStats()
+    events = botocore.hooks.HierarchicalEmitter()
+    stats.register(events)
+
+    model = SimpleNamespace(
+        name='DescribeRegions',
+        service_model=SimpleNamespace(endpoint_prefix='ec2'))
+    context = {}
+    throttled = (
+        SimpleNamespace(status_code=503),
+        {'Error': {'Code': 'RequestLimitExceeded', 'Message': ''}})
+    succeeded = (SimpleNamespace(status_code=200), {'Regions': []})
+
+    events.emit(
+        'before-call.ec2.DescribeRegions',
+        model=model, params={}, request_signer=None, context=context)
+    for (attempts, response) in enumerate([throttled, succeeded], 1):
+        events.emit(
+            'needs-retry.ec2.DescribeRegions',
+            response=response, endpoint=None, operation=model,
+            attempts=attempts, caught_exception=None)
+    events.emit(
+        'after-call.ec2.DescribeRegions',
+        http_response=succeeded[0], parsed=succeeded[1], model=model, context=context)
+
+    describe_regions = stats.get_stats()['ec2.DescribeRegions']
+    assert describe_regions['calls'] == 1
+    assert describe_regions['retries'] == 1
+    assert describe_regions['throttles'] == 1
+    assert describe_regions['errors'] == 0
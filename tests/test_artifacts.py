@@ -0,0 +1,118 @@
+import hashlib
+import http.server
+import json
+import threading
+
+# External modules
+import pytest
+
+# Flintrock modules
+from flintrock.artifacts import (
+    Artifact,
+    ArtifactStoreError,
+    HTTPArtifactStore,
+    LocalArtifactStore,
+    get_artifact_store,
+    get_spark_artifact)
+
+
+class QuietRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream(tmpdir, monkeypatch):
+    """
+    Serve a package and its published digest, like an Apache mirror would.
+    """
+    served_dir = tmpdir.mkdir('upstream')
+    served_dir.join('spark-1.6.1-bin-hadoop2.6.tgz').write_binary(b'spark')
+    served_dir.join('spark-1.6.1-bin-hadoop2.6.tgz.sha512').write(
+        '{c}  spark-1.6.1-bin-hadoop2.6.tgz\n'.format(c=hashlib.sha512(b'spark').hexdigest()))
+
+    monkeypatch.chdir(served_dir)
+    server = http.server.HTTPServer(('127.0.0.1', 0), QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{p}/'.format(p=server.server_address[1])
+    server.shutdown()
+
+
+def test_fetch(upstream, tmpdir):
+    artifact = Artifact(
+        name='spark-1.6.1-bin-hadoop2.6.tgz',
+        urls=[
+            upstream + 'missing.tgz',
+            upstream + 'spark-1.6.1-bin-hadoop2.6.tgz',
+        ],
+        digest_urls=[
+            upstream + 'spark-1.6.1-bin-hadoop2.6.tgz.sha512',
+        ])
+    store = LocalArtifactStore(str(tmpdir.join('store')))
+
+    assert not store.contains(artifact)
+    store.fetch(artifact)
+    assert store.contains(artifact)
+
+    checksum = hashlib.sha512(b'spark').hexdigest()
+    index = json.loads(tmpdir.join('store', 'artifacts.json').read())
+    assert index == {
+        'spark-1.6.1-bin-hadoop2.6.tgz': {
+            'sha512': checksum,
+            'size': 5,
+            'source': upstream + 'spark-1.6.1-bin-hadoop2.6.tgz',
+            'verified': True,
+        }
+    }
+    assert tmpdir.join('store', 'spark-1.6.1-bin-hadoop2.6.tgz.sha512').read().split() == [
+        checksum,
+        'spark-1.6.1-bin-hadoop2.6.tgz']
+
+    # A damaged artifact doesn't count.
+    tmpdir.join('store', 'spark-1.6.1-bin-hadoop2.6.tgz').write_binary(b'spork')
+    assert not store.contains(artifact)
+
+
+def test_fetch_checksum_mismatch(upstream, tmpdir):
+    tmpdir.join('upstream', 'spark-1.6.1-bin-hadoop2.6.tgz').write_binary(b'tampered')
+    artifact = Artifact(
+        name='spark-1.6.1-bin-hadoop2.6.tgz',
+        urls=[upstream + 'spark-1.6.1-bin-hadoop2.6.tgz'],
+        digest_urls=[upstream + 'spark-1.6.1-bin-hadoop2.6.tgz.sha512'])
+    store = LocalArtifactStore(str(tmpdir.join('store')))
+
+    with pytest.raises(ArtifactStoreError):
+        store.fetch(artifact)
+    assert tmpdir.join('store').listdir() == []
+
+
+def test_fetch_skips_bad_digests(upstream, tmpdir, capsys):
+    tmpdir.join('upstream', 'spark-1.6.1-bin-hadoop2.6.tgz.mds').write('<html>Not Found</html>')
+    artifact = Artifact(
+        name='spark-1.6.1-bin-hadoop2.6.tgz',
+        urls=[upstream + 'spark-1.6.1-bin-hadoop2.6.tgz'],
+        digest_urls=[
+            upstream + 'spark-1.6.1-bin-hadoop2.6.tgz.mds',
+            upstream + 'spark-1.6.1-bin-hadoop2.6.tgz.sha512',
+        ])
+
+    store = LocalArtifactStore(str(tmpdir.join('store')))
+    assert store.fetch(artifact)['verified']
+
+    store = LocalArtifactStore(str(tmpdir.join('unverified-store')))
+    assert not store.fetch(artifact._replace(digest_urls=artifact.digest_urls[:1]))['verified']
+    assert 'Could not get a SHA-512 checksum' in capsys.readouterr().err
+
+
+def test_get_artifact_store():
+    store = get_artifact_store('https://example.com/artifacts/')
+    assert isinstance(store, HTTPArtifactStore)
+
+    artifact = store.get_artifact(get_spark_artifact(version='1.6.1', distribution='hadoop2.6'))
+    assert artifact == Artifact(
+        name='spark-1.6.1-bin-hadoop2.6.tgz',
+        urls=['https://example.com/artifacts/spark-1.6.1-bin-hadoop2.6.tgz'],
+        digest_urls=['https://example.com/artifacts/spark-1.6.1-bin-hadoop2.6.tgz.sha512'])
+
+    with pytest.raises(ArtifactStoreError):
+        get_artifact_store('/some/local/directory')
@@ -0,0 +1,163 @@
+import functools
+import json
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+# External modules
+import pytest
+
+# Flintrock modules
+import flintrock.ec2
+from flintrock.core import StorageDirs, _run_asynchronously, get_service_manifest
+from flintrock.ec2 import EC2Cluster, _get_cluster_master_slaves, get_clusters
+from flintrock.services import HDFS, Spark, THIS_DIR, get_formatted_template
+
+pytest.importorskip('pytest_benchmark')
+
+FLINTROCK_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+CLUSTER_SIZES = [10, 100, 1000]
+
+
+def make_instance(n: int, *, cluster_name: str='test', role: str='slave'):
+    return SimpleNamespace(
+        id='i-{n}'.format(n=n),
+        subnet_id='subnet-1',
+        public_ip_address='54.0.{a}.{b}'.format(a=n // 256, b=n % 256),
+        public_dns_name='ec2-{n}.example.com'.format(n=n),
+        private_ip_address='10.0.{a}.{b}'.format(a=n // 256, b=n % 256),
+        private_dns_name='ip-{n}.internal'.format(n=n),
+        security_groups=[
+            {'GroupName': 'flintrock'},
+            {'GroupName': 'flintrock-' + cluster_name}],
+        tags=[
+            {'Key': 'Name', 'Value': '{c}-{r}'.format(c=cluster_name, r=role)},
+            {'Key': 'flintrock-role', 'Value': role}])
+
+
+def make_instances(num_slaves: int, *, cluster_name: str='test', start: int=0) -> list:
+    return (
+        [make_instance(start, cluster_name=cluster_name, role='master')] +
+        [make_instance(start + n, cluster_name=cluster_name) for n in range(1, num_slaves + 1)])
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    gateway = SimpleNamespace(
+        instances=[],
+        client=SimpleNamespace(
+            describe_subnets=lambda *, SubnetIds: {
+                'Subnets': [{'SubnetId': SubnetIds[0], 'MapPublicIpOnLaunch': True}]}),
+        call=lambda func, *args, **kwargs: func(*args, **kwargs))
+    gateway.get_instances = lambda *, filters: gateway.instances
+    monkeypatch.setattr(flintrock.ec2, 'get_gateway', lambda region: gateway)
+    return gateway
+
+
+def make_cluster(num_slaves: int) -> EC2Cluster:
+    [master_instance, *slave_instances] = make_instances(num_slaves)
+    return EC2Cluster(
+        name='test',
+        region='us-east-1',
+        vpc_id='vpc-1',
+        master_instance=master_instance,
+        slave_instances=slave_instances,
+        storage_dirs=StorageDirs(
+            root='/media/root',
+            ephemeral=['/media/ephemeral0', '/media/ephemeral1'],
+            persistent=None))
+
+
+@pytest.mark.parametrize('num_slaves', CLUSTER_SIZES)
+def test_generate_template_mapping(benchmark, gateway, num_slaves):
+    cluster = make_cluster(num_slaves)
+
+    def generate_template_mapping():
+        # Benchmark building the mapping, not looking it up in the cache.
+        cluster._template_mappings.clear()
+        return cluster.generate_template_mapping(service='spark')
+
+    mapping = benchmark(generate_template_mapping)
+    assert len(mapping['slave_hosts'].splitlines()) == num_slaves
+
+
+@pytest.mark.parametrize('num_slaves', CLUSTER_SIZES)
+def test_get_formatted_template(benchmark, gateway, num_slaves):
+    mapping = make_cluster(num_slaves).generate_template_mapping(service='hadoop')
+    path = os.path.join(THIS_DIR, 'templates', 'hadoop', 'conf', 'slaves')
+
+    slaves = benchmark(get_formatted_template, path=path, mapping=mapping)
+    assert len(slaves.splitlines()) == num_slaves
+
+
+@pytest.mark.parametrize('num_slaves', CLUSTER_SIZES)
+def test_get_cluster_master_slaves(benchmark, num_slaves):
+    instances = make_instances(num_slaves)
+
+    (master, slaves) = benchmark(_get_cluster_master_slaves, instances)
+    assert len(slaves) == num_slaves
+
+
+@pytest.mark.parametrize('num_clusters', [1, 10, 100])
+def test_get_clusters(benchmark, gateway, num_clusters):
+    # 1,000 nodes in all, spread over the clusters.
+    num_slaves = 1000 // num_clusters - 1
+    for c in range(num_clusters):
+        gateway.instances.extend(
+            make_instances(
+                num_slaves,
+                cluster_name='cluster-{c}'.format(c=c),
+                start=c * (num_slaves + 1)))
+
+    clusters = benchmark(get_clusters, region='us-east-1', vpc_id='vpc-1')
+    assert len(clusters) == num_clusters
+
+
+@pytest.mark.parametrize('num_hosts', CLUSTER_SIZES)
+def test_run_asynchronously(benchmark, num_hosts):
+    def noop(*, host):
+        return host
+
+    hosts = ['10.0.{a}.{b}'.format(a=n // 256, b=n % 256) for n in range(num_hosts)]
+    results = benchmark(
+        _run_asynchronously,
+        partial_func=functools.partial(noop),
+        hosts=hosts)
+    assert [result.value for result in results] == hosts
+
+
+def test_manifest_round_trip(benchmark):
+    services = [
+        HDFS(version='2.7.2', download_source='https://example.com/hadoop-{v}.tar.gz'),
+        Spark(version='1.6.1')]
+
+    def round_trip():
+        manifest_raw = json.dumps(
+            {'services': [get_service_manifest(service) for service in services]},
+            indent=4,
+            sort_keys=True)
+        manifest = json.loads(manifest_raw)
+        return [
+            {'HDFS': HDFS, 'Spark': Spark}[service_name](**service_manifest)
+            for [service_name, service_manifest] in manifest['services']]
+
+    assert [s.manifest for s in benchmark(round_trip)] == [s.manifest for s in services]
+
+
+@pytest.mark.parametrize('args', [
+    ['-c', 'import flintrock.flintrock'],
+    ['-m', 'flintrock', '--help'],
+], ids=['import', 'help'])
+def test_cli_startup_time(benchmark, args):
+    env = dict(os.environ, PYTHONPATH=FLINTROCK_ROOT_DIR)
+
+    def run_cli():
+        subprocess.check_call(
+            [sys.executable] + args,
+            env=env,
+            stdout=subprocess.DEVNULL)
+
+    # Each round starts a fresh interpreter, so a few rounds are plenty.
+    benchmark.pedantic(run_cli, rounds=5, warmup_rounds=1)
@@ -0,0 +1,103 @@
+import http.server
+import os
+import shutil
+import threading
+
+# External modules
+import pytest
+
+# Flintrock modules
+from flintrock.build_cache import (
+    BuildCacheError,
+    HTTPBuildCache,
+    LocalBuildCache,
+    S3BuildCache,
+    get_build_cache,
+    get_build_key)
+
+
+class FakeSFTP:
+    """
+    Stands in for an SFTP session by copying files on the local filesystem.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def put(self, *, localpath, remotepath):
+        shutil.copyfile(localpath, remotepath)
+
+    def get(self, *, remotepath, localpath):
+        shutil.copyfile(remotepath, localpath)
+
+
+class FakeSSHClient:
+    def open_sftp(self):
+        return FakeSFTP()
+
+
+class CacheRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    A stand-in for an HTTP build cache. It serves files in the current directory.
+    """
+    def log_message(self, *args):
+        pass
+
+
+def test_get_build_key():
+    key = get_build_key(repository='https://github.com/apache/spark', commit='abc', profile='p')
+    assert key == get_build_key(repository='https://github.com/apache/spark', commit='abc', profile='p')
+    assert key != get_build_key(repository='https://github.com/apache/spark', commit='abd', profile='p')
+    assert len(key) == 64
+
+
+def test_get_build_cache(tmpdir, monkeypatch):
+    assert isinstance(get_build_cache(str(tmpdir)), LocalBuildCache)
+    assert isinstance(get_build_cache('http://localhost:8000/cache'), HTTPBuildCache)
+    assert isinstance(get_build_cache('s3://bucket/spark-builds'), S3BuildCache)
+
+    # Pre-signing URLs needs credentials, but not valid ones.
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'key')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'secret')
+    s3_cache = get_build_cache(
+        's3://bucket/spark-builds',
+        s3_endpoint_url='http://localhost:9000')
+    assert s3_cache.s3.meta.endpoint_url == 'http://localhost:9000'
+    assert s3_cache._get_presigned_url('key', 'get_object').startswith(
+        'http://localhost:9000/bucket/spark-builds/key.tgz?')
+
+    with pytest.raises(BuildCacheError):
+        get_build_cache('ftp://example.com/cache')
+
+
+def test_local_build_cache(tmpdir):
+    cache = LocalBuildCache(str(tmpdir.join('cache')))
+    artifact = tmpdir.join('spark-dist.tgz')
+    artifact.write('build')
+
+    assert not cache.contains('key')
+    cache.store(key='key', ssh_client=FakeSSHClient(), remote_path=str(artifact))
+    assert cache.contains('key')
+    assert os.listdir(cache.directory) == ['key.tgz']
+
+    fetched = tmpdir.join('fetched.tgz')
+    cache.fetch(key='key', ssh_client=FakeSSHClient(), remote_path=str(fetched))
+    assert fetched.read() == 'build'
+
+
+def test_http_build_cache(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    server = http.server.HTTPServer(('127.0.0.1', 0), CacheRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        cache = HTTPBuildCache('http://127.0.0.1:{p}/'.format(p=server.server_port))
+        assert not cache.contains('key')
+        tmpdir.join('key.tgz').write('build')
+        assert cache.contains('key')
+    finally:
+        server.shutdown()
+        server.server_close()
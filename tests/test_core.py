@@ -0,0 +1,175 @@
+import contextlib
+import functools
+import gzip
+import json
+import subprocess
+import threading
+import time
+
+# External modules
+import pytest
+
+# Flintrock modules
+import flintrock.core
+from flintrock.core import (
+    FlintrockCluster,
+    _run_asynchronously,
+    get_bootstrap_script,
+    get_bootstrap_user_data,
+    get_service_manifest,
+    service_is_baked,
+    wait_for_bootstrap)
+from flintrock.exceptions import Error
+from flintrock.services import HDFS, Spark
+
+
+def test_run_asynchronously_results():
+    def double(*, host):
+        return host * 2
+
+    results = _run_asynchronously(
+        partial_func=functools.partial(double),
+        hosts=['a', 'b', 'c'])
+    assert [r.host for r in results] == ['a', 'b', 'c']
+    assert [r.value for r in results] == ['aa', 'bb', 'cc']
+    assert all(r.ok for r in results)
+
+    # The event loop must survive across fan-outs in the same process.
+    results = _run_asynchronously(
+        partial_func=functools.partial(double),
+        hosts=['d'])
+    assert results[0].value == 'dd'
+
+    assert _run_asynchronously(partial_func=functools.partial(double), hosts=[]) == []
+
+
+def test_run_asynchronously_max_parallel():
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def track(*, host):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    _run_asynchronously(
+        partial_func=functools.partial(track),
+        hosts=range(50),
+        max_parallel=4)
+    assert peak[0] <= 4
+
+
+def test_run_asynchronously_error():
+    finished = []
+
+    def fail_on_b(*, host):
+        if host == 'b':
+            raise ValueError(host)
+        time.sleep(0.05)
+        finished.append(host)
+
+    with pytest.raises(ValueError):
+        _run_asynchronously(
+            partial_func=functools.partial(fail_on_b),
+            hosts=['a', 'b', 'c'])
+
+    # We only raise once every host is done.
+    assert sorted(finished) == ['a', 'c']
+
+
+def test_run_asynchronously_lazy_hosts():
+    first_host_done = threading.Event()
+
+    def mark(*, host):
+        if host == 'a':
+            first_host_done.set()
+
+    def slow_hosts():
+        yield 'a'
+        # Work on the first host must start before the next host shows up.
+        assert first_host_done.wait(timeout=5)
+        yield 'b'
+
+    results = _run_asynchronously(
+        partial_func=functools.partial(mark),
+        hosts=slow_hosts())
+    assert [r.host for r in results] == ['a', 'b']
+
+
+def test_service_is_baked():
+    cluster = FlintrockCluster(name='test')
+    spark = Spark(version='1.6.1')
+    assert not service_is_baked(service=spark, cluster=cluster)
+
+    # This is how provision_node() reads what build-image recorded on the image.
+    cluster.baked_services = json.loads(json.dumps(
+        {'services': [get_service_manifest(spark)]}))['services']
+    assert service_is_baked(service=spark, cluster=cluster)
+    # Launch-time options that don't change what gets installed don't matter.
+    assert service_is_baked(
+        service=Spark(version='1.6.1', distribute_artifacts=True),
+        cluster=cluster)
+    assert not service_is_baked(service=Spark(version='2.0.0'), cluster=cluster)
+
+
+def test_get_bootstrap_script():
+    services = [
+        HDFS(version='2.7.2', download_source='https://example.com/hadoop-{v}.tar.gz'),
+        Spark(version='1.6.1'),
+        # Built on the master and distributed from there, so not in the script.
+        Spark(git_commit='abc123', git_repository='https://github.com/apache/spark'),
+    ]
+    script = get_bootstrap_script(services=services, user='ec2-user')
+
+    subprocess.check_output(['bash', '-n'], input=script.encode('utf-8'))
+    assert 'run_step hdfs-install' in script
+    assert 'run_step spark-install' in script
+    assert 'abc123' not in script
+    # HDFS and Spark share the download script, which we only include once.
+    assert script.count('Download a package, like a Hadoop or Spark release') == 1
+
+    user_data = get_bootstrap_user_data(services=services, user='ec2-user')
+    assert gzip.decompress(user_data).decode('utf-8') == script
+
+
+def test_wait_for_bootstrap_timeout(monkeypatch):
+    clock = [0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    monkeypatch.setattr('flintrock.core.time.time', lambda: clock[0])
+    monkeypatch.setattr('flintrock.core.time.sleep', sleep)
+
+    def ssh_check_output(*, client, command):
+        if 'tail' in command:
+            return 'Building Spark...'
+        return json.dumps({'status': 'running', 'step': 'spark-install'})
+
+    monkeypatch.setattr(flintrock.core, 'ssh_check_output', ssh_check_output)
+
+    class SSHClientPool:
+        @contextlib.contextmanager
+        def borrow(self, **kwargs):
+            yield None
+
+    cluster = FlintrockCluster(name='test')
+    cluster.ssh_client_pool = SSHClientPool()
+    cluster.host_is_booted = lambda host: True
+
+    # A node that's stuck on a step doesn't keep us waiting forever.
+    with pytest.raises(Error) as e:
+        wait_for_bootstrap(
+            services=[],
+            user='ec2-user',
+            host='10.0.0.1',
+            identity_file='/dev/null',
+            cluster=cluster,
+            timeout=60)
+    assert 'spark-install' in str(e.value)
+    assert 'Building Spark...' in str(e.value)
+    assert 60 < clock[0] <= 60 + flintrock.core.BOOTSTRAP_POLL_INTERVAL
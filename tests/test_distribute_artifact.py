@@ -0,0 +1,52 @@
+import os
+import socket
+import stat
+import subprocess
+import sys
+
+# Flintrock modules
+from flintrock.core import SCRIPTS_DIR
+
+# Stands in for ssh by running the command locally, with a separate home
+# directory for each host.
+FAKE_SSH = """#!/bin/sh
+while [ "$1" = "-o" ]; do shift 2; done
+host="$1"
+export HOME="{root}/$host"
+mkdir -p "$HOME"
+cd "$HOME"
+exec sh -c "$2"
+"""
+
+
+def test_distribute_artifact(tmpdir):
+    bin_dir = tmpdir.mkdir('bin')
+    fake_ssh = bin_dir.join('ssh')
+    fake_ssh.write(FAKE_SSH.format(root=tmpdir.mkdir('hosts')))
+    fake_ssh.chmod(stat.S_IRWXU)
+
+    artifact = tmpdir.join('artifact.txt')
+    artifact.write('payload')
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    hosts = ['a', 'b', 'c']
+    subprocess.check_call(
+        [
+            sys.executable, os.path.join(SCRIPTS_DIR, 'distribute-artifact.py'),
+            '--source', '127.0.0.1',
+            '--port', str(port),
+            # Peers on one machine can't all serve on the same port, so every
+            # peer fetches from the source here.
+            '--fanout', str(len(hosts)),
+            '--then', 'cp "$ARTIFACT" received.txt',
+            str(artifact)] + hosts,
+        env=dict(os.environ, PATH=str(bin_dir) + os.pathsep + os.environ['PATH']))
+
+    for host in hosts:
+        host_dir = tmpdir.join('hosts', host)
+        assert host_dir.join('received.txt').read() == 'payload'
+        # The peer's copy is cleaned up once everyone has the file.
+        assert not host_dir.join('.flintrock-artifacts').exists()
@@ -0,0 +1,209 @@
+import hashlib
+import http.server
+import importlib.util
+import json
+import os
+import re
+import tarfile
+import threading
+
+# External modules
+import pytest
+
+# Flintrock modules
+from flintrock.core import SCRIPTS_DIR
+
+
+@pytest.fixture(scope='module')
+def download_package():
+    spec = importlib.util.spec_from_file_location(
+        'download_package',
+        os.path.join(SCRIPTS_DIR, 'download-package.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves files in the current directory, with support for Range requests.
+    Every third response gets cut off halfway, like a flaky mirror's would.
+    """
+    responses_sent = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if not match:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        start = int(match.group(1))
+        end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+        body = data[start:end + 1]
+
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {s}-{e}/{t}'.format(s=start, e=end, t=len(data)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        with self.lock:
+            type(self).responses_sent += 1
+            flaky = type(self).responses_sent % 3 == 0
+        self.wfile.write(body[:len(body) // 2] if flaky else body)
+
+    def log_message(self, *args):
+        pass
+
+
+class QuietRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def package(tmpdir, monkeypatch):
+    """
+    Serve a Hadoop-like package from two local mirrors, one that supports
+    Range requests and one that doesn't.
+    """
+    bin_dir = tmpdir.mkdir('package').mkdir('hadoop-2.7.2').mkdir('bin')
+    # Random data doesn't compress, so the package spans many segments.
+    bin_dir.join('hdfs').write_binary(os.urandom(1024 * 1024))
+
+    served_dir = tmpdir.mkdir('served')
+    path = str(served_dir.join('hadoop-2.7.2.tar.gz'))
+    with tarfile.open(path, mode='w:gz') as tar:
+        tar.add(str(tmpdir.join('package', 'hadoop-2.7.2')), arcname='hadoop-2.7.2')
+    with open(path, 'rb') as f:
+        checksum = hashlib.sha512(f.read()).hexdigest()
+
+    monkeypatch.chdir(served_dir)
+    servers = [
+        http.server.HTTPServer(('127.0.0.1', 0), handler)
+        for handler in [RangeRequestHandler, QuietRequestHandler]]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield {
+        'checksum': checksum,
+        'contents': bin_dir.join('hdfs').read_binary(),
+        'range_url': 'http://127.0.0.1:{p}/hadoop-2.7.2.tar.gz'.format(
+            p=servers[0].server_address[1]),
+        'plain_url': 'http://127.0.0.1:{p}/hadoop-2.7.2.tar.gz'.format(
+            p=servers[1].server_address[1]),
+    }
+
+    for server in servers:
+        server.shutdown()
+
+
+def test_parse_sha512(download_package):
+    checksum = hashlib.sha512(b'hadoop').hexdigest()
+
+    # The format of newer releases.
+    assert download_package.parse_sha512(
+        'SHA512 (hadoop-3.0.0.tar.gz) = {c}\n'.format(c=checksum)) == checksum
+
+    # The format of older releases, where the checksum is split into groups
+    # and listed along with other digests.
+    groups = [checksum[i:i + 8].upper() for i in range(0, 128, 8)]
+    mds = (
+        'hadoop-2.7.2.tar.gz:    MD5 = 6C B1 D7 E2 EC 73 EC F0  '
+        '5A 44 33 8C 3E 77 2B 2F\n'
+        'hadoop-2.7.2.tar.gz: SHA512 = {first}\n'
+        '                              {second}\n'
+        'hadoop-2.7.2.tar.gz: SHA256 = {sha256}\n').format(
+            first=' '.join(groups[:8]),
+            second=' '.join(groups[8:]),
+            sha256=hashlib.sha256(b'hadoop').hexdigest())
+    assert download_package.parse_sha512(mds) == checksum
+
+    assert download_package.parse_sha512('Not Found') is None
+
+
+def test_get_published_sha512(download_package, package, tmpdir):
+    served_dir = tmpdir.join('served')
+    served_dir.join('hadoop-2.7.2.tar.gz.sha').write('<html>Not Found</html>')
+    served_dir.join('hadoop-2.7.2.tar.gz.sha512').write(
+        '{c}  hadoop-2.7.2.tar.gz\n'.format(c=package['checksum']))
+
+    # We skip digest files that we can't get or that have no SHA-512.
+    digest_urls = [
+        package['plain_url'] + '.missing',
+        package['plain_url'] + '.sha',
+        package['plain_url'] + '.sha512',
+    ]
+    assert download_package.get_published_sha512(digest_urls) == package['checksum']
+    assert download_package.get_published_sha512(digest_urls[:2]) is None
+
+
+def test_get_candidate_urls(download_package, package, tmpdir):
+    mirror_url = package['plain_url'].rsplit('/', 1)[0]
+    tmpdir.join('served').mkdir('closer.lua').join('hadoop-2.7.2.tar.gz').write(
+        json.dumps({
+            'preferred': mirror_url + '/',
+            'http': [mirror_url + '/', 'http://mirror.example.com/apache/'],
+            'backup': ['http://backup.example.com/apache/'],
+            'path_info': 'hadoop-2.7.2.tar.gz',
+        }))
+
+    assert download_package.get_candidate_urls([
+        mirror_url + '/closer.lua/hadoop-2.7.2.tar.gz?as_json',
+        package['range_url'],
+    ]) == [
+        package['plain_url'],
+        'http://mirror.example.com/apache/hadoop-2.7.2.tar.gz',
+        'http://backup.example.com/apache/hadoop-2.7.2.tar.gz',
+        'https://archive.apache.org/dist/hadoop-2.7.2.tar.gz',
+        package['range_url'],
+    ]
+
+
+def test_download_in_segments(download_package, package, tmpdir, monkeypatch):
+    monkeypatch.setattr(download_package.time, 'sleep', lambda seconds: None)
+
+    mirrors = download_package.rank_mirrors([
+        package['range_url'],
+        package['range_url'].replace('hadoop-2.7.2', 'missing'),
+    ])
+    assert len(mirrors) == 1
+    assert mirrors[0].supports_ranges
+    assert mirrors[0].size == os.path.getsize(str(tmpdir.join('served', 'hadoop-2.7.2.tar.gz')))
+
+    checksum = download_package.download(
+        mirrors=mirrors,
+        output=None,
+        extract_to=str(tmpdir.join('hadoop')),
+        parallel=4,
+        segment_size=64 * 1024)
+
+    assert checksum == package['checksum']
+    assert tmpdir.join('hadoop', 'bin', 'hdfs').read_binary() == package['contents']
+
+
+def test_download_without_ranges(download_package, package, tmpdir):
+    mirrors = download_package.rank_mirrors([package['plain_url']])
+    assert not mirrors[0].supports_ranges
+
+    output = str(tmpdir.join('hadoop-2.7.2.tar.gz'))
+    checksum = download_package.download(
+        mirrors=mirrors,
+        output=output,
+        extract_to=None,
+        parallel=4,
+        segment_size=64 * 1024)
+
+    assert checksum == package['checksum']
+    with open(output, 'rb') as f:
+        assert hashlib.sha512(f.read()).hexdigest() == package['checksum']
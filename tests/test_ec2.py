@@ -0,0 +1,254 @@
+import functools
+from types import SimpleNamespace
+
+# External modules
+import botocore
+
+# Flintrock modules
+import flintrock.ec2
+from flintrock.ec2 import EC2Cluster
+from flintrock.ec2_gateway import EC2Gateway
+from flintrock.state_cache import StateCache
+
+
+def make_instance(n: int):
+    return SimpleNamespace(
+        id='i-{n}'.format(n=n),
+        subnet_id='subnet-1',
+        public_ip_address='54.0.0.{n}'.format(n=n),
+        public_dns_name='ec2-{n}.example.com'.format(n=n),
+        private_ip_address='10.0.0.{n}'.format(n=n),
+        private_dns_name='ip-{n}.internal'.format(n=n))
+
+
+def test_cluster_metadata_snapshot(monkeypatch):
+    subnet_lookups = []
+
+    def describe_subnets(*, SubnetIds):
+        subnet_lookups.extend(SubnetIds)
+        return {'Subnets': [{'SubnetId': SubnetIds[0], 'MapPublicIpOnLaunch': True}]}
+
+    gateway = SimpleNamespace(
+        client=SimpleNamespace(describe_subnets=describe_subnets),
+        call=lambda func, *args, **kwargs: func(*args, **kwargs))
+    monkeypatch.setattr(flintrock.ec2, 'get_gateway', lambda region: gateway)
+
+    cluster = EC2Cluster(
+        name='test',
+        region='us-east-1',
+        vpc_id='vpc-1',
+        master_instance=make_instance(1),
+        slave_instances=[make_instance(2), make_instance(3)])
+
+    for _ in range(3):
+        assert cluster.master_ip == '54.0.0.1'
+        assert cluster.slave_hosts == ['ec2-2.example.com', 'ec2-3.example.com']
+    assert subnet_lookups == ['subnet-1']
+
+    cluster.slave_instances = cluster.slave_instances[:1]
+    assert len(cluster.slave_ips) == 2
+
+    cluster.invalidate_metadata()
+    assert cluster.slave_ips == ['54.0.0.2']
+    assert subnet_lookups == ['subnet-1']
+
+
+def test_destroy(monkeypatch, tmpdir):
+    monkeypatch.setattr('flintrock.ec2.time.sleep', lambda seconds: None)
+    monkeypatch.setattr('flintrock.ec2.TERMINATE_BATCH_SIZE', 2)
+    monkeypatch.setattr('flintrock.ec2.DEFAULT_MAX_PARALLEL_CALLS', 2)
+
+    detached = []
+    terminated = []
+    delete_attempts = []
+
+    def delete_security_group(*, GroupId):
+        delete_attempts.append(GroupId)
+        if len(delete_attempts) < 3:
+            raise botocore.exceptions.ClientError(
+                error_response={'Error': {'Code': 'DependencyViolation', 'Message': ''}},
+                operation_name='DeleteSecurityGroup')
+
+    gateway = SimpleNamespace(
+        client=SimpleNamespace(
+            modify_instance_attribute=lambda *, InstanceId, Groups: detached.append(InstanceId),
+            terminate_instances=lambda *, InstanceIds: terminated.append(InstanceIds),
+            delete_security_group=delete_security_group),
+        call=lambda func, *args, **kwargs: func(*args, **kwargs),
+        get_security_group=lambda *, name, vpc_id: SimpleNamespace(id='sg-' + name, group_name=name))
+    gateway.map = functools.partial(EC2Gateway.map, gateway)
+    monkeypatch.setattr(flintrock.ec2, 'get_gateway', lambda region: gateway)
+
+    cluster = EC2Cluster(
+        name='test',
+        region='us-east-1',
+        vpc_id='vpc-1',
+        master_instance=make_instance(1),
+        slave_instances=[make_instance(n) for n in range(2, 6)])
+    cluster.destroy()
+
+    assert sorted(detached) == ['i-1', 'i-2', 'i-3', 'i-4', 'i-5']
+    assert sorted(len(batch) for batch in terminated) == [1, 2, 2]
+    assert sorted(sum(terminated, [])) == sorted(detached)
+    assert delete_attempts == ['sg-flintrock-test'] * 3
+
+    # With a state cache, we leave the group for later instead of waiting.
+    del delete_attempts[:]
+    state_cache = StateCache(str(tmpdir.join('state.db')))
+    cluster.destroy(state_cache=state_cache)
+    assert delete_attempts == ['sg-flintrock-test']
+    pending_groups = functools.partial(
+        state_cache.get_pending_security_groups,
+        provider='ec2',
+        region='us-east-1')
+    assert pending_groups() == {'sg-flintrock-test': 'flintrock-test'}
+
+    flintrock.ec2.delete_pending_security_groups(region='us-east-1', state_cache=state_cache)
+    assert pending_groups() == {'sg-flintrock-test': 'flintrock-test'}
+    flintrock.ec2.delete_pending_security_groups(region='us-east-1', state_cache=state_cache)
+    assert pending_groups() == {}
+    assert delete_attempts == ['sg-flintrock-test'] * 3
+
+
+def test_delete_pending_security_groups_errors(monkeypatch, tmpdir, capsys):
+    def delete_security_group(*, GroupId):
+        raise botocore.exceptions.ClientError(
+            error_response={'Error': {'Code': 'UnauthorizedOperation', 'Message': ''}},
+            operation_name='DeleteSecurityGroup')
+
+    gateway = SimpleNamespace(
+        client=SimpleNamespace(delete_security_group=delete_security_group),
+        call=lambda func, *args, **kwargs: func(*args, **kwargs))
+    monkeypatch.setattr(flintrock.ec2, 'get_gateway', lambda region: gateway)
+
+    state_cache = StateCache(str(tmpdir.join('state.db')))
+    state_cache.add_pending_security_group(
+        provider='ec2',
+        region='us-east-1',
+        group_id='sg-1',
+        group_name='flintrock-old')
+
+    # Leftovers from an earlier destroy must not fail the command at hand.
+    flintrock.ec2.delete_pending_security_groups(region='us-east-1', state_cache=state_cache)
+    assert 'flintrock-old' in capsys.readouterr().err
+    assert state_cache.get_pending_security_groups(provider='ec2', region='us-east-1') == {
+        'sg-1': 'flintrock-old'}
+
+
+def test_get_clusters_from_state_cache(monkeypatch, tmpdir, capsys):
+    def make_cluster_instance(n: int, role: str):
+        instance = make_instance(n)
+        instance.state = {'Name': 'running'}
+        instance.security_groups = [{'GroupName': 'flintrock'}, {'GroupName': 'flintrock-test'}]
+        instance.tags = [{'Key': 'flintrock-role', 'Value': role}]
+        return instance
+
+    ec2_calls = []
+
+    def get_instances(*, filters):
+        ec2_calls.append('DescribeInstances')
+        return [make_cluster_instance(1, 'master'), make_cluster_instance(2, 'slave')]
+
+    def describe_subnets(*, SubnetIds):
+        ec2_calls.append('DescribeSubnets')
+        return {'Subnets': [{'SubnetId': SubnetIds[0], 'MapPublicIpOnLaunch': True}]}
+
+    gateway = SimpleNamespace(
+        get_instances=get_instances,
+        client=SimpleNamespace(describe_subnets=describe_subnets),
+        call=lambda func, *args, **kwargs: func(*args, **kwargs))
+    monkeypatch.setattr(flintrock.ec2, 'get_gateway', lambda region: gateway)
+
+    state_cache = StateCache(str(tmpdir.join('state.db')))
+    lookup = functools.partial(
+        flintrock.ec2.get_cluster,
+        cluster_name='test',
+        region='us-east-1',
+        vpc_id='vpc-1',
+        state_cache=state_cache)
+
+    cluster = lookup()
+    assert cluster.master_ip == '54.0.0.1'
+    assert ec2_calls == ['DescribeInstances', 'DescribeSubnets']
+    assert cluster.service_manifests is None
+
+    cached_cluster = lookup()
+    assert cached_cluster.state == 'running'
+    assert cached_cluster.master_ip == '54.0.0.1'
+    assert cached_cluster.slave_hosts == ['ec2-2.example.com']
+    assert not cached_cluster.subnet_is_private
+    assert ec2_calls == ['DescribeInstances', 'DescribeSubnets']
+
+    class Spark:
+        manifest = {'version': '2.0.0', 'download_source': ''}
+
+    flintrock.ec2.cache_cluster(
+        cluster,
+        state_cache=state_cache,
+        vpc_id='vpc-1',
+        services=[Spark()])
+    cached_cluster = lookup()
+    assert cached_cluster.service_manifests == [
+        ['Spark', {'version': '2.0.0', 'download_source': ''}]]
+    capsys.readouterr()
+    cached_cluster.print()
+    assert '  services:\n    - Spark 2.0.0\n' in capsys.readouterr().out
+    assert ec2_calls == ['DescribeInstances', 'DescribeSubnets']
+
+    lookup(max_age=0)
+    assert ec2_calls.count('DescribeInstances') == 2
+
+
+def test_build_image(monkeypatch):
+    monkeypatch.setattr('flintrock.ec2.time.sleep', lambda seconds: None)
+
+    def make_builder_instance(state: str):
+        instance = make_instance(1)
+        instance.state = {'Name': state}
+        instance.tags = [{'Key': 'flintrock-role', 'Value': 'master'}]
+        return instance
+
+    gateway = SimpleNamespace(
+        get_instances=lambda *, instance_ids: [make_builder_instance('running')],
+        client=SimpleNamespace(
+            describe_subnets=lambda *, SubnetIds: {
+                'Subnets': [{'SubnetId': SubnetIds[0], 'MapPublicIpOnLaunch': True}]},
+            create_image=lambda *, InstanceId, Name, Description: {'ImageId': 'ami-baked'},
+            create_tags=lambda *, Resources, Tags: None,
+            describe_images=lambda *, ImageIds: {
+                'Images': [{'ImageId': ImageIds[0], 'State': 'available'}]}),
+        call=lambda func, *args, **kwargs: func(*args, **kwargs))
+    monkeypatch.setattr(flintrock.ec2, 'get_gateway', lambda region: gateway)
+
+    builder = EC2Cluster(
+        name='image-builder',
+        region='us-east-1',
+        vpc_id='vpc-1',
+        master_instance=make_builder_instance('pending'),
+        slave_instances=[])
+    monkeypatch.setattr(flintrock.ec2, 'launch', lambda **kwargs: builder)
+    monkeypatch.setattr(builder, 'destroy', lambda: None)
+
+    baked_hosts = []
+    monkeypatch.setattr(
+        flintrock.ec2, 'bake_node',
+        lambda *, services, user, host, identity_file, cluster: baked_hosts.append(host))
+
+    image_id = flintrock.ec2.build_image(
+        image_name='test-image',
+        services=[],
+        assume_yes=True,
+        key_name='key',
+        identity_file='/dev/null',
+        instance_type='m3.medium',
+        region='us-east-1',
+        availability_zone='',
+        ami='ami-base',
+        user='ec2-user',
+        vpc_id='vpc-1',
+        subnet_id='subnet-1',
+        instance_profile_name='')
+
+    assert image_id == 'ami-baked'
+    assert baked_hosts == ['54.0.0.1']
+    assert builder.slave_instances == []
@@ -0,0 +1,72 @@
+import threading
+
+# External modules
+import botocore
+import pytest
+
+# Flintrock modules
+from flintrock.ec2_gateway import AdaptiveRateLimiter, EC2Gateway
+
+
+def client_error(code: str) -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        error_response={'Error': {'Code': code, 'Message': code}},
+        operation_name='DescribeInstances')
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    monkeypatch.setattr('flintrock.ec2_gateway.time.sleep', lambda seconds: None)
+    return EC2Gateway('us-east-1')
+
+
+def test_rate_limiter_adapts():
+    limiter = AdaptiveRateLimiter(rate=8, min_rate=1, max_rate=10)
+
+    limiter.on_throttle()
+    assert limiter.rate == 4
+    for _ in range(10):
+        limiter.on_throttle()
+    assert limiter.rate == 1
+
+    for _ in range(200):
+        limiter.on_success()
+    assert limiter.rate == 10
+
+
+def test_call_retries_throttling(gateway):
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise client_error('RequestLimitExceeded')
+        return 'done'
+
+    assert gateway.call(flaky) == 'done'
+    assert len(attempts) == 3
+
+    def broken():
+        raise client_error('InvalidInstanceID.NotFound')
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        gateway.call(broken)
+
+
+def test_map(gateway):
+    lock = threading.Lock()
+    seen = []
+
+    def record(item):
+        with lock:
+            seen.append(item)
+        if item == 3:
+            raise client_error('InvalidInstanceID.NotFound')
+        return item * 2
+
+    assert gateway.map(record, [1, 2]) == [2, 4]
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        gateway.map(record, list(range(10)))
+    # Every call runs, even when one of them fails.
+    assert sorted(seen) == sorted([1, 2] + list(range(10)))
@@ -1,3 +1,7 @@
+import os
+import subprocess
+import sys
+
 # External modules
 import pytest
 
@@ -138,3 +142,19 @@ def test_get_latest_commit():
 
     with pytest.raises(Exception):
         get_latest_commit("https://github.com/apache/nonexistent-repo")
+
+
+def test_cli_imports_providers_lazily():
+    """
+    boto3 and Paramiko are slow to import, so the CLI shouldn't import them
+    until a command needs them.
+    """
+    flintrock_root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    output = subprocess.check_output(
+        [
+            sys.executable, '-c',
+            'import sys; import flintrock.flintrock; print(" ".join(sys.modules))'],
+        env=dict(os.environ, PYTHONPATH=flintrock_root_dir),
+        universal_newlines=True)
+    modules = {module.split('.')[0] for module in output.split()}
+    assert not modules & {'boto3', 'botocore', 'paramiko'}
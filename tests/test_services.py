@@ -0,0 +1,57 @@
+import base64
+import io
+import tarfile
+import urllib.error
+
+# External modules
+import pytest
+
+# Flintrock modules
+from flintrock.exceptions import ServiceNotReady
+from flintrock.services import FlintrockService, get_config_archive
+
+
+def test_get_config_archive():
+    mapping = {
+        'master_ip': '10.0.0.1',
+        'master_host': 'master.example.com',
+        'slave_ips': '10.0.0.2\n10.0.0.3',
+        'slave_hosts': 'slave1.example.com\nslave2.example.com',
+        'root_dir': '/media/root/spark',
+        'ephemeral_dirs': '',
+        'root_ephemeral_dirs': '/media/root/spark',
+    }
+
+    archive = get_config_archive(template_dir='spark/conf', mapping=mapping)
+    assert get_config_archive(template_dir='spark/conf', mapping=dict(mapping)) is archive
+
+    with tarfile.open(fileobj=io.BytesIO(base64.b64decode(archive)), mode='r:gz') as tar:
+        assert sorted(tar.getnames()) == ['spark/conf/slaves', 'spark/conf/spark-env.sh']
+        slaves = tar.extractfile('spark/conf/slaves').read().decode('utf-8')
+
+    assert slaves.split() == ['slave1.example.com', 'slave2.example.com']
+
+
+class FakeService(FlintrockService):
+    def __init__(self, registered_slaves):
+        self.registered_slaves = list(registered_slaves)
+
+    def is_ready(self, master_host: str, num_slaves: int) -> bool:
+        registered = self.registered_slaves.pop(0)
+        if registered is None:
+            raise urllib.error.URLError('connection refused')
+        return registered >= num_slaves
+
+
+def test_wait_for_ready(monkeypatch):
+    monkeypatch.setattr('flintrock.services.time.sleep', lambda seconds: None)
+
+    service = FakeService([None, 1, 2])
+    service.wait_for_ready(master_host='master', num_slaves=2)
+    assert service.registered_slaves == []
+
+    with pytest.raises(ServiceNotReady):
+        FakeService([None] * 100).wait_for_ready(
+            master_host='master',
+            num_slaves=2,
+            timeout=0)
@@ -0,0 +1,62 @@
+import json
+
+# External modules
+import pytest
+
+# Flintrock modules
+from flintrock.core import provision_cluster
+from flintrock.exceptions import SSHError
+
+from simulator import SimulatedCluster, SimulatedNetwork, SimulatedService, SimulationConfig
+
+
+def test_simulated_cluster(tmpdir):
+    network = SimulatedNetwork(
+        SimulationConfig(latency=0.001, boot_time=(0, 0.2), connect_failure_rate=0.2, seed=0))
+    cluster = SimulatedCluster(name='simulated', num_slaves=49, network=network)
+    hosts = [cluster.master_ip] + cluster.slave_ips
+    assert len(set(hosts)) == 50
+
+    provision_cluster(
+        cluster=cluster,
+        services=[SimulatedService()],
+        user='ec2-user',
+        identity_file='/dev/null',
+        max_parallel=16)
+    manifest = json.loads(
+        network.hosts[cluster.master_ip].files['/home/ec2-user/.flintrock-manifest.json'])
+    assert manifest == {'services': [['SimulatedService', {'steps': 2}]]}
+
+    cluster.start(user='ec2-user', identity_file='/dev/null', max_parallel=16)
+
+    cluster.run_command(
+        master_only=False,
+        user='ec2-user',
+        identity_file='/dev/null',
+        command=('true',),
+        max_parallel=16)
+
+    local_file = tmpdir.join('file.txt')
+    local_file.write('simulated')
+    cluster.copy_file(
+        master_only=False,
+        user='ec2-user',
+        identity_file='/dev/null',
+        local_path=str(local_file),
+        remote_path='/home/ec2-user/file.txt',
+        max_parallel=16)
+    assert all(
+        network.hosts[host].files['/home/ec2-user/file.txt'] == '<9 bytes>'
+        for host in hosts)
+
+
+def test_simulated_command_failure():
+    network = SimulatedNetwork(SimulationConfig(latency=0, command_failure_rate=1))
+    cluster = SimulatedCluster(name='simulated', num_slaves=2, network=network)
+
+    with pytest.raises(SSHError):
+        cluster.run_command(
+            master_only=False,
+            user='ec2-user',
+            identity_file='/dev/null',
+            command=('true',))
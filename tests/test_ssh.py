@@ -0,0 +1,145 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+
+# External modules
+import pytest
+
+# Flintrock modules
+from flintrock.exceptions import SSHError
+from flintrock.ssh import SCRIPTS_DIR, SSHClientPool, get_ssh_client
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+        self.keepalive = None
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+
+class FakeClient:
+    def __init__(self, host):
+        self.host = host
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+        self.transport.active = False
+
+
+def test_ssh_client_pool_reuses_clients():
+    connections = []
+
+    def connect(*, user, host, identity_file, **kwargs):
+        client = FakeClient(host)
+        connections.append(client)
+        return client
+
+    pool = SSHClientPool(connect=connect, keepalive_interval=10)
+
+    with pool.borrow(user='u', host='h1', identity_file='k', wait=True) as client1:
+        assert client1.transport.keepalive == 10
+    with pool.borrow(user='u', host='h1', identity_file='k') as client2:
+        assert client2 is client1
+    with pool.borrow(user='u', host='h2', identity_file='k') as client3:
+        assert client3 is not client1
+    assert len(connections) == 2
+
+    # Dead connections get replaced.
+    client1.transport.active = False
+    with pool.borrow(user='u', host='h1', identity_file='k') as client4:
+        assert client4 is not client1
+    assert len(connections) == 3
+
+    pool.close()
+    assert all(c.closed for c in connections)
+
+
+def test_ssh_client_pool_evicts_idle_clients():
+    pool = SSHClientPool(
+        connect=lambda **kwargs: FakeClient(kwargs['host']),
+        max_idle=0)
+
+    with pool.borrow(user='u', host='h1', identity_file='k') as client1:
+        # Clients that are lent out are never evicted.
+        with pool.borrow(user='u', host='h2', identity_file='k'):
+            pass
+        assert not client1.closed
+
+    with pool.borrow(user='u', host='h2', identity_file='k'):
+        assert client1.closed
+
+
+def test_remote_agent_script():
+    p = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPTS_DIR, 'remote-agent.py')],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        universal_newlines=True)
+    assert json.loads(p.stdout.readline()) == {'ready': True}
+
+    p.stdin.write(json.dumps([
+        {'command': 'echo one'},
+        {'command': 'cat', 'input': 'two'},
+        {'command': 'exit 3'},
+        {'command': 'echo never'}]) + '\n')
+    p.stdin.write(json.dumps([{'command': 'echo three'}]) + '\n')
+    p.stdin.close()
+
+    reports = [json.loads(line) for line in p.stdout]
+    assert p.wait() == 0
+    assert [r['stdout'] for r in reports] == ['one\n', 'two', '', 'three\n']
+    assert [r['exit_status'] for r in reports] == [0, 0, 3, 0]
+
+
+def test_get_ssh_client_deadline(monkeypatch):
+    clock = [0]
+    sleeps = []
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr('flintrock.ssh.time.time', lambda: clock[0])
+    monkeypatch.setattr('flintrock.ssh.time.sleep', fake_sleep)
+
+    # Bind a port without listening on it, so connections to it are refused.
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        host, port = sock.getsockname()
+        monkeypatch.setattr(
+            'paramiko.client.SSHClient.connect',
+            lambda self, **kwargs: socket.create_connection((host, port)))
+
+        with pytest.raises(SSHError):
+            get_ssh_client(
+                user='user',
+                host=host,
+                identity_file=None,
+                wait=True,
+                timeout=0)
+
+        checks = []
+        with pytest.raises(SSHError):
+            get_ssh_client(
+                user='user',
+                host=host,
+                identity_file=None,
+                wait=True,
+                timeout=60,
+                is_booted=lambda: checks.append(1) and False)
+
+    assert len(checks) > 1
+    # Backoff is jittered, but capped.
+    assert all(0 <= s <= 30 for s in sleeps)
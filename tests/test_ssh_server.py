@@ -0,0 +1,55 @@
+import json
+import os
+
+# Flintrock modules
+from flintrock.core import provision_cluster
+from flintrock.ssh import ssh_check_output, ssh_check_steps
+
+from simulator import SimulatedService
+from ssh_server import LocalCluster
+
+
+def test_ssh_client(local_ssh_servers):
+    servers = local_ssh_servers(1)
+    [address] = servers.addresses
+    server = servers.servers[address]
+
+    client = servers.connect(user='ec2-user', host=address, identity_file=servers.identity_file)
+    try:
+        assert ssh_check_output(client=client, command='echo "$HOME"') == server.sandbox
+        [result] = ssh_check_steps(client=client, steps=['pwd'])
+        assert result.output == server.sandbox
+        with client.open_sftp() as sftp:
+            with sftp.open('/home/ec2-user/file.txt', 'w') as f:
+                f.write('sandboxed')
+        assert ssh_check_output(client=client, command='cat /home/ec2-user/file.txt') == 'sandboxed'
+    finally:
+        client.close()
+    assert server.commands_run == 3
+
+
+def test_local_cluster(local_ssh_servers, tmpdir):
+    servers = local_ssh_servers(4)
+    cluster = LocalCluster(name='local', servers=servers)
+    common = {'user': 'ec2-user', 'identity_file': servers.identity_file}
+
+    provision_cluster(cluster=cluster, services=[SimulatedService()], **common)
+    master_sandbox = servers.servers[cluster.master_ip].sandbox
+    with open(os.path.join(master_sandbox, '.flintrock-manifest.json')) as f:
+        assert json.load(f) == {'services': [['SimulatedService', {'steps': 2}]]}
+
+    cluster.start(**common)
+    cluster.run_command(master_only=False, command=('touch', 'ran'), **common)
+
+    local_file = tmpdir.join('file.txt')
+    local_file.write('local')
+    cluster.copy_file(
+        master_only=False,
+        local_path=str(local_file),
+        remote_path='/home/ec2-user/file.txt',
+        **common)
+
+    for server in servers.servers.values():
+        assert os.path.exists(os.path.join(server.sandbox, 'ran'))
+        with open(os.path.join(server.sandbox, 'file.txt')) as f:
+            assert f.read() == 'local'
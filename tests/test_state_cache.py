@@ -0,0 +1,52 @@
+import time
+
+# Flintrock modules
+from flintrock.state_cache import StateCache
+
+SCOPE = {'provider': 'ec2', 'region': 'us-east-1', 'vpc_id': ''}
+
+
+def test_cluster_entries(tmpdir):
+    cache = StateCache(str(tmpdir.join('state.db')))
+    assert cache.get_cluster(name='spark', **SCOPE) is None
+
+    cache.put_cluster(name='spark', entry={'state': 'running'}, manifest=[['Spark', {}]], **SCOPE)
+    assert cache.get_cluster(name='spark', **SCOPE) == {
+        'state': 'running',
+        'manifest': [['Spark', {}]]}
+    assert cache.get_cluster(name='spark', provider='ec2', region='us-west-2', vpc_id='') is None
+
+    # We keep the manifest we have unless we get a new one.
+    cache.put_cluster(name='spark', entry={'state': 'stopped'}, **SCOPE)
+    assert cache.get_cluster(name='spark', **SCOPE)['manifest'] == [['Spark', {}]]
+
+    time.sleep(0.01)
+    assert cache.get_cluster(name='spark', max_age=0.005, **SCOPE) is None
+
+    cache.delete_cluster(name='spark', **SCOPE)
+    assert cache.get_cluster(name='spark', **SCOPE) is None
+
+
+def test_listings(tmpdir):
+    cache = StateCache(str(tmpdir.join('state.db')))
+    cache.put_cluster(name='old', entry={}, **SCOPE)
+    # We don't know about every cluster until we've listed them all.
+    assert cache.get_clusters(**SCOPE) is None
+
+    cache.put_clusters(entries={'a': {}, 'b': {}}, complete=True, **SCOPE)
+    cache.put_cluster(name='c', entry={}, **SCOPE)
+    assert sorted(cache.get_clusters(**SCOPE)) == ['a', 'b', 'c']
+
+    time.sleep(0.01)
+    cache.put_cluster(name='c', entry={}, **SCOPE)
+    assert cache.get_clusters(max_age=0.005, **SCOPE) is None
+
+
+def test_unusable_cache(tmpdir, capsys):
+    path = tmpdir.join('state.db')
+    path.write('not a database')
+    cache = StateCache(str(path))
+
+    cache.put_cluster(name='spark', entry={}, **SCOPE)
+    assert cache.get_cluster(name='spark', **SCOPE) is None
+    assert 'Could not use the cluster state cache' in capsys.readouterr().err
@@ -0,0 +1,51 @@
+import json
+
+# External modules
+import pytest
+
+# Flintrock modules
+from flintrock import tracing
+
+
+@pytest.fixture
+def trace(monkeypatch):
+    monkeypatch.setattr(tracing, '_enabled', False)
+    monkeypatch.setattr(tracing, '_events', [])
+    monkeypatch.setattr(tracing, '_rows', {})
+
+
+def test_spans_are_off_by_default(trace):
+    with tracing.span('provision_node', host='10.0.0.1'):
+        pass
+    assert tracing._events == []
+
+
+def test_write_trace(trace, tmpdir):
+    tracing.enable()
+
+    with tracing.span('provision'):
+        with tracing.span('provision_node', host='10.0.0.1'):
+            pass
+        tracing.add_span('spark-install', start=1000.0, duration=2.5, host='10.0.0.1')
+        with pytest.raises(ValueError):
+            with tracing.span('provision_node', host='10.0.0.2'):
+                raise ValueError
+
+    path = str(tmpdir.join('trace.json'))
+    tracing.write_trace(path)
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+
+    rows = {e['args']['name']: e['tid'] for e in events if e['ph'] == 'M'}
+    assert sorted(rows) == ['10.0.0.1', '10.0.0.2', 'flintrock']
+
+    spans = [e for e in events if e['ph'] == 'X']
+    assert [(e['name'], e['tid']) for e in spans] == [
+        ('provision_node', rows['10.0.0.1']),
+        ('spark-install', rows['10.0.0.1']),
+        ('provision_node', rows['10.0.0.2']),
+        ('provision', rows['flintrock']),
+    ]
+    assert spans[1]['ts'] == 1000000000
+    assert spans[1]['dur'] == 2500000
+    assert spans[2]['args'] == {'error': 'ValueError'}